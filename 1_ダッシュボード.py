@@ -1,8 +1,9 @@
 import streamlit as st
 from datetime import datetime, timedelta
 from backend import (
-    init_database, load_embedding_model, get_db_connection,
-    hide_match, load_app_config, get_all_users, convert_to_jst_str
+    init_database, load_embedding_model,
+    hide_match, load_app_config, get_all_users, convert_to_jst_str,
+    get_dashboard_match_page, count_dashboard_matches
 )
 import os
 import ui_components as ui  # ← 1. 新しいファイルをインポート
@@ -107,201 +108,122 @@ show_hidden_filter = st.sidebar.checkbox("非表示も表示する", value=False
 
 st.header("最新マッチング結果一覧")
 
-# --- DBからフィルタリングされた結果を取得 ---
-conn = get_db_connection()
-
-# ▼▼▼【SQLクエリの確認・修正】▼▼▼
-# COALESCE を使って、担当者がNULLの場合に「未担当」を返すようにする
-query = '''
-    SELECT 
-        r.id as res_id, r.job_id, j.document as job_doc, j.project_name, j.is_hidden as job_is_hidden,
-        r.engineer_id, e.document as eng_doc, e.name as engineer_name, e.is_hidden as engineer_is_hidden,
-        r.score, r.created_at, r.is_hidden as match_is_hidden, r.grade, r.status,
-        COALESCE(job_user.username, '未割当') as job_assignee,
-        COALESCE(eng_user.username, '未割当') as engineer_assignee,
-        CASE 
-            WHEN r.feedback_status IS NOT NULL AND r.feedback_status != '' THEN true
-            ELSE false
-        END AS has_feedback
-    FROM matching_results r
-    JOIN jobs j ON r.job_id = j.id
-    JOIN engineers e ON r.engineer_id = e.id
-    LEFT JOIN users job_user ON j.assigned_user_id = job_user.id
-    LEFT JOIN users eng_user ON e.assigned_user_id = eng_user.id
-'''
-# ▲▲▲【SQLクエリここまで】▲▲▲
-
-
-params = []
-where_clauses = []
-
-if job_assignee_filter != "すべて":
-    where_clauses.append("job_user.username = %s")
-    params.append(job_assignee_filter)
-
-if engineer_assignee_filter != "すべて":
-    where_clauses.append("eng_user.username = %s")
-    params.append(engineer_assignee_filter)
-
-if selected_statuses:
-    where_clauses.append("r.status = ANY(%s)")
-    params.append(list(selected_statuses))
-
-if selected_grades:
-    where_clauses.append("r.grade = ANY(%s)")
-    params.append(list(selected_grades))
-
-if keyword_filter: 
-    where_clauses.append("(j.document ILIKE %s OR e.document ILIKE %s OR j.project_name ILIKE %s OR e.name ILIKE %s OR job_user.username ILIKE %s OR eng_user.username ILIKE %s OR r.status ILIKE %s)")
-    keyword_param = f'%{keyword_filter}%'
-    params.extend([keyword_param] * 7)
-
-if not show_hidden_filter:
-    where_clauses.append("((r.is_hidden = 0 OR r.is_hidden IS NULL) AND j.is_hidden = 0 AND e.is_hidden = 0)")
-
-if where_clauses:
-    query += " WHERE " + " AND ".join(where_clauses)
-
-query += """ ORDER BY
-            CASE r.grade
-                WHEN 'S' THEN 1
-                WHEN 'A' THEN 2
-                WHEN 'B' THEN 3
-                WHEN 'C' THEN 4
-                WHEN 'D' THEN 5
-                ELSE 6
-            END ASC,
-            r.created_at DESC
-"""
-
-with conn.cursor() as cursor:
-    cursor.execute(query, tuple(params))
-    results = cursor.fetchall()
-conn.close()
-
-# --- 結果のフィルタリング (国籍) ---
-if not results:
+# --- DBからフィルタリングされた結果を1ページずつ取得 ---
+# 絞り込み（国籍のルールを含む）と並び替えは SQL で行い、表示する件数分だけを読む（backend.get_dashboard_match_page）
+dashboard_filters = {
+    "job_assignee": job_assignee_filter,
+    "engineer_assignee": engineer_assignee_filter,
+    "statuses": selected_statuses,
+    "grades": selected_grades,
+    "keyword": keyword_filter,
+    "status_options": status_options,
+    "exclude_foreign_restricted": filter_nationality,
+    "show_hidden": show_hidden_filter,
+}
+
+# --- "Load More"方式のためのセッションステート初期化 ---
+ITEMS_PER_LOAD = 10 # 一回に読み込む件数
+COUNT_CAP = 1000    # 件数表示はこれを超えたら「以上」とする
+if 'items_to_show' not in st.session_state:
+    st.session_state.items_to_show = ITEMS_PER_LOAD
+
+# 表示中の件数分を、前のページの最後の行から続けて読む
+items_to_display_now, next_cursor = [], None
+while len(items_to_display_now) < st.session_state.items_to_show:
+    page_rows, next_cursor = get_dashboard_match_page(dashboard_filters, after=next_cursor, limit=ITEMS_PER_LOAD)
+    items_to_display_now.extend(page_rows)
+    if next_cursor is None: break
+
+if not items_to_display_now:
     st.info("フィルタリング条件に合致するマッチング結果はありませんでした。")
 else:
-    results_to_display = []
-    if filter_nationality:
-        for res in results:
-            job_doc = res['job_doc'] or ""
-            eng_doc = res['eng_doc'] or ""
-            if "外国籍不可" in job_doc or "日本人" in job_doc:
-                if "国籍: 日本" not in eng_doc:
-                    continue
-            results_to_display.append(res)
-    else:
-        results_to_display = results
-    
-    if not results_to_display:
-        st.warning("AIが提案したマッチングはありましたが、ルールフィルターによってすべて除外されました。")
-    else:
-
-        # ▼▼▼【ここからが修正箇所です】▼▼▼
-
-        # --- "Load More"方式のためのセッションステート初期化 ---
-        ITEMS_PER_LOAD = 10 # 一回に読み込む件数
-        if 'items_to_show' not in st.session_state:
-            st.session_state.items_to_show = ITEMS_PER_LOAD
-
-        total_items = len(results_to_display)
-
-        # --- ヘッダー表示 ---
-        # 表示件数セレクターは不要になるため削除（またはコメントアウト）
-        st.write(f"**マッチング結果: {total_items}件**")
+    total_items = count_dashboard_matches(dashboard_filters, cap=COUNT_CAP)
 
-        # --- 表示するデータのスライス ---
-        # 現在表示すべき件数までのデータを取得
-        items_to_display_now = results_to_display[:st.session_state.items_to_show]
+    # --- ヘッダー表示 ---
+    st.write(f"**マッチング結果: {COUNT_CAP}件以上**" if total_items > COUNT_CAP else f"**マッチング結果: {total_items}件**")
 
-        # --- マッチング結果の表示ループ ---
-        for res in items_to_display_now:
-            with st.container(border=True):
-                is_archived = res['match_is_hidden'] or res['job_is_hidden'] or res['engineer_is_hidden']
-                
-                if is_archived:
-                    st.warning("このマッチングは、関連する案件・技術者、またはマッチング自体が非表示（アーカイブ済み）です。")
-                
-                header_col1, header_col2 = st.columns([5, 2])
-                with header_col1:
-                    created_at_utc = res.get('created_at')
+    # --- マッチング結果の表示ループ ---
+    for res in items_to_display_now:
+        with st.container(border=True):
+            is_archived = res['match_is_hidden'] or res['job_is_hidden'] or res['engineer_is_hidden']
             
-                    # 共通関数を使って、DBから取得したUTC時刻をJST文字列に変換
-                    jst_time_str = convert_to_jst_str(created_at_utc, format_str='%Y-%m-%d %H:%M:%S')
-                    
-                    st.caption(f"マッチング日時: {jst_time_str} (JST)")
+            if is_archived:
+                st.warning("このマッチングは、関連する案件・技術者、またはマッチング自体が非表示（アーカイブ済み）です。")
+            
+            header_col1, header_col2 = st.columns([5, 2])
+            with header_col1:
+                created_at_utc = res.get('created_at')
+        
+                # 共通関数を使って、DBから取得したUTC時刻をJST文字列に変換
+                jst_time_str = convert_to_jst_str(created_at_utc, format_str='%Y-%m-%d %H:%M:%S')
+                
+                st.caption(f"マッチング日時: {jst_time_str} (JST)")
 
 
-                    
-                with header_col2:
-                    status_html = get_status_badge(res['status'])
-                    st.markdown(f"<div style='text-align: right;'>{status_html}</div>", unsafe_allow_html=True)
-
-                col1, col2, col3 = st.columns([5, 2, 5])
                 
-                with col1:
-                    project_name = res['project_name'] or f"案件(ID: {res['job_id']})"
-                    project_button_label = f"💼 {project_name}{' (非表示)' if res['job_is_hidden'] else ''}"
+            with header_col2:
+                status_html = get_status_badge(res['status'])
+                st.markdown(f"<div style='text-align: right;'>{status_html}</div>", unsafe_allow_html=True)
 
-                    #created_at_jst = res.get('created_at')
-                    #created_at_str = convert_to_jst_str(created_at_jst) if isinstance(created_at_jst, datetime) else "不明"
+            col1, col2, col3 = st.columns([5, 2, 5])
+            
+            with col1:
+                project_name = res['project_name'] or f"案件(ID: {res['job_id']})"
+                project_button_label = f"💼 {project_name}{' (非表示)' if res['job_is_hidden'] else ''}"
 
+                #created_at_jst = res.get('created_at')
+                #created_at_str = convert_to_jst_str(created_at_jst) if isinstance(created_at_jst, datetime) else "不明"
 
-                    # st.button を使い、クリックされたら session_state にIDを保存してページを切り替える
-                    if st.button(project_button_label, key=f"job_link_{res['res_id']}", use_container_width=True, type="secondary"):
-                        st.session_state['selected_job_id'] = res['job_id']
-                        st.switch_page("pages/6_案件詳細.py")
-                        
-                    st.caption(f"ID: {res['job_id']} | 担当: {res['job_assignee']}")
-                    #st.caption(f"ID: {res['job_id']} | 担当: {res['job_assignee']} | 登録日: {created_at_str}")
 
-                    job_doc_summary = (res['job_doc'].split('\n---\n', 1)[-1]).replace('\n', ' ').replace('\r', '')[:150]
-                    st.caption(f"{job_doc_summary}...")
+                # st.button を使い、クリックされたら session_state にIDを保存してページを切り替える
+                if st.button(project_button_label, key=f"job_link_{res['res_id']}", use_container_width=True, type="secondary"):
+                    st.session_state['selected_job_id'] = res['job_id']
+                    st.switch_page("pages/6_案件詳細.py")
                     
+                st.caption(f"ID: {res['job_id']} | 担当: {res['job_assignee']}")
+                #st.caption(f"ID: {res['job_id']} | 担当: {res['job_assignee']} | 登録日: {created_at_str}")
 
-                    
-                with col2:
+                st.caption(f"{res['job_summary']}...")
+                
 
-                    feedback_icon = "💬" if res.get('has_feedback') else ""
-                    grade_html = get_evaluation_html(res['grade'])
-                    st.markdown(f"{grade_html}<div style='text-align:center; font-size:1.2em;'>{feedback_icon}</div>", unsafe_allow_html=True)
-                    
-                    if st.button("詳細を見る", key=f"dashboard_detail_btn_{res['res_id']}", use_container_width=True):
-                        st.session_state['selected_match_id'] = res['res_id']
-                        st.switch_page("pages/7_マッチング詳細.py")
+                
+            with col2:
 
-                with col3:
-                    engineer_name = res['engineer_name'] or f"技術者(ID: {res['engineer_id']})"
-                    engineer_button_label = f"👤 {engineer_name}{' (非表示)' if res['engineer_is_hidden'] else ''}"
+                feedback_icon = "💬" if res.get('has_feedback') else ""
+                grade_html = get_evaluation_html(res['grade'])
+                st.markdown(f"{grade_html}<div style='text-align:center; font-size:1.2em;'>{feedback_icon}</div>", unsafe_allow_html=True)
+                
+                if st.button("詳細を見る", key=f"dashboard_detail_btn_{res['res_id']}", use_container_width=True):
+                    st.session_state['selected_match_id'] = res['res_id']
+                    st.switch_page("pages/7_マッチング詳細.py")
 
-                    # こちらも同様に st.button に変更
-                    if st.button(engineer_button_label, key=f"eng_link_{res['res_id']}", use_container_width=True, type="secondary"):
-                        st.session_state['selected_engineer_id'] = res['engineer_id']
-                        st.switch_page("pages/5_技術者詳細.py")
+            with col3:
+                engineer_name = res['engineer_name'] or f"技術者(ID: {res['engineer_id']})"
+                engineer_button_label = f"👤 {engineer_name}{' (非表示)' if res['engineer_is_hidden'] else ''}"
 
-                    st.caption(f"ID: {res['engineer_id']} | 担当: {res['engineer_assignee']}")
-                    eng_doc_summary = (res['eng_doc'].split('\n---\n', 1)[-1]).replace('\n', ' ').replace('\r', '')[:150]
-                    st.caption(f"{eng_doc_summary}...")
+                # こちらも同様に st.button に変更
+                if st.button(engineer_button_label, key=f"eng_link_{res['res_id']}", use_container_width=True, type="secondary"):
+                    st.session_state['selected_engineer_id'] = res['engineer_id']
+                    st.switch_page("pages/5_技術者詳細.py")
 
+                st.caption(f"ID: {res['engineer_id']} | 担当: {res['engineer_assignee']}")
+                st.caption(f"{res['eng_summary']}...")
 
 
 
-        
-        # まだ表示していないアイテムが残っている場合のみボタンを表示
-        if st.session_state.items_to_show < total_items:
-            # 画面中央にボタンを配置するためのカラム
-            _, col_btn, _ = st.columns([2, 1, 2])
-            with col_btn:
-                if st.button("もっと見る", use_container_width=True, type="primary"):
-                    # 表示件数を増やす
-                    st.session_state.items_to_show += ITEMS_PER_LOAD
-                    st.rerun()
-        else:
-            st.success("すべてのマッチング結果を表示しました。")
-
-        # ▲▲▲【修正ここまで】▲▲▲
 
-        
+    
+    # まだ表示していないアイテムが残っている場合のみボタンを表示
+    if next_cursor is not None:
+        # 画面中央にボタンを配置するためのカラム
+        _, col_btn, _ = st.columns([2, 1, 2])
+        with col_btn:
+            if st.button("もっと見る", use_container_width=True, type="primary"):
+                # 表示件数を増やす
+                st.session_state.items_to_show += ITEMS_PER_LOAD
+                st.rerun()
+    else:
+        st.success("すべてのマッチング結果を表示しました。")
+
+    
 ui.display_footer()
@@ -9,7 +9,6 @@ from backend import (
 import ui_components as ui
 
 # --- アプリケーションの初期化 ---
-init_database()
 load_embedding_model()
 
 # --- 設定ファイルの読み込み ---
@@ -27,6 +26,8 @@ if 'debug_log' not in st.session_state:
 
 # ページ設定
 st.set_page_config(page_title=f"{APP_TITLE} | メール処理", layout="wide")
+# スキーマのバージョン確認（未適用のマイグレーションがあれば案内を表示するため、ページ設定の後に呼ぶ）
+init_database()
 ui.apply_global_styles() 
 
 
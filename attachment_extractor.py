@@ -0,0 +1,440 @@
+# ==============================================================================
+# attachment_extractor.py
+# ==============================================================================
+# メール添付ファイル（PDF / DOCX / Excel / TXT）のテキスト抽出。
+# 取り込みパイプラインからはプロセスプール経由で呼び出されるため、
+# このモジュールは DB や LLM に依存させないこと（ワーカープロセスの起動を軽く保つ）。
+# ==============================================================================
+
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from datetime import date, datetime, time as dt_time
+
+import fitz
+import docx
+import openpyxl
+import pandas as pd
+
+
+# --- 抽出時の上限値（config.toml の [attachment_extraction] で上書き可能） ---
+DEFAULT_EXTRACTION_LIMITS = {
+    "max_bytes": 20 * 1024 * 1024,   # これを超える添付ファイルは抽出しない
+    "max_pages": 50,                 # PDFの最大ページ数
+    "max_rows": 2000,                # Excelの1シートあたりの最大行数（空行を除く）
+    "max_cols": 50,                  # Excelの最大列数
+    "max_chars": 50000,              # 抽出テキストの最大文字数
+    "timeout_seconds": 60,           # 1ファイルあたりの抽出時間の上限
+    "max_memory_mb": 1024,           # ワーカープロセスのヒープ・確保メモリの上限（RLIMIT_DATA が使える環境のみ）
+    "cache_size": 256,               # プロセス内で保持する抽出結果の件数
+    "spool_threshold_bytes": 1024 * 1024,  # これを超える添付ファイルは一時ファイルに書き出し、パスで受け渡す
+    "spool_dir": "",                 # 一時ファイルの置き場所（空ならOSの既定）
+}
+
+def load_extraction_limits(config: dict) -> dict:
+    limits = dict(DEFAULT_EXTRACTION_LIMITS)
+    limits.update((config or {}).get("attachment_extraction", {}))
+    return limits
+
+
+# ==============================================================================
+# 1. 形式ごとの抽出関数
+# ==============================================================================
+# 各関数の file_bytes には、バイト列の代わりに一時ファイルのパス（str）も渡せる。
+# パスの場合はファイルから直接読み込むため、添付ファイル全体をメモリに載せずに済む。
+
+def _as_source(file_bytes):
+    """パスはそのまま、バイト列はファイルとして読めるよう BytesIO にして返す。"""
+    return file_bytes if isinstance(file_bytes, str) else io.BytesIO(file_bytes)
+
+def _read_head(file_bytes, size: int) -> bytes:
+    if isinstance(file_bytes, str):
+        with open(file_bytes, "rb") as f: return f.read(size)
+    return bytes(file_bytes[:size])
+
+def source_size(file_bytes) -> int:
+    return os.path.getsize(file_bytes) if isinstance(file_bytes, str) else len(file_bytes or b"")
+
+def source_digest(file_bytes) -> str:
+    """添付ファイルの sha256。パスの場合は 1MB ずつ読んで計算する。"""
+    if not isinstance(file_bytes, str): return hashlib.sha256(file_bytes or b"").hexdigest()
+    digest = hashlib.sha256()
+    with open(file_bytes, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+def clean_and_format_text(text: str) -> str:
+    if not text: return ""
+    text_with_tabs = re.sub(r' {2,}', '\t', text)
+    full_text = "\n".join([line.strip() for line in text_with_tabs.splitlines()])
+    return re.sub(r'\n{3,}', '\n\n', full_text).strip()
+
+def extract_text_from_pdf(file_bytes, max_pages: int | None = None):
+    try:
+        opened = fitz.open(file_bytes, filetype="pdf") if isinstance(file_bytes, str) else fitz.open(stream=file_bytes, filetype="pdf")
+        with opened as doc:
+            page_count = doc.page_count
+            limit = page_count if not max_pages else min(page_count, max_pages)
+            raw_text = "".join(doc[i].get_text() for i in range(limit))
+        formatted_text = clean_and_format_text(raw_text)
+        if not formatted_text: return "[PDFテキスト抽出失敗: 内容が空または画像PDF]"
+        if limit < page_count:
+            formatted_text += f"\n[…PDFの{limit + 1}ページ目以降（全{page_count}ページ）は省略しました]"
+        return formatted_text
+    except Exception as e: return f"[PDFテキスト抽出エラー: {e}]"
+
+def extract_text_from_docx(file_bytes):
+    try:
+        doc = docx.Document(_as_source(file_bytes))
+        raw_text = "\n".join([p.text for p in doc.paragraphs])
+        formatted_text = clean_and_format_text(raw_text)
+        return formatted_text if formatted_text else "[DOCXテキスト抽出失敗: 内容が空]"
+    except Exception as e: return f"[DOCXテキスト抽出エラー: {e}]"
+
+_XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'   # 旧形式（.xls / OLE2）のファイル先頭
+_MAX_CONSECUTIVE_EMPTY_ROWS = 1000                       # 書式だけが設定された空行が続いたら走査を打ち切る
+
+def _format_cell(value) -> str:
+    if value is None: return ""
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    if isinstance(value, datetime): return value.strftime('%Y-%m-%d') if value.time() == dt_time(0, 0) else value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, date): return value.strftime('%Y-%m-%d')
+    text = str(value)
+    if text == "nan": return ""
+    # セル内の改行やタブは、行・列の区切りと紛れないよう空白にする
+    return re.sub(r'[\t\r\n]+', ' ', text).strip()
+
+def _rows_to_text(rows, max_rows: int | None, max_cols: int | None):
+    """
+    行のイテレータを1回だけ走査し、空行を除いたタブ区切りの行リストと、省略が発生したかを返す。
+    """
+    lines, empty_run = [], 0
+    rows_truncated = cols_truncated = False
+    for row in rows:
+        cells = [_format_cell(v) for v in row]
+        if max_cols and len(cells) > max_cols:
+            if any(cells[max_cols:]): cols_truncated = True
+            cells = cells[:max_cols]
+        while cells and not cells[-1]: cells.pop()
+        if not cells:
+            empty_run += 1
+            if empty_run >= _MAX_CONSECUTIVE_EMPTY_ROWS: break
+            continue
+        empty_run = 0
+        if max_rows and len(lines) >= max_rows:
+            rows_truncated = True
+            break
+        lines.append("\t".join(cells))
+    return lines, rows_truncated, cols_truncated
+
+def _iter_xlsx_sheets(source, max_rows: int | None, max_cols: int | None):
+    # read_only モードではシートのXMLを逐次パースするため、ブック全体をメモリに展開しない
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True, max_col=(max_cols + 1) if max_cols else None)
+            yield (sheet.title, *_rows_to_text(rows, max_rows, max_cols))
+    finally:
+        workbook.close()
+
+def _iter_xls_sheets(source, max_rows: int | None, max_cols: int | None):
+    # 旧形式の .xls は openpyxl で読めないため、pandas(xlrd) で各シートを1回だけ読む
+    sheets = pd.read_excel(source, sheet_name=None, header=None, nrows=(max_rows + 1) if max_rows else None, engine="xlrd")
+    for name, df in sheets.items():
+        yield (name, *_rows_to_text(df.itertuples(index=False, name=None), max_rows, max_cols))
+
+def extract_text_from_excel(file_bytes, max_rows: int | None = None, max_cols: int | None = None) -> str:
+    """
+    Excelブックの全シートを1回ずつ走査し、シートごとにタブ区切りのテキストへ変換する。
+    .xlsx は openpyxl の read_only モードでストリーミングし、.xls は pandas(xlrd) にフォールバックする。
+    max_rows / max_cols を超えた部分は読み飛ばし、省略マーカーを付ける。
+    """
+    try:
+        head = _read_head(file_bytes, 8)
+        source = _as_source(file_bytes)
+        sheet_iter = _iter_xls_sheets if head == _XLS_SIGNATURE else _iter_xlsx_sheets
+        all_text_parts = []
+        for name, lines, rows_truncated, cols_truncated in sheet_iter(source, max_rows, max_cols):
+            if not lines: continue
+            part = f"### シート: {name}\n" + "\n".join(lines)
+            if rows_truncated: part += f"\n[…{max_rows}行目以降は省略しました]"
+            if cols_truncated: part += f"\n[…{max_cols}列目以降は省略しました]"
+            all_text_parts.append(part)
+        if not all_text_parts: return "[Excelテキスト抽出失敗: 内容が空です]"
+        return "\n\n".join(all_text_parts)
+    except Exception as e: return f"[Excelテキスト抽出エラー: {e}]"
+
+def _truncate_text(text: str, max_chars: int | None) -> str:
+    if not max_chars or len(text) <= max_chars: return text
+    return text[:max_chars] + f"\n[…以降 {len(text) - max_chars}文字は省略しました]"
+
+def extract_attachment_text(filename: str, file_bytes: bytes, limits: dict | None = None) -> str | None:
+    """
+    添付ファイルの拡張子に応じて抽出関数を呼び分ける。未対応形式の場合は None を返す。
+    プロセスプールのワーカーから呼ばれるため、モジュールのトップレベルに定義しておくこと。
+    """
+    limits = limits or DEFAULT_EXTRACTION_LIMITS
+    lfname = filename.lower()
+    if lfname.endswith(".pdf"): text = extract_text_from_pdf(file_bytes, limits.get("max_pages"))
+    elif lfname.endswith(".docx"): text = extract_text_from_docx(file_bytes)
+    elif lfname.endswith((".xlsx", ".xls")): text = extract_text_from_excel(file_bytes, limits.get("max_rows"), limits.get("max_cols"))
+    elif lfname.endswith(".txt"):
+        # 省略されるだけの部分は読まない（UTF-8 は1文字最大4バイト）
+        max_chars = limits.get("max_chars")
+        if isinstance(file_bytes, str):
+            with open(file_bytes, "rb") as f: raw = f.read(max_chars * 4 + 4) if max_chars else f.read()
+        else: raw = file_bytes
+        text = raw.decode('utf-8', errors='ignore')
+    else: return None
+    return _truncate_text(text, limits.get("max_chars"))
+
+def is_supported_attachment(filename: str) -> bool:
+    return filename.lower().endswith((".pdf", ".docx", ".xlsx", ".xls", ".txt"))
+
+# 抽出中の例外（MemoryError を含む）から作ったマーカー。一時的な失敗や上限の設定によるものなので、キャッシュしない
+_EXTRACTION_ERROR_MARKER = re.compile(r'^\[[^\]\n]*抽出エラー: ')
+
+def is_extraction_error(text: str | None) -> bool:
+    return bool(text) and bool(_EXTRACTION_ERROR_MARKER.match(text))
+
+# 抽出結果を左右する上限値。キャッシュのキーに含め、上限を変えたら抽出し直す
+_OUTPUT_LIMIT_KEYS = ("max_pages", "max_rows", "max_cols", "max_chars")
+
+def limits_fingerprint(limits: dict) -> str:
+    return ",".join(f"{key}={limits.get(key)}" for key in _OUTPUT_LIMIT_KEYS)
+
+
+# --- MIMEパートの一時ファイルへの書き出し ---
+_BASE64_CHUNK_CHARS = 1024 * 1024   # base64 を一度にデコードする文字数
+_WHITESPACE = re.compile(r'\s+')
+
+def spool_attachment_payload(part, filename: str, limits: dict | None = None):
+    """
+    MIMEパートの添付ファイルを取り出す。デコード後のサイズが spool_threshold_bytes を超える場合は、
+    base64 を少しずつデコードしながら一時ファイルに書き出し、そのパス（str）を返す。それ以外はバイト列を返す。
+    パスを受け取った呼び出し側は、抽出後に os.remove で削除すること。
+    """
+    limits = limits or DEFAULT_EXTRACTION_LIMITS
+    threshold = limits.get("spool_threshold_bytes") or 0
+    encoding = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+    encoded = part.get_payload(decode=False)
+    if not threshold or not isinstance(encoded, str) or encoding != "base64" or len(encoded) * 3 // 4 <= threshold:
+        return part.get_payload(decode=True)
+
+    suffix = os.path.splitext(filename)[1].lower()
+    fd, path = tempfile.mkstemp(prefix="mail_attachment_", suffix=suffix, dir=limits.get("spool_dir") or None)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            leftover = ""
+            for start in range(0, len(encoded), _BASE64_CHUNK_CHARS):
+                chunk = leftover + _WHITESPACE.sub("", encoded[start:start + _BASE64_CHUNK_CHARS])
+                usable = len(chunk) - len(chunk) % 4
+                f.write(base64.b64decode(chunk[:usable]))
+                leftover = chunk[usable:]
+            if leftover:
+                # 末尾のパディングが欠けたデータも、get_payload(decode=True) と同様に読めるだけ読む
+                f.write(base64.b64decode(leftover + "=" * (-len(leftover) % 4)))
+    except Exception:
+        os.remove(path)
+        return part.get_payload(decode=True)
+    return path
+
+
+# ==============================================================================
+# 2. プロセスプールによる並列・隔離実行
+# ==============================================================================
+
+def _limit_worker_resources(max_memory_mb: int):
+    # 壊れたファイルでワーカーがメモリを食い潰さないよう、確保できるメモリに上限を設ける（Linuxのみ有効）。
+    # RLIMIT_AS はライブラリの読み込みやスレッドのスタックなど予約しただけのアドレス空間も数えてしまい、
+    # 抽出前から上限を超えて全ファイルが失敗することがあるため、実際に確保するメモリ（RLIMIT_DATA）で制限する。
+    try:
+        import resource
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    except Exception:
+        pass
+
+
+def _worker_context():
+    """
+    ワーカープロセスの起動方式。プールはタイムアウト後にパイプラインのスレッドから作り直すため、
+    その時点で gRPC やDB接続プールのスレッドが動いている親プロセスを fork すると、子プロセスがロックを握ったまま固まりうる。
+    スレッドを持たないサーバープロセスから fork する forkserver（使えない環境では spawn）を使う。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # 抽出ライブラリはサーバープロセスで一度だけ読み込み、ワーカーの起動を軽くする
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+_START_POLL_SECONDS = 0.5   # 実行待ちのファイルが実行を始めたかを確かめる間隔
+
+
+class AttachmentExtractor:
+    """
+    添付ファイルの抽出をプロセスプールで並列に実行する。
+
+    - max_bytes を超えるファイルは抽出せず、その旨のマーカー文字列を返す
+    - timeout_seconds を超えたファイルはマーカー文字列を返し、固まったワーカーはプールごと作り直す
+    - 抽出できた結果は、添付ファイルの sha256 と抽出上限（limits_fingerprint）から作ったキーでキャッシュする
+      （プロセス内のLRU + 任意の永続キャッシュ）。抽出エラーのマーカーはキャッシュせず、次回は抽出し直す
+
+    persistent_cache には get(key) -> str | None と put(key, filename, content) を持つオブジェクトを渡す。
+    key も sha256 の16進文字列なので、添付ファイルの sha256 用の列にそのまま保存できる。
+    複数スレッドから同時に呼び出してよい。
+    """
+
+    def __init__(self, limits: dict | None = None, workers: int = 2, persistent_cache=None):
+        self.limits = dict(DEFAULT_EXTRACTION_LIMITS)
+        self.limits.update(limits or {})
+        self.workers = workers
+        self.persistent_cache = persistent_cache
+        self._memory_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_generation = 0
+        self._limits_key = limits_fingerprint(self.limits)
+        self.stats = {"extracted": 0, "cache_hits": 0, "timeouts": 0, "skipped_too_large": 0}
+
+    # --- プールの管理 ---
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context(),
+                                                 initializer=_limit_worker_resources, initargs=(self.limits["max_memory_mb"],))
+                self._pool_generation += 1
+            return self._pool, self._pool_generation
+
+    def _reset_pool(self, generation: int):
+        """固まったワーカーを強制終了してプールを作り直す。他スレッドが既に作り直していれば何もしない。"""
+        with self._lock:
+            if self._pool is None or generation != self._pool_generation: return
+            pool, self._pool = self._pool, None
+        # ProcessPoolExecutor には実行中のタスクを止める公開APIが無いため、ワーカープロセスを直接終了させる
+        for process in list(getattr(pool, "_processes", {}).values()):
+            try: process.terminate()
+            except Exception: pass
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool: pool.shutdown(wait=True)
+
+    def _count(self, key: str):
+        # 複数スレッドの extract_many から更新されるため、ロックの中で数える
+        with self._lock: self.stats[key] += 1
+
+    # --- キャッシュ ---
+    def _cache_key(self, digest: str) -> str:
+        return hashlib.sha256(f"{digest}:{self._limits_key}".encode()).hexdigest()
+
+    def _cache_get(self, digest: str):
+        with self._lock:
+            if digest in self._memory_cache:
+                self._memory_cache.move_to_end(digest)
+                return self._memory_cache[digest]
+        if self.persistent_cache is not None:
+            try:
+                content = self.persistent_cache.get(digest)
+            except Exception as e:
+                print(f"  > ⚠️ 抽出キャッシュの参照に失敗しました: {e}")
+                content = None
+            if content is not None:
+                self._cache_put(digest, None, content, persist=False)
+            return content
+        return None
+
+    def _cache_put(self, digest: str, filename: str | None, content: str, persist: bool = True):
+        with self._lock:
+            self._memory_cache[digest] = content
+            self._memory_cache.move_to_end(digest)
+            while len(self._memory_cache) > self.limits["cache_size"]:
+                self._memory_cache.popitem(last=False)
+        if persist and self.persistent_cache is not None:
+            try: self.persistent_cache.put(digest, filename, content)
+            except Exception as e: print(f"  > ⚠️ 抽出キャッシュの保存に失敗しました: {e}")
+
+    # --- 抽出 ---
+    def extract_many(self, attachments: list) -> list:
+        """
+        [(filename, file_bytes), ...] をまとめてプールに投入し、同じ順序でテキスト（未対応形式は None）を返す。
+        file_bytes には一時ファイルのパスも渡せる。その場合ワーカーにはパスだけを渡し、ファイルの中身はコピーしない。
+        """
+        results = [None] * len(attachments)
+        pending = []
+        for i, (filename, file_bytes) in enumerate(attachments):
+            if not is_supported_attachment(filename): continue
+            file_bytes = file_bytes or b""
+            size = source_size(file_bytes)
+            if size > self.limits["max_bytes"]:
+                self._count("skipped_too_large")
+                results[i] = f"[添付ファイル抽出スキップ: サイズ {size / 1024 / 1024:.1f}MB が上限 {self.limits['max_bytes'] / 1024 / 1024:.1f}MB を超えています]"
+                continue
+            cache_key = self._cache_key(source_digest(file_bytes))
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                self._count("cache_hits")
+                results[i] = cached
+                continue
+            pending.append((i, filename, file_bytes, cache_key))
+
+        timeout = self.limits["timeout_seconds"]
+        for attempt in range(2):
+            if not pending: break
+            pool, generation = self._get_pool()
+            futures, retry = {}, []
+            for entry in pending:
+                i, filename, file_bytes, _ = entry
+                try: futures[pool.submit(extract_attachment_text, filename, file_bytes, self.limits)] = entry
+                except (BrokenProcessPool, RuntimeError): retry.append(entry)
+            # タイムアウトはファイルごとに、ワーカーが実行を始めてから数える（空きワーカーを待つ時間は含めない）
+            started, not_done = {}, set(futures)
+            while not_done:
+                now = time.monotonic()
+                for future in not_done:
+                    if future not in started and future.running(): started[future] = now
+                expired = {future for future in not_done if future in started and now - started[future] >= timeout}
+                if expired:
+                    for future in expired:
+                        self._count("timeouts")
+                        results[futures[future][0]] = f"[添付ファイル抽出タイムアウト: {timeout}秒以内に完了しませんでした]"
+                    # 固まったワーカーを止める。同じプールの他のファイルは BrokenProcessPool になり、下で再試行に回る
+                    self._reset_pool(generation)
+                    not_done -= expired
+                    if not not_done: break
+                next_check = min([started[future] + timeout - now for future in not_done if future in started] + [_START_POLL_SECONDS])
+                done, not_done = wait(not_done, timeout=max(0.0, next_check), return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = futures[future]
+                    i, filename, _, cache_key = entry
+                    try:
+                        content = future.result()
+                    except (BrokenProcessPool, CancelledError):
+                        # 他のファイルのタイムアウトやメモリ上限でプールが壊れた。作り直したプールで1回だけ再試行する
+                        self._reset_pool(generation)
+                        retry.append(entry)
+                        continue
+                    except Exception as e:
+                        results[i] = f"[添付ファイル抽出エラー: {e}]"
+                        continue
+                    self._count("extracted")
+                    if content is not None and not is_extraction_error(content): self._cache_put(cache_key, filename, content)
+                    results[i] = content
+            pending = retry
+        for i, _, _, _ in pending:
+            results[i] = "[添付ファイル抽出エラー: ワーカープロセスが異常終了しました]"
+        return results
@@ -17,6 +17,13 @@ import contextlib
 import toml
 import fitz
 import docx
+import attachment_extractor
+import db_pool
+import item_attributes
+import matching_queue
+import run_migrations
+import skill_taxonomy
+import text_search
 import re # スキル抽出のために re モジュールをインポート
 import json
 import pandas as pd
@@ -71,52 +78,41 @@ def load_embedding_model():
     except Exception as e:
         st.error(f"埋め込みモデル '{MODEL_NAME}' の読み込みに失敗しました: {e}"); return None
 
+@st.cache_resource
+def get_connection_pool():
+    """プロセス全体で共有するコネクションプール。config.toml の [database_pool] で上限などを設定する。"""
+    return db_pool.ConnectionPool(st.secrets["DATABASE_URL"], db_pool.load_pool_settings(load_app_config()))
+
 def get_db_connection():
+    """
+    プールから接続を借りる。戻り値は psycopg2 の接続と同じように使え、close() または with ブロックの終了で返却される。
+    """
     try:
-        db_url = st.secrets["DATABASE_URL"]
-        return psycopg2.connect(db_url, cursor_factory=DictCursor)
+        return get_connection_pool().getconn()
     except KeyError:
         st.error("`secrets.toml` に `DATABASE_URL` が設定されていません。"); st.stop()
-    except psycopg2.OperationalError as e:
+    except (psycopg2.OperationalError, db_pool.PoolError) as e:
         st.error(f"データベースへの接続に失敗しました: {e}"); st.stop()
     except Exception as e:
         st.error(f"データベース接続中に予期せぬエラーが発生しました: {e}"); st.stop()
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _pending_migrations() -> list:
+    """未適用のマイグレーションのファイル名。プロセスごとに5分に1回だけ schema_migrations を確認する。"""
+    with get_db_connection() as conn:
+        return [m["filename"] for m in run_migrations.pending_migrations(conn)]
+
 def init_database():
-    conn = get_db_connection()
+    """
+    スキーマのバージョン確認だけを行う。テーブルの作成・変更は run_migrations.py（migrations/）で行う。
+    未適用のマイグレーションがあれば、画面に案内を表示する。
+    """
     try:
-        with conn.cursor() as cursor:
-            cursor.execute('CREATE TABLE IF NOT EXISTS jobs (id SERIAL PRIMARY KEY, project_name TEXT, document TEXT NOT NULL, source_data_json TEXT, created_at TEXT, assigned_user_id INTEGER, is_hidden INTEGER NOT NULL DEFAULT 0, received_at TIMESTAMP WITH TIME ZONE)')
-            cursor.execute('CREATE TABLE IF NOT EXISTS engineers (id SERIAL PRIMARY KEY, name TEXT, document TEXT NOT NULL, source_data_json TEXT, created_at TEXT, assigned_user_id INTEGER, is_hidden INTEGER NOT NULL DEFAULT 0, received_at TIMESTAMP WITH TIME ZONE)')
-            cursor.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, username TEXT NOT NULL UNIQUE, email TEXT, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP);")
-            cursor.execute('''CREATE TABLE IF NOT EXISTS matching_results (id SERIAL PRIMARY KEY, job_id INTEGER NOT NULL, engineer_id INTEGER NOT NULL, score REAL NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, is_hidden INTEGER DEFAULT 0, grade TEXT, positive_points TEXT, concern_points TEXT, proposal_text TEXT, status TEXT DEFAULT '新規', FOREIGN KEY (job_id) REFERENCES jobs (id) ON DELETE CASCADE, FOREIGN KEY (engineer_id) REFERENCES engineers (id) ON DELETE CASCADE, UNIQUE (job_id, engineer_id))''')
-            cursor.execute("SELECT COUNT(*) FROM users")
-            if cursor.fetchone()[0] == 0:
-                print("初回起動のため、テストユーザーを追加します...")
-                users_to_add = [('熊崎', 'yamada@example.com'), ('岩本', 'suzuki@example.com'), ('小関', 'sato@example.com'), ('内山', 'sato@example.com'), ('島田', 'sato@example.com'), ('長谷川', 'sato@example.com'), ('北島', 'sato@example.com'), ('岩崎', 'sato@example.com'), ('根岸', 'sato@example.com'), ('添田', 'sato@example.com'), ('山浦', 'sato@example.com'), ('福田', 'sato@example.com')]
-                cursor.executemany("INSERT INTO users (username, email) VALUES (%s, %s)", users_to_add)
-                print(" -> テストユーザーを追加しました。")
-            def get_columns(table_name):
-                cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s", (table_name,))
-                return [row['column_name'] for row in cursor.fetchall()]
-            job_columns = get_columns('jobs')
-            if 'assigned_user_id' not in job_columns: cursor.execute("ALTER TABLE jobs ADD COLUMN assigned_user_id INTEGER REFERENCES users(id)")
-            if 'is_hidden' not in job_columns: cursor.execute("ALTER TABLE jobs ADD COLUMN is_hidden INTEGER NOT NULL DEFAULT 0")
-            if 'received_at' not in job_columns: cursor.execute("ALTER TABLE jobs ADD COLUMN received_at TIMESTAMP WITH TIME ZONE")
-            engineer_columns = get_columns('engineers')
-            if 'assigned_user_id' not in engineer_columns: cursor.execute("ALTER TABLE engineers ADD COLUMN assigned_user_id INTEGER REFERENCES users(id)")
-            if 'is_hidden' not in engineer_columns: cursor.execute("ALTER TABLE engineers ADD COLUMN is_hidden INTEGER NOT NULL DEFAULT 0")
-            if 'received_at' not in engineer_columns: cursor.execute("ALTER TABLE engineers ADD COLUMN received_at TIMESTAMP WITH TIME ZONE")
-            match_columns = get_columns('matching_results')
-            if 'positive_points' not in match_columns: cursor.execute("ALTER TABLE matching_results ADD COLUMN positive_points TEXT")
-            if 'concern_points' not in match_columns: cursor.execute("ALTER TABLE matching_results ADD COLUMN concern_points TEXT")
-            if 'status' not in match_columns: cursor.execute("ALTER TABLE matching_results ADD COLUMN status TEXT DEFAULT '新規'")
-        conn.commit()
-        print("Database initialized and schema verified successfully for PostgreSQL.")
-    except (Exception, psycopg2.Error) as e:
-        print(f"❌ データベース初期化中にエラーが発生しました: {e}"); conn.rollback()
-    finally:
-        if conn: conn.close()
+        pending = _pending_migrations()
+    except psycopg2.Error as e:
+        st.error(f"スキーマのバージョン確認に失敗しました: {e}"); return
+    if pending:
+        st.warning(f"データベースに未適用のマイグレーションが {len(pending)}件 あります（{', '.join(pending)}）。サーバーで `python run_migrations.py` を実行してください。")
 
 def get_extraction_prompt(doc_type, text_content):
     if doc_type == 'engineer':
@@ -172,17 +168,15 @@ def split_text_with_llm(text_content: str) -> (dict | None, list):
     """
     logs = []
 
+    # ★★★ AIアクティビティログを記録 (分類) ★★★
+    # LLMの応答を待つ間に接続を握り続けないよう、記録したらすぐにプールへ返す
     conn = get_db_connection() # この関数はUIから呼ばれる前提
     if not conn:
         logs.append("❌ DB接続エラーにより、処理を中断しました。")
         return None, logs
-    
-    with conn.cursor() as cur:
-            # --- 1. 文書タイプの分類 ---
-            # ★★★ AIアクティビティログを記録 (分類) ★★★
+    with conn:
+        with conn.cursor() as cur:
             cur.execute("INSERT INTO ai_activity_log (activity_type) VALUES ('classification')")
-            conn.commit()
-
 
     # この関数内で発生したログを収集するためのリスト
     # UI表示とは別に、呼び出し元に返す
@@ -727,41 +721,11 @@ def extract_text_from_docx(file_bytes):
 def extract_text_from_excel(file_bytes: bytes) -> str:
     """
     Excelファイル（.xlsx, .xls）のバイトデータを受け取り、
-    すべてのシートの内容をテキスト形式で結合して返す。
+    すべてのシートの内容をタブ区切りのテキストで結合して返す。
+    DataFrameは作らず、openpyxl の read_only モードで各シートを1回だけ走査する（attachment_extractor と共通）。
     """
-    try:
-        # バイトデータを pandas が読み込める形式に変換
-        excel_file = io.BytesIO(file_bytes)
-        
-        # Excelファイル内の全シート名を取得
-        xls = pd.ExcelFile(excel_file)
-        sheet_names = xls.sheet_names
-        
-        all_text_parts = []
-        
-        # 各シートをループで処理
-        for sheet_name in sheet_names:
-            # シートをDataFrameとして読み込む
-            df = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-            
-            # DataFrameが空でないことを確認
-            if not df.empty:
-                # シートの内容を文字列に変換（CSV形式に似せる）
-                # 各セルをタブ区切り、各行を改行で結合する
-                sheet_text = df.to_string(header=False, index=False, na_rep='')
-                
-                # シート名と内容を結合してリストに追加
-                all_text_parts.append(f"\n--- シート: {sheet_name} ---\n{sheet_text}")
-
-        if not all_text_parts:
-            return "[Excelテキスト抽出失敗: ファイル内に解析可能なデータがありません]"
-            
-        # 全シートのテキストを結合して返す
-        return "".join(all_text_parts)
-
-    except Exception as e:
-        # pandas が読み込めない形式や破損ファイルなどのエラーをキャッチ
-        return f"[Excelテキスト抽出エラー: {e}]"
+    limits = attachment_extractor.load_extraction_limits(load_app_config())
+    return attachment_extractor.extract_text_from_excel(file_bytes, limits["max_rows"], limits["max_cols"])
     
 
 def get_email_contents(msg) -> dict:
@@ -818,12 +782,35 @@ def get_email_contents(msg) -> dict:
 
 # backend.py
 
+def _compress_uid_set(uids) -> str:
+    """[1, 2, 3, 7] → '1:3,7' のように、UIDのリストをIMAPのシーケンスセット表記にまとめる"""
+    ranges = []
+    for uid in sorted(set(int(u) for u in uids)):
+        if ranges and uid == ranges[-1][1] + 1: ranges[-1][1] = uid
+        else: ranges.append([uid, uid])
+    return ",".join(f"{a}" if a == b else f"{a}:{b}" for a, b in ranges)
+
+def _fetch_messages_by_uid(mail, uids: list, batch_size: int):
+    """
+    batch_size 件ずつ `UID FETCH <set> (UID BODY.PEEK[])` でまとめて取得し、(uid, RFC822バイト列) を uids の順に返す。
+    """
+    for i in range(0, len(uids), batch_size):
+        chunk = uids[i:i + batch_size]
+        _, data = mail.uid('FETCH', _compress_uid_set(chunk), '(UID BODY.PEEK[])')
+        fetched = {}
+        for part in data:
+            if isinstance(part, tuple) and (m := re.search(rb'UID (\d+)', part[0])):
+                fetched[int(m.group(1))] = part[1]
+        for uid in chunk:
+            if uid in fetched: yield uid, fetched[uid]
+
 def fetch_and_process_emails():
     try:
         # 1. 設定ファイルから読み込み件数を取得
         config = load_app_config()
         # .get() を使って安全に値を取得し、取得できない場合はデフォルトで10を設定
         FETCH_LIMIT = config.get("email_processing", {}).get("fetch_limit", 10)
+        FETCH_BATCH_SIZE = config.get("email_processing", {}).get("fetch_batch_size", 25)
 
         # プログレスバーの初期化と重み付け定義
         progress_bar = st.progress(0, text="処理を開始します...")
@@ -851,58 +838,60 @@ def fetch_and_process_emails():
         total_processed_count, checked_count = 0, 0
         try:
             with st.status("最新の未読メールを取得・処理中...", expanded=True) as status:
-                _, messages = mail.search(None, 'UNSEEN')
-                email_ids = messages[0].split()
+                _, messages = mail.uid('SEARCH', None, 'UNSEEN')
+                email_uids = [int(x) for x in (messages[0] or b'').split()]
                 
                 progress_bar.progress(WEIGHT_CONNECT + WEIGHT_FETCH_IDS, text="未読メールIDリスト取得完了")
                 
-                if not email_ids:
+                if not email_uids:
                     st.write("処理対象の未読メールは見つかりませんでした。")
                 else:
-                    latest_ids = email_ids[::-1][:FETCH_LIMIT]
-                    checked_count = len(latest_ids)
+                    latest_uids = sorted(email_uids, reverse=True)[:FETCH_LIMIT]
+                    checked_count = len(latest_uids)
                     st.write(f"最新の未読メール {checked_count}件をチェックします。")
 
                     # メール1件あたりの進捗の割合を計算
                     progress_per_email = WEIGHT_LOOP / checked_count if checked_count > 0 else 0
+                    checked_uids = []
                     
-                    for i, email_id in enumerate(latest_ids):
+                    for i, (uid, raw_bytes) in enumerate(_fetch_messages_by_uid(mail, latest_uids, FETCH_BATCH_SIZE)):
                         # このループ開始時点でのベースとなる進捗
                         base_progress_for_this_email = (WEIGHT_CONNECT + WEIGHT_FETCH_IDS) + (i * progress_per_email)
                         
                         # メール内容取得の進捗
                         progress_bar.progress(base_progress_for_this_email, text=f"メール({i+1}/{checked_count})の内容を取得中...")
                         
-                        _, msg_data = mail.fetch(email_id, '(RFC822)')
-                        for response_part in msg_data:
-                            if isinstance(response_part, tuple):
-                                msg = email.message_from_bytes(response_part[1])
-                                source_data = get_email_contents(msg)
-                                
-                                # メール内容取得完了後の進捗 (メール1件の処理の20%を割り当て)
-                                fetch_complete_progress = base_progress_for_this_email + (progress_per_email * 0.2)
-                                progress_bar.progress(fetch_complete_progress, text=f"メール({i+1}/{checked_count})の内容取得完了")
-
-                                if source_data['body'] or source_data['attachments']:
-                                    st.write("---")
-                                    st.write(f"✅ メールID {email_id.decode()} を処理します。")
-                                    received_at_str = source_data['received_at'].strftime('%Y-%m-%d %H:%M:%S') if source_data.get('received_at') else '取得不可'
-                                    st.write(f"   受信日時: {received_at_str}")
-                                    st.write(f"   差出人: {source_data.get('from', '取得不可')}")
-                                    st.write(f"   件名: {source_data.get('subject', '取得不可')}")
-                                    
-                                    # process_single_content に進捗管理情報を渡す
-                                    # 残りの80%の進捗をこの関数に委ねる
-                                    if process_single_content(source_data, progress_bar, fetch_complete_progress, progress_per_email * 0.8):
-                                        total_processed_count += 1
-                                        mail.store(email_id, '+FLAGS', '\\Seen')
-                                else:
-                                    st.write(f"✖️ メールID {email_id.decode()} は本文も添付ファイルも無いため、スキップします。")
-                                    # スキップした場合でも、このメールの進捗は完了したことにする
-                                    final_progress_for_this_email = base_progress_for_this_email + progress_per_email
-                                    progress_bar.progress(final_progress_for_this_email, text=f"メール({i+1}/{checked_count}) スキップ完了")
+                        msg = email.message_from_bytes(raw_bytes)
+                        source_data = get_email_contents(msg)
+                        checked_uids.append(uid)
+                        
+                        # メール内容取得完了後の進捗 (メール1件の処理の20%を割り当て)
+                        fetch_complete_progress = base_progress_for_this_email + (progress_per_email * 0.2)
+                        progress_bar.progress(fetch_complete_progress, text=f"メール({i+1}/{checked_count})の内容取得完了")
+
+                        if source_data['body'] or source_data['attachments']:
+                            st.write("---")
+                            st.write(f"✅ メールUID {uid} を処理します。")
+                            received_at_str = source_data['received_at'].strftime('%Y-%m-%d %H:%M:%S') if source_data.get('received_at') else '取得不可'
+                            st.write(f"   受信日時: {received_at_str}")
+                            st.write(f"   差出人: {source_data.get('from', '取得不可')}")
+                            st.write(f"   件名: {source_data.get('subject', '取得不可')}")
+                            
+                            # process_single_content に進捗管理情報を渡す
+                            # 残りの80%の進捗をこの関数に委ねる
+                            if process_single_content(source_data, progress_bar, fetch_complete_progress, progress_per_email * 0.8):
+                                total_processed_count += 1
+                        else:
+                            st.write(f"✖️ メールUID {uid} は本文も添付ファイルも無いため、スキップします。")
+                            # スキップした場合でも、このメールの進捗は完了したことにする
+                            final_progress_for_this_email = base_progress_for_this_email + progress_per_email
+                            progress_bar.progress(final_progress_for_this_email, text=f"メール({i+1}/{checked_count}) スキップ完了")
                         
                         st.write(f"({i+1}/{checked_count}) チェック完了")
+
+                    # BODY.PEEK[] は既読を付けないため、チェックしたメールをUIDセットでまとめて既読にする
+                    if checked_uids:
+                        mail.uid('STORE', _compress_uid_set(checked_uids), '+FLAGS', '(\\Seen)')
                 
                 status.update(label="メールチェック完了", state="complete")
         finally:
@@ -937,7 +926,7 @@ def hide_match(result_id):
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute('UPDATE matching_results SET is_hidden = 1 WHERE id = %s', (result_id,))
+                cursor.execute('UPDATE matching_results SET is_hidden = 1, retired_at = NULL WHERE id = %s', (result_id,))
                 if cursor.rowcount > 0: st.toast(f"マッチング結果 (ID: {result_id}) を非表示にしました。"); conn.commit(); return True
                 else: st.warning(f"マッチング結果 (ID: {result_id}) が見つかりませんでした。"); return False
     except (Exception, psycopg2.Error) as e: st.error(f"DB更新エラー: {e}"); return False
@@ -1162,6 +1151,14 @@ def _build_meta_info_string(item_type, item_data):
     meta_parts = [f"[{display_name}: {item_data.get(key, '不明')}]" for display_name, key in meta_fields]
     return " ".join(meta_parts) + "\n---\n"
 
+def save_item_attributes(cursor, item_type: str, item_id: int, document: str):
+    """document のメタ情報から単価・勤務地・開始時期の列（item_attributes.py）を取り出して保存する。コミットは呼び出し元で行う。"""
+    table_name = 'jobs' if item_type == 'job' else 'engineers'
+    attributes = item_attributes.extract_attributes(item_type, document)
+    assignments = ", ".join(f"{column} = %s" for column in item_attributes.ATTRIBUTE_COLUMNS)
+    cursor.execute(f"UPDATE {table_name} SET {assignments} WHERE id = %s",
+                   tuple(attributes[column] for column in item_attributes.ATTRIBUTE_COLUMNS) + (item_id,))
+
 def update_match_status(match_id, new_status):
     if not match_id or not new_status: return False
 
@@ -1305,8 +1302,9 @@ def update_match_evaluation(match_id, llm_result):
 def re_evaluate_and_match_single_engineer(engineer_id, target_rank='B', target_count=5):
     """
     【新しい仕様】
-    指定された技術者の情報を最新化し、既存のマッチングをクリア後、
+    指定された技術者の情報を最新化し、
     案件を最新順に処理し、目標ランク以上のマッチングが目標件数に達したら処理を終了する。
+    既存のマッチング結果は消さず、内容が変わっていない組は前回の評価を使う（_diff_rematch）。
     """
     if not engineer_id:
         st.error("技術者IDが指定されていません。")
@@ -1359,85 +1357,31 @@ def re_evaluate_and_match_single_engineer(engineer_id, target_rank='B', target_c
                 
                 # 2. engineersテーブルのdocumentを更新
                 cursor.execute("UPDATE engineers SET document = %s WHERE id = %s", (engineer_doc, engineer_id))
+                save_item_attributes(cursor, 'engineer', engineer_id, engineer_doc)
                 st.write("✅ 技術者のAI要約情報を更新しました。")
 
-                # 3. 既存のマッチング結果を削除
-                cursor.execute("DELETE FROM matching_results WHERE engineer_id = %s", (engineer_id,))
-                st.write(f"🗑️ 技術者ID:{engineer_id} の既存マッチング結果をクリアしました。")
-
-                # 4. マッチング対象の全案件を最新順に取得
-                st.write("🔄 最新の案件から順にマッチング処理を開始します...")
-                #cursor.execute("SELECT id, document, project_name FROM jobs WHERE is_hidden = 0 ORDER BY created_at DESC")
-                cursor.execute("SELECT id, document, project_name, source_data_json FROM jobs WHERE is_hidden = 0 ORDER BY created_at DESC")
-
+                # 3. マッチング対象の案件を最新順に取得
+                # 技術者の希望単価が案件単価（price_min）を5万円より上回る案件は、SQL の段階で除外する
+                st.write("🔄 最新の案件から順にマッチング処理を開始します（既存のマッチング結果は消さず、変更のない組は前回の評価を使います）...")
+                cursor.execute("""
+                    SELECT id, document, project_name AS name, price_min FROM jobs
+                    WHERE is_hidden = 0 AND (%(price)s::real IS NULL OR price_min IS NULL OR price_min + 5 >= %(price)s::real)
+                    ORDER BY created_at DESC
+                """, {"price": engineer_price})
                 all_active_jobs = cursor.fetchall()
-                if not all_active_jobs:
-                    st.warning("マッチング対象の案件がありません。")
-                    conn.commit()
-                    return True
 
-                st.write(f"  - 対象案件数: {len(all_active_jobs)}件")
+                st.write(f"  - 対象案件数（単価条件で絞り込み後）: {len(all_active_jobs)}件")
                 st.write(f"  - 終了条件: 「**{target_rank}**」ランク以上のマッチングが **{target_count}** 件見つかった時点")
 
-                # 5. ループでマッチング処理を実行
-                found_count = 0
-                processed_count = 0
-                now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                for job in all_active_jobs:
-                    processed_count += 1
-
-                    # ▼▼▼【単価フィルタリングロジック】▼▼▼
-                    try:
-                        job_source_data = json.loads(job['source_data_json'])
-                        job_price_str = job_source_data.get("unit_price")
-                        job_price = _extract_price_from_string(job_price_str)
-                    except (json.JSONDecodeError, TypeError):
-                        job_price = None
-
-                    if job_price is not None and engineer_price is not None:
-                        if engineer_price > job_price + 5:
-                            st.write(f"  ({processed_count}/{len(all_active_jobs)}) 案件『{job['project_name']}』 -> 単価不一致のためスキップ (案件:{job_price}万, 技術者:{engineer_price}万)")
-                            continue
-                    # ▲▲▲【単価フィルタリングここまで】▲▲▲
-
-                    st.write(f"  ({processed_count}/{len(all_active_jobs)}) 案件『{job['project_name']}』とマッチング中...")
-                    
-                    # LLMによるマッチング評価を実行
-                    llm_result = get_match_summary_with_llm(job['document'], engineer_doc)
-
-                    if llm_result and 'summary' in llm_result:
-                        grade = llm_result.get('summary')
-                        positive_points = json.dumps(llm_result.get('positive_points', []), ensure_ascii=False)
-                        concern_points = json.dumps(llm_result.get('concern_points', []), ensure_ascii=False)
-                        
-                        # 類似度スコアはベクトル検索を行わないため、ダミー値（例: 0）を入れるか、NULL許容にする必要があります。
-                        # ここでは score を 0 とします。
-                        score = 0.0
-
-                        # DBに保存（ランクに関わらず一旦すべて保存する方が後々の分析に役立つ場合もあるが、今回はヒットしたものだけ保存）
-                        if grade in valid_ranks:
-                            try:
-                                cursor.execute(
-                                    'INSERT INTO matching_results (job_id, engineer_id, score, created_at, grade, positive_points, concern_points,status,is_hidden) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                    (job['id'], engineer_id, score, now_str, grade, positive_points, concern_points,'新規',0)
-                                )
-                                st.success(f"    -> マッチング評価: **{grade}** ... ✅ ヒット！DBに保存しました。")
-                                found_count += 1
-                            except Exception as e:
-                                st.error(f"    -> DB保存中にエラー: {e}")
-                        else:
-                            st.write(f"    -> マッチング評価: **{grade}** ... スキップ")
-                    else:
-                        st.warning(f"    -> LLM評価失敗のためスキップ")
+                # 4. 差分の再マッチング
+                stats = {}
+                for message in _diff_rematch(conn, 'engineer', engineer_id, engineer_doc, all_active_jobs, len(all_active_jobs),
+                                             valid_ranks, target_count, stats):
+                    st.write(message)
 
-                    # 終了条件をチェック
-                    if found_count >= target_count:
-                        st.success(f"🎉 目標の {target_count} 件に到達したため、処理を終了します。")
-                        break
-                
-                if found_count < target_count:
-                    st.info(f"すべての案件とのマッチングが完了しました。(ヒット数: {found_count}件)")
+                if stats['found'] < target_count:
+                    st.info(f"すべての案件とのマッチングが完了しました。(ヒット数: {stats['found']}件)")
+                st.write(_diff_rematch_summary(stats))
 
             conn.commit()
             return True
@@ -1474,103 +1418,100 @@ def save_proposal_text(match_id, text):
 
 # backend.py の get_dashboard_data 関数をこちらに置き換えてください
 
+_RANK_ORDER = ['S', 'A', 'B', 'C', 'D']
+
+@st.cache_data(ttl=300)
 def get_dashboard_data():
-    """ダッシュボード表示に必要なデータをDBから取得・集計する"""
+    """ダッシュボード表示に必要なデータをDBから取得・集計する（5分間キャッシュ）"""
     conn = get_db_connection()
     try:
-        #@st.cache_data(ttl=3600) # 5分間キャッシュ
-        def fetch_data_from_db():
-            # 【変更点1】 users テーブルも読み込む
-            # 【変更点2】 SQLでJOINして担当者名(username)を取得する
-            jobs_sql = """
-                SELECT j.id, j.created_at, u.username as assignee_name
-                FROM jobs j
-                LEFT JOIN users u ON j.assigned_user_id = u.id
-            """
-            engineers_sql = """
-                SELECT e.id, e.created_at, u.username as assignee_name
-                FROM engineers e
-                LEFT JOIN users u ON e.assigned_user_id = u.id
-            """
-            matches_sql = """
-                SELECT m.id, m.created_at, m.grade, u_job.username as job_assignee, u_eng.username as engineer_assignee
-                FROM matching_results m
-                LEFT JOIN jobs j ON m.job_id = j.id
-                LEFT JOIN engineers e ON m.engineer_id = e.id
-                LEFT JOIN users u_job ON j.assigned_user_id = u_job.id
-                LEFT JOIN users u_eng ON e.assigned_user_id = u_eng.id
-            """
-            jobs_df = pd.read_sql(jobs_sql, conn)
-            engineers_df = pd.read_sql(engineers_sql, conn)
-            matches_df = pd.read_sql(matches_sql, conn)
-            
-            return jobs_df, engineers_df, matches_df
-
-        jobs_df, engineers_df, matches_df = fetch_data_from_db()
-
-        # --- 1. サマリー指標 (変更なし) ---
-        total_jobs = len(jobs_df)
-        total_engineers = len(engineers_df)
-        total_matches = len(matches_df)
-
-        jobs_df['created_at'] = pd.to_datetime(jobs_df['created_at'], errors='coerce')
-        engineers_df['created_at'] = pd.to_datetime(engineers_df['created_at'], errors='coerce')
-        
-        now = pd.Timestamp.now()
-        jobs_this_month = len(jobs_df.dropna(subset=['created_at'])[jobs_df['created_at'].dt.month == now.month])
-        engineers_this_month = len(engineers_df.dropna(subset=['created_at'])[engineers_df['created_at'].dt.month == now.month])
-
-        summary_metrics = {
-            "total_jobs": total_jobs,
-            "total_engineers": total_engineers,
-            "total_matches": total_matches,
-            "jobs_this_month": jobs_this_month,
-            "engineers_this_month": engineers_this_month,
-        }
+        return compute_dashboard_data(conn)
+    finally:
+        if conn:
+            conn.close()
 
-        # --- 2. AI評価ランクの割合 (変更なし) ---
-        if not matches_df.empty:
-            rank_counts = matches_df['grade'].value_counts().reindex(['S', 'A', 'B', 'C', 'D'], fill_value=0)
+def compute_dashboard_data(conn):
+    """
+    get_dashboard_data の本体。集計は SQL（GROUP BY）で行い、グラフに使う集計済みの行だけを受け取る
+    （全件を pandas に読み込まないため、メモリ使用量は履歴の量によらない）。
+    """
+    with conn.cursor() as cur:
+        # --- 1. サマリー指標 ---
+        # 古いスキーマでは created_at が TEXT のまま残っているため、比較・集計の前に timestamp へキャストする（004 と同じ扱い）
+        cur.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM jobs) AS total_jobs,
+                (SELECT COUNT(*) FROM engineers) AS total_engineers,
+                (SELECT COUNT(*) FROM matching_results) AS total_matches,
+                (SELECT COUNT(*) FROM jobs WHERE created_at::timestamp >= date_trunc('month', now())) AS jobs_this_month,
+                (SELECT COUNT(*) FROM engineers WHERE created_at::timestamp >= date_trunc('month', now())) AS engineers_this_month
+        """)
+        summary_metrics = dict(cur.fetchone())
+
+        # --- 2. AI評価ランクの割合 ---
+        cur.execute("SELECT grade, COUNT(*) AS count FROM matching_results WHERE grade IS NOT NULL GROUP BY grade")
+        rank_counts = pd.Series({row['grade']: row['count'] for row in cur.fetchall()}, dtype=int).reindex(_RANK_ORDER, fill_value=0)
+
+        # --- 3. 時系列データ（日別の件数。登録の無い日は 0 で埋める）---
+        cur.execute("""
+            SELECT '案件登録数' AS series, created_at::timestamp::date AS day, COUNT(*) AS count FROM jobs WHERE created_at IS NOT NULL GROUP BY 2
+            UNION ALL
+            SELECT '技術者登録数', created_at::timestamp::date, COUNT(*) FROM engineers WHERE created_at IS NOT NULL GROUP BY 2
+            UNION ALL
+            SELECT 'マッチング生成数', created_at::timestamp::date, COUNT(*) FROM matching_results WHERE created_at IS NOT NULL GROUP BY 2
+        """)
+        daily_rows = [dict(row) for row in cur.fetchall()]
+        series_columns = ['案件登録数', '技術者登録数', 'マッチング生成数']
+        if daily_rows:
+            daily_df = pd.DataFrame(daily_rows)
+            daily_df['day'] = pd.to_datetime(daily_df['day'])
+            time_series_df = daily_df.pivot_table(index='day', columns='series', values='count', aggfunc='sum')
+            full_range = pd.date_range(time_series_df.index.min(), time_series_df.index.max(), freq='D')
+            time_series_df = time_series_df.reindex(index=full_range, columns=series_columns).fillna(0).astype(int)
+            time_series_df.index.name = 'created_at'
         else:
-            rank_counts = pd.Series([0, 0, 0, 0, 0], index=['S', 'A', 'B', 'C', 'D'])
-
-        # --- 3. 時系列データ (変更なし) ---
-        matches_df['created_at'] = pd.to_datetime(matches_df['created_at'], errors='coerce')
-        jobs_ts = jobs_df.dropna(subset=['created_at']).set_index('created_at')
-        engineers_ts = engineers_df.dropna(subset=['created_at']).set_index('created_at')
-        matches_ts = matches_df.dropna(subset=['created_at']).set_index('created_at')
-        daily_jobs = jobs_ts.resample('D').size().rename('案件登録数')
-        daily_engineers = engineers_ts.resample('D').size().rename('技術者登録数')
-        daily_matches = matches_ts.resample('D').size().rename('マッチング生成数')
-        time_series_df = pd.concat([daily_jobs, daily_engineers, daily_matches], axis=1).fillna(0).astype(int)
-        
-        # --- 4. 担当者別分析データ (★ここからが新しいコード) ---
-        # 担当者が未割り当て(None)の場合を「未担当」に置き換える
-        jobs_df['assignee_name'].fillna('未担当', inplace=True)
-        engineers_df['assignee_name'].fillna('未担当', inplace=True)
-        
-        # 担当者ごとの担当件数を集計
-        job_counts_by_assignee = jobs_df['assignee_name'].value_counts().rename('案件担当数')
-        engineer_counts_by_assignee = engineers_df['assignee_name'].value_counts().rename('技術者担当数')
-        assignee_counts_df = pd.concat([job_counts_by_assignee, engineer_counts_by_assignee], axis=1).fillna(0).astype(int)
-        
+            time_series_df = pd.DataFrame(columns=series_columns, dtype=int)
+
+        # --- 4. 担当者別分析データ ---
+        # 担当者が未割り当て(None)の場合は「未担当」として集計する
+        cur.execute("""
+            SELECT '案件担当数' AS kind, COALESCE(u.username, '未担当') AS assignee_name, COUNT(*) AS count
+            FROM jobs j LEFT JOIN users u ON j.assigned_user_id = u.id GROUP BY 2
+            UNION ALL
+            SELECT '技術者担当数', COALESCE(u.username, '未担当'), COUNT(*)
+            FROM engineers e LEFT JOIN users u ON e.assigned_user_id = u.id GROUP BY 2
+        """)
+        assignee_rows = [dict(row) for row in cur.fetchall()]
+        if assignee_rows:
+            assignee_counts_df = pd.DataFrame(assignee_rows).pivot_table(index='assignee_name', columns='kind', values='count', aggfunc='sum')
+            assignee_counts_df = assignee_counts_df.reindex(columns=['案件担当数', '技術者担当数']).fillna(0).astype(int)
+            assignee_counts_df.index.name = None
+            assignee_counts_df.columns.name = None
+        else:
+            assignee_counts_df = pd.DataFrame(columns=['案件担当数', '技術者担当数'], dtype=int)
+
         # 担当者ごとのマッチングランク分布を集計
-        # 案件担当者と技術者担当者のどちらかが設定されていれば、その担当者の成果とみなす（coalesce的な処理）
-        matches_df['responsible_person'] = matches_df['job_assignee'].fillna(matches_df['engineer_assignee']).fillna('未担当')
-        match_rank_by_assignee = pd.crosstab(
-            index=matches_df['responsible_person'],
-            columns=matches_df['grade']
-        )
+        # 案件担当者と技術者担当者のどちらかが設定されていれば、その担当者の成果とみなす
+        cur.execute("""
+            SELECT COALESCE(u_job.username, u_eng.username, '未担当') AS responsible_person, m.grade, COUNT(*) AS count
+            FROM matching_results m
+            LEFT JOIN jobs j ON m.job_id = j.id
+            LEFT JOIN engineers e ON m.engineer_id = e.id
+            LEFT JOIN users u_job ON j.assigned_user_id = u_job.id
+            LEFT JOIN users u_eng ON e.assigned_user_id = u_eng.id
+            WHERE m.grade IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        rank_rows = [dict(row) for row in cur.fetchall()]
+        if rank_rows:
+            match_rank_by_assignee = pd.DataFrame(rank_rows).pivot_table(index='responsible_person', columns='grade', values='count', aggfunc='sum', fill_value=0)
+        else:
+            match_rank_by_assignee = pd.DataFrame(index=pd.Index([], name='responsible_person'))
         # S,A,B,C,Dカラムが必ず存在するようにreindex
-        all_ranks = ['S', 'A', 'B', 'C', 'D']
-        match_rank_by_assignee = match_rank_by_assignee.reindex(columns=all_ranks, fill_value=0)
-
-        # 戻り値に担当者別データを追加
-        return summary_metrics, rank_counts, time_series_df, assignee_counts_df, match_rank_by_assignee
+        match_rank_by_assignee = match_rank_by_assignee.reindex(columns=_RANK_ORDER, fill_value=0).astype(int)
 
-    finally:
-        if conn:
-            conn.close()
+    # 戻り値に担当者別データを追加
+    return summary_metrics, rank_counts, time_series_df, assignee_counts_df, match_rank_by_assignee
 
 
 
@@ -1691,8 +1632,9 @@ def delete_match(match_id):
 def re_evaluate_and_match_single_job(job_id, target_rank='B', target_count=5):
     """
     【新しい関数】
-    指定された案件の情報を最新化し、既存のマッチングをクリア後、
+    指定された案件の情報を最新化し、
     技術者を最新順に処理し、目標ランク以上のマッチングが目標件数に達したら処理を終了する。
+    既存のマッチング結果は消さず、内容が変わっていない組は前回の評価を使う（_diff_rematch）。
     """
     if not job_id:
         st.error("案件IDが指定されていません。")
@@ -1741,79 +1683,31 @@ def re_evaluate_and_match_single_job(job_id, target_rank='B', target_count=5):
                 
                 # 2. jobsテーブルのdocumentを更新
                 cursor.execute("UPDATE jobs SET document = %s WHERE id = %s", (job_doc, job_id))
+                save_item_attributes(cursor, 'job', job_id, job_doc)
                 st.write("✅ 案件のAI要約情報を更新しました。")
 
-                # 3. 既存のマッチング結果を削除
-                cursor.execute("DELETE FROM matching_results WHERE job_id = %s", (job_id,))
-                st.write(f"🗑️ 案件ID:{job_id} の既存マッチング結果をクリアしました。")
-
-                # 4. マッチング対象の全技術者を最新順に取得
-                st.write("🔄 最新の技術者から順にマッチング処理を開始します...")
-                cursor.execute("SELECT id, document, name, source_data_json FROM engineers WHERE is_hidden = 0 ORDER BY created_at DESC")
+                # 3. マッチング対象の技術者を最新順に取得
+                # 希望単価（price_min）が案件単価を5万円より上回る技術者は、SQL の段階で除外する
+                st.write("🔄 最新の技術者から順にマッチング処理を開始します（既存のマッチング結果は消さず、変更のない組は前回の評価を使います）...")
+                cursor.execute("""
+                    SELECT id, document, name, price_min FROM engineers
+                    WHERE is_hidden = 0 AND (%(price)s::real IS NULL OR price_min IS NULL OR price_min <= %(price)s::real + 5)
+                    ORDER BY created_at DESC
+                """, {"price": job_price})
                 all_active_engineers = cursor.fetchall()
-                if not all_active_engineers:
-                    st.warning("マッチング対象の技術者がいません。")
-                    conn.commit()
-                    return True
 
-                st.write(f"  - 対象技術者数: {len(all_active_engineers)}名")
+                st.write(f"  - 対象技術者数（単価条件で絞り込み後）: {len(all_active_engineers)}名")
                 st.write(f"  - 終了条件: 「**{target_rank}**」ランク以上のマッチングが **{target_count}** 件見つかった時点")
 
-                # 5. ループでマッチング処理を実行
-                found_count = 0
-                processed_count = 0
-                now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                # 4. 差分の再マッチング
+                stats = {}
+                for message in _diff_rematch(conn, 'job', job_id, job_doc, all_active_engineers, len(all_active_engineers),
+                                             valid_ranks, target_count, stats):
+                    st.write(message)
 
-                for engineer in all_active_engineers:
-                    processed_count += 1
-
-                    # ▼▼▼【単価フィルタリングロジック】▼▼▼
-                    try:
-                        engineer_source_data = json.loads(engineer['source_data_json'])
-                        engineer_price_str = engineer_source_data.get("desired_salary")
-                        engineer_price = _extract_price_from_string(engineer_price_str)
-                    except (json.JSONDecodeError, TypeError):
-                        engineer_price = None
-
-                    # 案件単価と技術者希望単価の両方が取得できた場合のみ比較
-                    if job_price is not None and engineer_price is not None:
-                        # 技術者の希望単価が案件単価を5万円以上上回る場合はスキップ
-                        if engineer_price > job_price + 5:
-                            st.write(f"  ({processed_count}/{len(all_active_engineers)}) 技術者『{engineer['name']}』 -> 単価不一致のためスキップ (案件:{job_price}万, 技術者:{engineer_price}万)")
-                            continue # 次の技術者へ
-                    # ▲▲▲【単価フィルタリングここまで】▲▲▲
-
-                    st.write(f"  ({processed_count}/{len(all_active_engineers)}) 技術者『{engineer['name']}』とマッチング中...")
-                    
-                    llm_result = get_match_summary_with_llm(job_doc, engineer['document'])
-
-                    if llm_result and 'summary' in llm_result:
-                        grade = llm_result.get('summary')
-                        positive_points = json.dumps(llm_result.get('positive_points', []), ensure_ascii=False)
-                        concern_points = json.dumps(llm_result.get('concern_points', []), ensure_ascii=False)
-                        score = 0.0
-
-                        if grade in valid_ranks:
-                            try:
-                                cursor.execute(
-                                    'INSERT INTO matching_results (job_id, engineer_id, score, created_at, grade, positive_points, concern_points,status,is_hidden) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                    (job_id, engineer['id'], score, now_str, grade, positive_points, concern_points,'新規',0)
-                                )
-                                st.success(f"    -> マッチング評価: **{grade}** ... ✅ ヒット！DBに保存しました。")
-                                found_count += 1
-                            except Exception as e:
-                                st.error(f"    -> DB保存中にエラー: {e}")
-                        else:
-                            st.write(f"    -> マッチング評価: **{grade}** ... スキップ")
-                    else:
-                        st.warning(f"    -> LLM評価失敗のためスキップ")
-
-                    if found_count >= target_count:
-                        st.success(f"🎉 目標の {target_count} 件に到達したため、処理を終了します。")
-                        break
-                
-                if found_count < target_count:
-                    st.info(f"すべての技術者とのマッチングが完了しました。(ヒット数: {found_count}件)")
+                if stats['found'] < target_count:
+                    st.info(f"すべての技術者とのマッチングが完了しました。(ヒット数: {stats['found']}件)")
+                st.write(_diff_rematch_summary(stats))
 
             conn.commit()
             return True
@@ -1830,25 +1724,7 @@ def _extract_price_from_string(price_str: str) -> float | None:
     "80万円", "75万～85万", "〜90" のような文字列から数値（万円単位）を抽出する。
     範囲の場合は下限値を返す。抽出できない場合は None を返す。
     """
-    if not price_str or not isinstance(price_str, str):
-        return None
-    
-    # 全角数字を半角に、全角マイナスを半角に変換
-    price_str = price_str.translate(str.maketrans("０１２３４５６７８９－", "0123456789-"))
-    
-    # "万"や"円"などの文字を削除
-    price_str = price_str.replace("万", "").replace("円", "").replace(",", "")
-    
-    # 数字（小数点含む）をすべて抽出
-    numbers = re.findall(r'(\d+\.?\d*)', price_str)
-    
-    if numbers:
-        # 抽出された数字の中から最小のものを返す（例: "75~85" -> 75）
-        try:
-            return min([float(n) for n in numbers])
-        except (ValueError, TypeError):
-            return None
-    return None
+    return item_attributes.parse_price_range(price_str)[0]
 
 
 # backend.py の get_filtered_item_ids 関数をこちらに置き換えてください
@@ -1881,15 +1757,12 @@ def get_filtered_item_ids(
     if not show_hidden:
         where_clauses.append("e.is_hidden = 0")
 
-    if keyword:
-        joins += " LEFT JOIN users u ON e.assigned_user_id = u.id"
-        keywords_list = [k.strip() for k in keyword.split() if k.strip()]
-        keyword_clauses = []
-        for kw in keywords_list:
-            keyword_clauses.append(f"(e.document ILIKE %s OR e.{name_column} ILIKE %s OR u.username ILIKE %s)")
-            param = f'%{kw}%'
-            params.extend([param, param, param])
-        where_clauses.append(f"({' AND '.join(keyword_clauses)})")
+    # 名前・担当者名・本文をまとめた search_text（text_search.py）で、すべてのキーワードを含むものに絞り込む
+    keywords_list = text_search.split_keywords(keyword) if keyword else []
+    if keywords_list:
+        keyword_clause, keyword_params = text_search.keyword_filter_clause("e", keywords_list)
+        where_clauses.append(keyword_clause)
+        params.extend(keyword_params)
 
     if assigned_user_ids:
         real_user_ids = [uid for uid in assigned_user_ids if uid != -1]
@@ -1949,7 +1822,13 @@ def get_filtered_item_ids(
     order_by_direction = order_map.get(sort_order, "DESC")
     nulls_order = "NULLS LAST" if order_by_direction == "DESC" else "NULLS FIRST"
     
-    final_query += f" ORDER BY {order_by_column} {order_by_direction} {nulls_order}"
+    if sort_column == "関連度" and keywords_list:
+        # 関連度順（同じ関連度なら新しい順）。キーワードが無いときは登録日順と同じになる
+        relevance_sql, relevance_params = text_search.relevance_expression("e", name_column, keywords_list)
+        final_query += f" ORDER BY ({relevance_sql}) {order_by_direction}, e.id DESC"
+        params.extend(relevance_params)
+    else:
+        final_query += f" ORDER BY {order_by_column} {order_by_direction} {nulls_order}"
 
     # --- DB実行 ---
     conn = get_db_connection()
@@ -1973,6 +1852,118 @@ def get_filtered_item_ids(
 
 
 
+# ==============================================================================
+# ダッシュボードのマッチング結果一覧（1_ダッシュボード.py）
+# ==============================================================================
+# 一覧はキーセット方式で1ページずつ読む。並び順は AI評価（grade_priority: S=5 … D=1）・作成日時・ID の降順で、
+# 次のページは前のページの最後の行の (grade_priority, created_at, id) より後ろの行を
+# idx_matching_results_list_order（migrations/005_dashboard_list_columns.sql）の範囲スキャンで読む。
+# 本文は一覧に出す冒頭150文字だけを SQL で切り出して返す。
+
+DASHBOARD_SUMMARY_LENGTH = 150
+
+def _document_summary_sql(column: str) -> str:
+    """本文の「---」区切り以降（無ければ全体）の改行を除いた冒頭部分を返す SQL 式。"""
+    body = f"substr({column}, CASE WHEN strpos({column}, E'\\n---\\n') > 0 THEN strpos({column}, E'\\n---\\n') + 5 ELSE 1 END)"
+    return f"left(replace(replace({body}, E'\\n', ' '), E'\\r', ''), {DASHBOARD_SUMMARY_LENGTH})"
+
+def _dashboard_match_filters(filters: dict) -> tuple:
+    """
+    一覧の絞り込み条件を WHERE 句の断片とパラメータにする。
+    filters のキー: job_assignee / engineer_assignee（"すべて" なら絞り込まない）、statuses、grades、keyword、
+    status_options（キーワードをステータス名としても探すための候補）、exclude_foreign_restricted、show_hidden
+    """
+    where_clauses, params = [], []
+    if filters.get("job_assignee", "すべて") != "すべて":
+        where_clauses.append("job_user.username = %s")
+        params.append(filters["job_assignee"])
+    if filters.get("engineer_assignee", "すべて") != "すべて":
+        where_clauses.append("eng_user.username = %s")
+        params.append(filters["engineer_assignee"])
+    if filters.get("statuses"):
+        where_clauses.append("r.status = ANY(%s)")
+        params.append(list(filters["statuses"]))
+    if filters.get("grades"):
+        where_clauses.append("r.grade = ANY(%s)")
+        params.append(list(filters["grades"]))
+    keyword = (filters.get("keyword") or "").strip()
+    if keyword:
+        # 案件・技術者の search_text（名前・担当者名・本文）とステータス名で絞り込む（text_search.py）
+        keyword_clause, keyword_params = text_search.matching_results_keyword_clause("r", keyword, filters.get("status_options", []))
+        where_clauses.append(keyword_clause)
+        params.extend(keyword_params)
+    if filters.get("exclude_foreign_restricted"):
+        # 「外国籍不可」「日本人」の案件には、国籍が日本の技術者だけを残す
+        where_clauses.append("(NOT j.requires_japanese_national OR e.is_japanese_national)")
+    if not filters.get("show_hidden"):
+        where_clauses.append("((r.is_hidden = 0 OR r.is_hidden IS NULL) AND j.is_hidden = 0 AND e.is_hidden = 0)")
+    return where_clauses, params
+
+_DASHBOARD_MATCH_FROM = """
+    FROM matching_results r
+    JOIN jobs j ON r.job_id = j.id
+    JOIN engineers e ON r.engineer_id = e.id
+    LEFT JOIN users job_user ON j.assigned_user_id = job_user.id
+    LEFT JOIN users eng_user ON e.assigned_user_id = eng_user.id
+"""
+
+def get_dashboard_match_page(filters: dict, after: tuple | None = None, limit: int = 10) -> tuple:
+    """
+    ダッシュボードの一覧を1ページ分だけ返す。
+    after には前のページの戻り値の next_cursor を渡す（最初のページは None）。
+    戻り値は (行のリスト, next_cursor)。次のページが無ければ next_cursor は None。
+    """
+    where_clauses, params = _dashboard_match_filters(filters)
+    if after:
+        where_clauses.append("(r.grade_priority, r.created_at, r.id) < (%s, %s, %s)")
+        params.extend(after)
+
+    query = f"""
+        SELECT 
+            r.id as res_id, r.job_id, j.project_name, j.is_hidden as job_is_hidden,
+            r.engineer_id, e.name as engineer_name, e.is_hidden as engineer_is_hidden,
+            r.created_at, r.is_hidden as match_is_hidden, r.grade, r.grade_priority, r.status,
+            COALESCE(job_user.username, '未割当') as job_assignee,
+            COALESCE(eng_user.username, '未割当') as engineer_assignee,
+            (r.feedback_status IS NOT NULL AND r.feedback_status != '') AS has_feedback,
+            {_document_summary_sql('j.document')} as job_summary,
+            {_document_summary_sql('e.document')} as eng_summary
+        {_DASHBOARD_MATCH_FROM}
+        {"WHERE " + " AND ".join(where_clauses) if where_clauses else ""}
+        ORDER BY r.grade_priority DESC, r.created_at DESC, r.id DESC
+        LIMIT %s
+    """
+    params.append(limit + 1)
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            rows = [dict(row) for row in cursor.fetchall()]
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = (rows[-1]['grade_priority'], rows[-1]['created_at'], rows[-1]['res_id']) if has_more else None
+    return rows, next_cursor
+
+def count_dashboard_matches(filters: dict, cap: int = 1000) -> int:
+    """一覧の件数。cap 件を超える分は数えない（cap + 1 が返れば「cap件以上」）。"""
+    where_clauses, params = _dashboard_match_filters(filters)
+    query = f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 {_DASHBOARD_MATCH_FROM}
+            {"WHERE " + " AND ".join(where_clauses) if where_clauses else ""}
+            LIMIT %s
+        ) AS limited
+    """
+    params.append(cap + 1)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            return cursor.fetchone()[0]
+
+
+
+
 def get_items_by_ids(item_type: str, ids: list) -> list:
     """
     【修正版】
@@ -2818,6 +2809,12 @@ def update_auto_match_last_processed_ids(request_id, last_job_id, last_engineer_
     params.append(request_id)
     sql = f"UPDATE auto_matching_requests SET {', '.join(updates)} WHERE id = %s"
     
+    # 接続が渡された場合は呼び出し元のトランザクションに含め、コミットは呼び出し元に任せる
+    if conn is not None:
+        with conn.cursor() as cur:
+            cur.execute(sql, tuple(params))
+        return True
+
     with get_db_connection() as conn:
         try:
             with conn.cursor() as cur:
@@ -2830,19 +2827,24 @@ def update_auto_match_last_processed_ids(request_id, last_job_id, last_engineer_
             return False
         
 
-def create_or_update_match_record(job_id, engineer_id, score, grade, llm_result, conn=None):
+def create_or_update_match_record(job_id, engineer_id, score, grade, llm_result, conn=None, reset_status=True):
 
     """
     matching_resultsテーブルにレコードを挿入または更新する（UPSERT）。
     成功した場合は、作成/更新されたレコードのIDを返す。
+    conn が渡された場合は呼び出し元のトランザクション内で実行し、コミットは呼び出し元に任せる。
+    reset_status=False の場合、既存のレコードは評価だけを更新し、ステータスと作成日時はそのまま残す（差分の再マッチング用）。
     """
     # llm_resultからポジティブ/懸念点をJSON文字列に変換
     positive_points = json.dumps(llm_result.get('positive_points', []), ensure_ascii=False)
     concern_points = json.dumps(llm_result.get('concern_points', []), ensure_ascii=False)
     now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
+    # 再評価時は作成日時も最新にし、ステータスをリセットする（reset_status=False の場合は残す）
+    reset_columns = ", created_at = EXCLUDED.created_at, status = '新規'" if reset_status else ""
+
     # ON CONFLICT句を使ったUPSERT文
-    sql = """
+    sql = f"""
         INSERT INTO matching_results (
             job_id, engineer_id, score, created_at, grade, 
             positive_points, concern_points, status
@@ -2853,22 +2855,33 @@ def create_or_update_match_record(job_id, engineer_id, score, grade, llm_result,
             score = EXCLUDED.score,
             grade = EXCLUDED.grade,
             positive_points = EXCLUDED.positive_points,
-            concern_points = EXCLUDED.concern_points,
-            created_at = EXCLUDED.created_at, -- 更新日時も最新にする
-            status = '新規' -- 再評価時はステータスをリセット
+            concern_points = EXCLUDED.concern_points{reset_columns}
         RETURNING id;
     """
     
+    params = (job_id, engineer_id, score, now_str, grade, positive_points, concern_points)
+
+    if conn is not None:
+        # 1件の失敗で呼び出し元のトランザクション全体が中断されないよう、SAVEPOINTで囲む
+        with conn.cursor() as cur:
+            cur.execute("SAVEPOINT match_upsert")
+            try:
+                cur.execute(sql, params)
+                result = cur.fetchone()
+                cur.execute("RELEASE SAVEPOINT match_upsert")
+                return result['id'] if result else None
+            except psycopg2.Error as e:
+                print(f"Error in create_or_update_match_record: {e}")
+                cur.execute("ROLLBACK TO SAVEPOINT match_upsert")
+                return None
+
     conn = get_db_connection()
     if not conn:
         return None
         
     try:
         with conn.cursor() as cur:
-            cur.execute(sql, (
-                job_id, engineer_id, score, now_str, grade, 
-                positive_points, concern_points
-            ))
+            cur.execute(sql, params)
             result = cur.fetchone()
         conn.commit()
         
@@ -2947,6 +2960,7 @@ def get_live_dashboard_data():
     """
     【タイムゾーン対応・完全リファクタリング版】
     経営者向けライブモニタリングダッシュボード用のデータをまとめて取得する。
+    件数は集計テーブル（migrations/004_kpi_rollups.sql）から読むため、履歴の量によらず一定の時間で返る。
     """
     data = {
         "jobs_today": 0, "engineers_today": 0, "processed_items_today": 0,
@@ -2970,50 +2984,48 @@ def get_live_dashboard_data():
             # JSTでの「今日の午前0時」（naiveオブジェクト）
             today_start_jst_naive = now_in_jst.replace(hour=0, minute=0, second=0, microsecond=0).replace(tzinfo=None)
             
-            # JSTでの「明日の午前0時」（naiveオブジェクト）
-            tomorrow_start_jst_naive = today_start_jst_naive + timedelta(days=1)
-            
             # JSTでの「今月の1日」（naiveオブジェクト）
             this_month_start_jst_naive = today_start_jst_naive.replace(day=1)
 
             # --- 2. 各種KPIの集計（「JSTでの今日」基準）---
-            
+            # 件数は migrations/004_kpi_rollups.sql の集計テーブルから読む。
+            # 先に kpi_fold() で、トリガーが記録した未反映の増減を集計テーブルへ反映する。
+            cur.execute("SELECT kpi_fold()")
+            conn.commit()
+
+            cur.execute("SELECT metric, count FROM kpi_daily_counts WHERE day = %s", (today_start_jst_naive.date(),))
+            today_counts = {row['metric']: row['count'] for row in cur.fetchall()}
+
             # 本日登録された案件・技術者の数
-            cur.execute("SELECT COUNT(*) FROM jobs WHERE is_hidden = 0 AND created_at >= %s AND created_at < %s", (today_start_jst_naive, tomorrow_start_jst_naive))
-            data["jobs_today"] = cur.fetchone()['count']
-            
-            cur.execute("SELECT COUNT(*) FROM engineers WHERE is_hidden = 0 AND created_at >= %s AND created_at < %s", (today_start_jst_naive, tomorrow_start_jst_naive))
-            data["engineers_today"] = cur.fetchone()['count']
-            
+            data["jobs_today"] = today_counts.get('jobs', 0)
+            data["engineers_today"] = today_counts.get('engineers', 0)
             data["processed_items_today"] = data["jobs_today"] + data["engineers_today"]
 
             # 本日作成されたマッチングの総数
-            cur.execute("SELECT COUNT(*) FROM matching_results WHERE is_hidden = 0 AND created_at >= %s AND created_at < %s", (today_start_jst_naive, tomorrow_start_jst_naive))
-            data["new_matches_today"] = cur.fetchone()['count']
+            data["new_matches_today"] = today_counts.get('matches', 0)
 
             # 本日「採用」にステータス変更された件数
-            cur.execute("SELECT COUNT(*) FROM matching_results WHERE status = '採用' AND status_updated_at >= %s AND status_updated_at < %s", (today_start_jst_naive, tomorrow_start_jst_naive))
-            data["adopted_count_today"] = cur.fetchone()['count']
+            data["adopted_count_today"] = today_counts.get('adopted', 0)
 
             # 本日のAIアクティビティ
-            cur.execute("SELECT activity_type, COUNT(*) as count FROM ai_activity_log WHERE created_at >= %s AND created_at < %s GROUP BY activity_type", (today_start_jst_naive, tomorrow_start_jst_naive))
-            for row in cur.fetchall():
-                data["ai_activity_counts"][row['activity_type']] = row['count']
+            for metric, count in today_counts.items():
+                if metric.startswith('ai:') and count:
+                    data["ai_activity_counts"][metric[len('ai:'):]] = count
             
             # --- 3. その他の集計 ---
             
             # 担当者別ランキング（「今月」の採用件数）
             cur.execute("""
-                SELECT u.username, COUNT(r.id) as adoption_count FROM matching_results r
-                JOIN jobs j ON r.job_id = j.id JOIN users u ON j.assigned_user_id = u.id
-                WHERE r.status = '採用' AND r.created_at >= %s GROUP BY u.username
+                SELECT u.username, SUM(a.count) as adoption_count FROM kpi_monthly_adoptions a
+                JOIN jobs j ON a.job_id = j.id JOIN users u ON j.assigned_user_id = u.id
+                WHERE a.month = %s AND a.count > 0 GROUP BY u.username
                 ORDER BY adoption_count DESC LIMIT 5
-            """, (this_month_start_jst_naive,))
+            """, (this_month_start_jst_naive.date(),))
             data["top_performers"] = [dict(row) for row in cur.fetchall()]
 
 
             # 提案中の総件数
-            cur.execute("SELECT COUNT(*) FROM matching_results WHERE status IN ('提案準備中', '提案中')")
+            cur.execute("SELECT COALESCE(SUM(count), 0) AS count FROM kpi_status_counts WHERE status IN ('提案準備中', '提案中')")
             data["proposal_count_total"] = cur.fetchone()['count']
     
 
@@ -3026,28 +3038,18 @@ def get_live_dashboard_data():
             cur.execute("SELECT COUNT(*) FROM auto_matching_requests WHERE is_active = TRUE")
             data["active_auto_request_count"] = (res := cur.fetchone()) and res['count'] or 0
 
-            # 2. 案件と技術者それぞれのマッチング件数を事前に集計
-            cur.execute("""
-                SELECT job_id, COUNT(*) as match_count 
-                FROM matching_results WHERE is_hidden = 0 GROUP BY job_id
-            """)
-            job_match_counts = {row['job_id']: row['match_count'] for row in cur.fetchall()}
-
-            cur.execute("""
-                SELECT engineer_id, COUNT(*) as match_count 
-                FROM matching_results WHERE is_hidden = 0 GROUP BY engineer_id
-            """)
-            engineer_match_counts = {row['engineer_id']: row['match_count'] for row in cur.fetchall()}
-
-            # 3. 複雑なJOINを使わず、必要な情報を個別に取得してPythonで結合
+            # 2. マッチング件数は item_match_counts（案件・技術者ごとの集計）から依頼の行にだけ結合する
+            # 3. 依頼ごとの表示情報を取得
             # ID順（登録順）で処理するように修正
             cur.execute("""
                 SELECT 
                     req.id, req.item_id, req.item_type, req.target_rank, req.created_at,
                     COALESCE(j.project_name, e.name) as item_name,
                     COALESCE(u_job.username, u_eng.username) as assigned_username,
-                    COALESCE(j.document, e.document) as document
+                    COALESCE(j.document, e.document) as document,
+                    COALESCE(c.match_count, 0) as match_count
                 FROM auto_matching_requests req
+                LEFT JOIN item_match_counts c ON c.item_type = req.item_type AND c.item_id = req.item_id
                 LEFT JOIN jobs j ON req.item_id = j.id AND req.item_type = 'job'
                 LEFT JOIN engineers e ON req.item_id = e.id AND req.item_type = 'engineer'
                 LEFT JOIN users u_job ON j.assigned_user_id = u_job.id
@@ -3062,14 +3064,6 @@ def get_live_dashboard_data():
             for row in cur.fetchall():
                 req_dict = dict(row)
                 
-                # 事前に集計した辞書からマッチング件数を取得
-                if req_dict['item_type'] == 'job':
-                    req_dict['match_count'] = job_match_counts.get(req_dict['item_id'], 0)
-                elif req_dict['item_type'] == 'engineer':
-                    req_dict['match_count'] = engineer_match_counts.get(req_dict['item_id'], 0)
-                else:
-                    req_dict['match_count'] = 0
-                
                 # マッチング件数が50を超えている場合は自動的に無効化
                 if req_dict['match_count'] >= 50:
                     cur.execute(
@@ -3095,9 +3089,10 @@ def get_live_dashboard_data():
 
             
             # 10. リアルタイム活動ログ（「JSTでの今日」に限定）
+            # 各テーブルから新しい順に20件ずつだけ（created_at の部分インデックスで）読み、まとめて上位20件にする
             cur.execute("""
                 SELECT * FROM (
-                    SELECT 
+                    (SELECT 
                         'processing' as log_type, 
                         j.project_name, 
                         e.name as engineer_name, 
@@ -3111,10 +3106,12 @@ def get_live_dashboard_data():
                     JOIN engineers e ON r.engineer_id = e.id
                     WHERE r.is_hidden = 0 
                       AND r.created_at >= %s
+                    ORDER BY r.created_at DESC
+                    LIMIT 20)
 
                     UNION ALL
 
-                    SELECT 
+                    (SELECT 
                         'input' as log_type, 
                         project_name, 
                         NULL as engineer_name, 
@@ -3126,10 +3123,12 @@ def get_live_dashboard_data():
                     FROM jobs 
                     WHERE is_hidden = 0 
                       AND created_at >= %s
+                    ORDER BY created_at DESC
+                    LIMIT 20)
 
                     UNION ALL
 
-                    SELECT 
+                    (SELECT 
                         'input' as log_type, 
                         NULL as project_name, 
                         name as engineer_name, 
@@ -3141,6 +3140,8 @@ def get_live_dashboard_data():
                     FROM engineers 
                     WHERE is_hidden = 0
                       AND created_at >= %s
+                    ORDER BY created_at DESC
+                    LIMIT 20)
                       
                 ) AS combined_logs
                 ORDER BY created_at DESC
@@ -3436,79 +3437,134 @@ def get_latest_news_from_feeds():
 
 # backend.py に追加
 
-def calculate_keyword_score(job_id: int, engineer_id: int, conn=None) -> dict:
+def _load_skill_ids(cursor, table_name: str, item_ids) -> tuple:
+    """
+    item_ids の順に、各行の skill_ids のリストと skill_ancestor_ids のリストを返す
+    （行が無い・未設定なら空のリスト）。
     """
-    案件IDと技術者IDを受け取り、DBに保存されたキーワードを基に
-    マッチングスコアと一致したキーワードを計算して辞書で返す、共通関数。
+    cursor.execute(f"SELECT id, skill_ids, skill_ancestor_ids FROM {table_name} WHERE id = ANY(%s)", (list(item_ids),))
+    rows = {row['id']: (row['skill_ids'] or [], row['skill_ancestor_ids'] or []) for row in cursor.fetchall()}
+    loaded = [rows.get(item_id, ([], [])) for item_id in item_ids]
+    return [skill_ids for skill_ids, _ in loaded], [ancestor_ids for _, ancestor_ids in loaded]
 
-    Args:
-        job_id (int): 案件のID
-        engineer_id (int): 技術者のID
-        conn: (オプション) 既存のDB接続オブジェクト。指定されなければ新規に接続。
+
+def score_pairs(job_ids, engineer_ids, conn=None) -> np.ndarray:
+    """
+    案件 × 技術者のすべての組について、一致したスキルの数をまとめて計算する。
+    スキルはスキル辞書で正規化した jobs.skill_ids / engineers.skill_ids と、その親・祖先（skill_ancestor_ids）を使い、
+    一方のスキルが他方のスキルか祖先である組を、一致したスキルごとに1回数える（共通の祖先だけの組は数えない）。
+    案件・技術者それぞれ1回ずつのクエリと、ビット集合の AND / OR（skill_taxonomy.overlap_matrix）で数える。
 
     Returns:
-        dict: {
-                "score": int,      # 共通キーワードの数
-                "matched_keys": list[str] # 共通したキーワードのリスト
-              }
-              エラー時は {"score": 0, "matched_keys": []} を返す。
+        np.ndarray: 形が (len(job_ids), len(engineer_ids)) の int32 の行列。
+                    [i, j] が job_ids[i] と engineer_ids[j] のスコア。エラー時はすべて 0。
     """
-    # IDが不正な場合は、即座に0点と空リストを返す
-    if not job_id or not engineer_id:
-        return {"score": 0, "matched_keys": []}
+    job_ids, engineer_ids = list(job_ids), list(engineer_ids)
+    scores = np.zeros((len(job_ids), len(engineer_ids)), dtype=np.int32)
+    if not job_ids or not engineer_ids:
+        return scores
 
-    # この関数が外部から呼ばれた際に、自身の接続を管理するためのフラグ
-    should_close_conn = False
-    if conn is None:
+    should_close_conn = conn is None
+    if should_close_conn:
         conn = get_db_connection()
-        if not conn: 
-            return {"score": 0, "matched_keys": []}
-        should_close_conn = True
-    
     try:
         with conn.cursor() as cur:
-            # 1. 案件のキーワードリストを取得 (TEXT[]型を想定)
-            cur.execute("SELECT keywords FROM jobs WHERE id = %s", (job_id,))
-            job_record = cur.fetchone()
-            # DBから取得したリストがNoneでないことを確認してからセットに変換
-            job_keywords = set(job_record['keywords']) if job_record and job_record['keywords'] else set()
-
-            # 2. 技術者のキーワードリストを取得 (TEXT[]型を想定)
-            cur.execute("SELECT keywords FROM engineers WHERE id = %s", (engineer_id,))
-            engineer_record = cur.fetchone()
-            engineer_keywords = set(engineer_record['keywords']) if engineer_record and engineer_record['keywords'] else set()
+            job_skill_ids, job_ancestor_ids = _load_skill_ids(cur, 'jobs', job_ids)
+            engineer_skill_ids, engineer_ancestor_ids = _load_skill_ids(cur, 'engineers', engineer_ids)
+        return skill_taxonomy.overlap_matrix(job_skill_ids, engineer_skill_ids, job_ancestor_ids, engineer_ancestor_ids)
+    except Exception as e:
+        print(f"Error in score_pairs ({len(job_ids)} jobs x {len(engineer_ids)} engineers): {e}")
+        return scores
+    finally:
+        if should_close_conn and conn:
+            conn.close()
 
-        # 3. キーワードリストが片方でも空の場合は、スコアは0
-        if not job_keywords or not engineer_keywords:
-            return {"score": 0, "matched_keys": []}
 
-        # 4. 積集合（共通のキーワード）を計算
-        # ▼▼▼【ここからが修正の核】▼▼▼
-        
-        matched_keys = set() # 重複を防ぐためにセットを使用
+def calculate_keyword_scores_bulk(source_id: int, source_type: str, candidate_ids, conn=None) -> dict:
+    """
+    1件の案件（または技術者）と、多数の候補の技術者（または案件）とのキーワードスコアをまとめて計算する。
+    スキルはスキル辞書で正規化した skill_ids（表記ゆれを吸収したもの）と、その親・祖先の skill_ancestor_ids を使い、
+    一方のスキルが他方のスキルか祖先であれば一致とする（skill_taxonomy.overlap_matrix と同じ規則）。
+    一致したスキルはより一般的な方の名前で1回ずつ数え、共通の祖先だけの一致は数えない
+    （従来の calculate_keyword_score の部分一致で、短い方のキーワードを数えていたのと同じ考え方）。
+    比較元のスキル名は1回だけ読み、候補のスキルは1回のクエリでまとめて読むため、候補の数によらずクエリは2回。
 
-        # 案件キーワードが、技術者キーワードのいずれかに部分一致するかチェック
-        for j_kw in job_keywords:
-            for e_kw in engineer_keywords:
-                if j_kw in e_kw or e_kw in j_kw:
-                    # 'spring' in 'springboot' や 'springboot' in 'spring' のようなケースを拾う
-                    # より一般的なキーワード（短い方）を記録すると分かりやすい
-                    matched_keys.add(j_kw if len(j_kw) <= len(e_kw) else e_kw)
-        
-        score = len(matched_keys)
-        
-        
-        return {"score": score, "matched_keys": matched_keys}
+    Args:
+        source_id (int): 比較元の案件ID（source_type='job'）または技術者ID（source_type='engineer'）
+        source_type (str): 'job' または 'engineer'
+        candidate_ids: 比較先のID（source_type が 'job' なら技術者ID、'engineer' なら案件ID）
+        conn: (オプション) 既存のDB接続オブジェクト。指定されなければ新規に接続。
 
+    Returns:
+        dict: {候補ID: {"score": int, "matched_keys": set[str]}}。candidate_ids のすべてのIDを含む
+              （従来の calculate_keyword_score と同じく、見つからない候補・エラー時は {"score": 0, "matched_keys": []}）。
+    """
+    candidate_ids = list(dict.fromkeys(candidate_ids))
+    results = {candidate_id: {"score": 0, "matched_keys": []} for candidate_id in candidate_ids}
+    if not source_id or source_type not in ('job', 'engineer') or not candidate_ids:
+        return results
+    source_table, candidate_table = ('jobs', 'engineers') if source_type == 'job' else ('engineers', 'jobs')
+
+    should_close_conn = conn is None
+    if should_close_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # 1. 比較元のスキルと祖先のID → スキル名（比較元自身のスキルかどうかも読む）
+            cur.execute(f"""
+                SELECT s.id, s.name, s.id = ANY(t.skill_ids) AS is_own FROM {source_table} t
+                JOIN skills s ON s.id = ANY(t.skill_ids || t.skill_ancestor_ids)
+                WHERE t.id = %s
+            """, (source_id,))
+            source_rows = cur.fetchall()
+            skill_names = {row['id']: row['name'] for row in source_rows}
+            source_own = {row['id'] for row in source_rows if row['is_own']}
+            if not source_own:
+                return results
+
+            # 2. 候補のスキルと祖先をまとめて読み、
+            #    (候補のスキル ∩ 比較元のスキルと祖先) ∪ (比較元のスキル ∩ 候補のスキルと祖先) を一致として数える
+            cur.execute(f"SELECT id, skill_ids, skill_ancestor_ids FROM {candidate_table} WHERE id = ANY(%s)", (candidate_ids,))
+            for row in cur.fetchall():
+                candidate_own = set(row['skill_ids'] or ())
+                matched = (candidate_own & skill_names.keys()) | (source_own & (candidate_own | set(row['skill_ancestor_ids'] or ())))
+                matched_keys = {skill_names[skill_id] for skill_id in matched}
+                results[row['id']] = {"score": len(matched_keys), "matched_keys": matched_keys}
+        return results
     except Exception as e:
-        print(f"Error in calculate_keyword_score (job:{job_id}, eng:{engineer_id}): {e}")
-        return {"score": 0, "matched_keys": []}
+        print(f"Error in calculate_keyword_scores_bulk ({source_type}:{source_id}, {len(candidate_ids)} candidates): {e}")
+        return {candidate_id: {"score": 0, "matched_keys": []} for candidate_id in candidate_ids}
     finally:
-        # この関数内で新規に接続した場合のみ、接続を閉じる
         if should_close_conn and conn:
             conn.close()
 
 
+def calculate_keyword_score(job_id: int, engineer_id: int, conn=None) -> dict:
+    """
+    案件IDと技術者IDを受け取り、スキル辞書で正規化したスキル（jobs.skill_ids / engineers.skill_ids）を基に
+    マッチングスコアと一致したスキル名を計算して辞書で返す、共通関数。
+    「spring」と「springboot」のような派生は、より一般的な方（Spring）の一致として1回だけ数える。
+    1件の案件に多数の技術者を比べるときは calculate_keyword_scores_bulk、
+    案件 × 技術者のスコアの行列が欲しいときは score_pairs を使う。
+
+    Args:
+        job_id (int): 案件のID
+        engineer_id (int): 技術者のID
+        conn: (オプション) 既存のDB接続オブジェクト。指定されなければ新規に接続。
+
+    Returns:
+        dict: {
+                "score": int,      # 共通スキルの数
+                "matched_keys": set[str] # 一致したスキル名の集合
+              }
+              エラー時は {"score": 0, "matched_keys": []} を返す。
+    """
+    # IDが不正な場合は、即座に0点と空リストを返す
+    if not job_id or not engineer_id:
+        return {"score": 0, "matched_keys": []}
+    return calculate_keyword_scores_bulk(job_id, 'job', [engineer_id], conn)[engineer_id]
+
+
 def regenerate_document_and_keywords(item_id: int, item_type: str):
     """
     【ロジック最終確定版】
@@ -3598,6 +3654,7 @@ def regenerate_document_and_keywords(item_id: int, item_type: str):
                 WHERE id = %s;
             """
             cur.execute(sql_update, (new_name, new_full_document, new_keywords, item_id))
+            save_item_attributes(cur, item_type, item_id, new_full_document)
             
             # ▲▲▲【修正ここまで】▲▲▲
         
@@ -3740,6 +3797,7 @@ def register_item_from_text(input_text: str):
             """
             cur.execute(sql, (name, full_document, keywords, now_str, source_json_str))
             item_id = cur.fetchone()['id']
+            save_item_attributes(cur, item_type, item_id, full_document)
             conn.commit()
             
             yield f"  > ✅ 『{name}』を新規登録しました (ID: {item_id})。"
@@ -3758,48 +3816,255 @@ def register_item_from_text(input_text: str):
 
 
 
-def rematch_job_with_keyword_filtering(job_id: int, target_rank: str, target_count: int):
+# 再マッチングの候補を、スキルの重なりが大きい順に読むときに、1回の FETCH で受け取る行数
+REMATCH_CANDIDATE_FETCH_SIZE = 20
+
+
+# 比較元のスキル（skill_ids）と祖先を含むスキルのどちらかが、候補のスキル・祖先と一致する行（skill_taxonomy と同じ規則）
+_SKILL_CANDIDATE_CONDITION = "is_hidden = 0 AND (skill_ids && %(closure)s::int[] OR skill_ancestor_ids && %(skill_ids)s::int[])"
+
+
+def _skill_candidate_params(skill_ids, ancestor_ids) -> dict:
+    return {"skill_ids": list(skill_ids), "closure": sorted(set(skill_ids) | set(ancestor_ids or ()))}
+
+
+def _count_skill_candidates(cursor, table_name: str, skill_ids, ancestor_ids) -> int:
+    cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE {_SKILL_CANDIDATE_CONDITION}", _skill_candidate_params(skill_ids, ancestor_ids))
+    return cursor.fetchone()['count']
+
+
+def _stream_skill_candidates(conn, table_name: str, name_column: str, skill_ids, ancestor_ids):
+    """
+    スキル（jobs.skill_ids / engineers.skill_ids と、その祖先の skill_ancestor_ids）が1つでも一致する表示中の行を、
+    一致したスキルの数が多い順（同数なら新しい順）に id / name / document / overlap だけ返すジェネレータ。
+    一致は、一方のスキルが他方のスキルか祖先であるもの（共通の祖先だけでは一致としない）。
+    skill_ids / skill_ancestor_ids の GIN インデックスで候補を絞り、サーバーサイドカーソルで
+    REMATCH_CANDIDATE_FETCH_SIZE 行ずつ読むため、候補全体をメモリに載せない。
+    呼び出し元のトランザクションの中で使い、読み終えるまでコミットしないこと。
+    """
+    with conn.cursor(name=f"rematch_candidates_{table_name}") as cur:
+        cur.itersize = REMATCH_CANDIDATE_FETCH_SIZE
+        cur.execute(f"""
+            SELECT id, {name_column} AS name, document,
+                   cardinality(ARRAY(
+                       (SELECT unnest(skill_ids) INTERSECT SELECT unnest(%(closure)s::int[]))
+                       UNION
+                       (SELECT unnest(%(skill_ids)s::int[]) INTERSECT SELECT unnest(skill_ids || skill_ancestor_ids))
+                   )) AS overlap
+            FROM {table_name}
+            WHERE {_SKILL_CANDIDATE_CONDITION}
+            ORDER BY overlap DESC, created_at DESC, id DESC
+        """, _skill_candidate_params(skill_ids, ancestor_ids))
+        yield from cur
+
+
+# ==============================================================================
+# 差分の再マッチング（migrations/011_match_evaluations.sql）
+# ==============================================================================
+# 再マッチングは既存のマッチング結果を消さずに、変わったところだけを評価し直す。
+# LLM の評価は match_evaluations に、評価したときの案件・技術者の content_version と一緒に記録しておき、
+# どちらの内容も変わっていない組は LLM を呼ばずに前回の評価を使う。
+
+def record_match_evaluation(cursor, job_id, engineer_id, llm_result):
+    """LLM の評価を、今の案件・技術者の content_version と一緒に記録する（目標ランクに届かなかった評価も記録する）。"""
+    cursor.execute("""
+        INSERT INTO match_evaluations (job_id, engineer_id, job_content_version, engineer_content_version,
+                                       grade, positive_points, concern_points, evaluated_at)
+        SELECT j.id, e.id, j.content_version, e.content_version, %(grade)s, %(positive)s, %(concern)s, now()
+        FROM jobs j, engineers e WHERE j.id = %(job_id)s AND e.id = %(engineer_id)s
+        ON CONFLICT (job_id, engineer_id) DO UPDATE SET
+            job_content_version = EXCLUDED.job_content_version,
+            engineer_content_version = EXCLUDED.engineer_content_version,
+            grade = EXCLUDED.grade,
+            positive_points = EXCLUDED.positive_points,
+            concern_points = EXCLUDED.concern_points,
+            evaluated_at = EXCLUDED.evaluated_at
+    """, {"job_id": job_id, "engineer_id": engineer_id, "grade": llm_result.get('summary'),
+          "positive": json.dumps(llm_result.get('positive_points', []), ensure_ascii=False),
+          "concern": json.dumps(llm_result.get('concern_points', []), ensure_ascii=False)})
+
+
+def _load_match_state(cursor, source_type: str, source_id: int) -> tuple:
+    """
+    再マッチングの対象（案件または技術者）について、相手のIDごとの
+    (既存のマッチング結果, 両方の内容が変わっていない評価の記録) の2つの辞書を返す。
+    """
+    source_column, counterpart_column = ('job_id', 'engineer_id') if source_type == 'job' else ('engineer_id', 'job_id')
+    counterpart_table = 'engineers' if source_type == 'job' else 'jobs'
+    cursor.execute(f"""
+        SELECT m.id, m.{counterpart_column} AS counterpart_id, m.grade, m.is_hidden, m.retired_at, c.is_hidden AS counterpart_hidden
+        FROM matching_results m JOIN {counterpart_table} c ON c.id = m.{counterpart_column}
+        WHERE m.{source_column} = %s
+    """, (source_id,))
+    matches = {row['counterpart_id']: row for row in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT ev.{counterpart_column} AS counterpart_id, ev.grade, ev.positive_points, ev.concern_points
+        FROM match_evaluations ev
+        JOIN jobs j ON j.id = ev.job_id AND j.content_version = ev.job_content_version
+        JOIN engineers e ON e.id = ev.engineer_id AND e.content_version = ev.engineer_content_version
+        WHERE ev.{source_column} = %s
+    """, (source_id,))
+    evaluations = {row['counterpart_id']: row for row in cursor.fetchall()}
+    return matches, evaluations
+
+
+def _retire_matches(cursor, match_ids) -> int:
+    """
+    マッチング結果を非表示にし、再マッチングが非表示にした印（retired_at）を付ける（ステータス・メモ・フィードバックは残す）。
+    非表示にした件数を返す。
+    """
+    if not match_ids: return 0
+    cursor.execute("UPDATE matching_results SET is_hidden = 1, retired_at = now() WHERE id = ANY(%s) AND is_hidden = 0", (list(match_ids),))
+    return cursor.rowcount
+
+
+def _restore_retired_match(cursor, match_id) -> int:
+    """再マッチングが非表示にした結果を表示に戻す。手動で非表示にした結果（retired_at が NULL）には触れない。"""
+    cursor.execute("UPDATE matching_results SET is_hidden = 0, retired_at = NULL WHERE id = %s AND retired_at IS NOT NULL", (match_id,))
+    return cursor.rowcount
+
+
+def _diff_rematch(conn, source_type: str, source_id: int, source_doc: str, candidates, candidate_total: int,
+                  valid_ranks: list, target_count: int, stats: dict, reevaluate_all: bool = False, log_activity: bool = False):
+    """
+    差分の再マッチングを行い、進捗のメッセージを yield するジェネレータ。件数は stats に入れる。コミットは呼び出し元。
+      - 相手が非表示になった既存の結果は非表示にする（相手が削除された結果は外部キーで消える）
+      - 両方の内容が前回の評価から変わっていない候補は LLM を呼ばず、前回の評価をそのまま使う
+      - 新しい候補・内容が変わった候補だけを LLM で評価する。目標ランク以上なら保存し（既存の結果のステータス・メモは残す）、
+        届かなくなった既存の結果は非表示にする（前回の評価を使う組も、目標ランクに届かなければ同じく非表示にする）
+      - 再マッチングが非表示にした結果（retired_at あり）は、再び目標ランク以上になれば表示に戻す。
+        利用者が手動で非表示にした結果は、評価を更新しても非表示のままにする
+    reevaluate_all=True の場合は、前回の評価を使わずにすべての候補を評価し直す。
+    """
+    stats.update(processed=0, found=0, kept=0, reused=0, evaluated=0, saved=0, retired=0, restored=0)
+    with conn.cursor() as cursor:
+        matches, evaluations = _load_match_state(cursor, source_type, source_id)
+        if reevaluate_all: evaluations = {}
+        stats['retired'] = _retire_matches(cursor, [m['id'] for m in matches.values() if m['counterpart_hidden'] and not m['is_hidden']])
+        if stats['retired']:
+            yield f"🗄️ 相手が非表示になった既存のマッチング結果 {stats['retired']}件 を非表示にしました。"
+
+        for candidate in candidates:
+            stats['processed'] += 1
+            counterpart_id = candidate['id']
+            job_id, engineer_id = (source_id, counterpart_id) if source_type == 'job' else (counterpart_id, source_id)
+            match, evaluation = matches.get(counterpart_id), evaluations.get(counterpart_id)
+            visible = match is None or not match['is_hidden']
+            retired = match is not None and match['is_hidden'] and match['retired_at'] is not None
+            overlap = f"（共通スキル {candidate['overlap']}件）" if candidate.get('overlap') is not None else ""
+            label = f"  `({stats['processed']}/{candidate_total})` **{candidate['name']}**{overlap}"
+
+            if evaluation:
+                grade = evaluation['grade']
+                llm_result = {"summary": grade, "positive_points": json.loads(evaluation['positive_points'] or "[]"),
+                              "concern_points": json.loads(evaluation['concern_points'] or "[]")}
+                if grade in valid_ranks and match and visible:
+                    stats['kept'] += 1; stats['found'] += 1
+                    yield f"{label} ... 変更なし（評価: **{grade}** の結果を維持）"
+                elif grade in valid_ranks and (match is None or retired):
+                    # 前回は目標ランクに届かなかった組・相手が非表示だった組が、今回は対象になる
+                    create_or_update_match_record(job_id, engineer_id, 0.0, grade, llm_result, conn=conn, reset_status=match is None)
+                    if retired: stats['restored'] += _restore_retired_match(cursor, match['id'])
+                    stats['reused'] += 1; stats['found'] += 1
+                    restored_note = "非表示にしていた結果を表示に戻しました" if retired else "DBに保存しました"
+                    yield f"{label} ... 変更なし（前回の評価: **{grade}**）... ✅ ヒット！ {restored_note}。"
+                elif match and visible:
+                    # 内容は変わっていないが、目標ランクを上げたため前回の評価では届かなくなった
+                    create_or_update_match_record(job_id, engineer_id, 0.0, grade, llm_result, conn=conn, reset_status=False)
+                    stats['retired'] += _retire_matches(cursor, [match['id']])
+                    yield f"{label} ... 変更なし（前回の評価: **{grade}**）... 🗄️ 目標ランクに届かなくなったため、既存の結果を非表示にしました。"
+                else:
+                    yield f"{label} ... 変更なし（前回の評価: **{grade}**）... ⏭️ スキップ"
+            else:
+                yield f"{label} とマッチング評価中..."
+                if log_activity:
+                    cursor.execute("INSERT INTO ai_activity_log (activity_type) VALUES ('evaluation')")
+                job_doc, engineer_doc = (source_doc, candidate['document']) if source_type == 'job' else (candidate['document'], source_doc)
+                llm_result = get_match_summary_with_llm(job_doc, engineer_doc)
+                stats['evaluated'] += 1
+                if not (llm_result and llm_result.get('summary')):
+                    yield "    -> ⚠️ LLM評価失敗のためスキップ"
+                else:
+                    grade = llm_result.get('summary')
+                    record_match_evaluation(cursor, job_id, engineer_id, llm_result)
+                    if grade in valid_ranks:
+                        create_or_update_match_record(job_id, engineer_id, 0.0, grade, llm_result, conn=conn, reset_status=match is None)
+                        if retired: stats['restored'] += _restore_retired_match(cursor, match['id'])
+                        stats['saved'] += 1
+                        if visible or retired:
+                            stats['found'] += 1
+                            restored_note = "非表示にしていた結果を表示に戻しました" if retired else "DBに保存しました"
+                            yield f"    -> 評価: **{grade}** ... ✅ ヒット！ {restored_note}。"
+                        else:
+                            yield f"    -> 評価: **{grade}** ... 💾 評価を更新しました（手動で非表示にした結果のため、非表示のままにします）。"
+                    elif match and visible:
+                        create_or_update_match_record(job_id, engineer_id, 0.0, grade, llm_result, conn=conn, reset_status=False)
+                        stats['retired'] += _retire_matches(cursor, [match['id']])
+                        yield f"    -> 評価: **{grade}** ... 🗄️ 目標ランクに届かなくなったため、既存の結果を非表示にしました。"
+                    else:
+                        yield f"    -> 評価: **{grade}** ... ⏭️ スキップ"
+
+            if stats['found'] >= target_count:
+                yield f"\n🎉 目標の {target_count} 件に到達したため、処理を終了します。"
+                break
+
+
+def _diff_rematch_summary(stats: dict) -> str:
+    return (f"ℹ️ 差分: 維持 {stats['kept']}件・前回の評価で保存 {stats['reused']}件・AI評価 {stats['evaluated']}件"
+            f"（保存 {stats['saved']}件）・非表示 {stats['retired']}件・表示に戻す {stats['restored']}件")
+
+
+def rematch_job_with_keyword_filtering(job_id: int, target_rank: str, target_count: int, reevaluate_all: bool = False):
     """
     【案件詳細ページ専用】
     DBに登録されているキーワードで技術者を絞り込み、再マッチングを実行するジェネレータ。
+    既存のマッチング結果は消さず、内容が変わっていない組は前回の評価を使う（_diff_rematch）。
+    最後に実行結果（matching_queue.TaskResult）を return する。
     """
     if not job_id:
-        yield "❌ 案件IDが指定されていません。"
-        return
+        message = "❌ 案件IDが指定されていません。"
+        yield message
+        return matching_queue.TaskResult(False, message, retryable=False)
 
     # --- ランク条件の設定 ---
     rank_order = ['S', 'A', 'B', 'C', 'D']
     try:
         valid_ranks = rank_order[:rank_order.index(target_rank) + 1]
     except ValueError:
-        yield f"❌ 無効な目標ランクが指定されました: {target_rank}"
-        return
+        message = f"❌ 無効な目標ランクが指定されました: {target_rank}"
+        yield message
+        return matching_queue.TaskResult(False, message, retryable=False)
     
     yield f"🎯 目標: 「**{target_rank}**」ランク以上のマッチングを最大 **{target_count}** 件探します。"
 
     conn = get_db_connection()
     if not conn:
-        yield "❌ データベースに接続できませんでした。"
-        return
+        message = "❌ データベースに接続できませんでした。"
+        yield message
+        return matching_queue.TaskResult(False, message)
         
     try:
         with conn.cursor() as cur:
             # --- ステップ1: 案件のキーワードとドキュメントを取得 ---
             yield "📄 対象案件の登録済みキーワード情報を取得しています..."
-            cur.execute("SELECT keywords, document, project_name FROM jobs WHERE id = %s", (job_id,))
+            cur.execute("SELECT keywords, skill_ids, skill_ancestor_ids, document, project_name FROM jobs WHERE id = %s", (job_id,))
             job_record = cur.fetchone()
             
             if not job_record:
-                yield f"❌ 案件ID:{job_id} が見つかりませんでした。"
-                return
+                message = f"❌ 案件ID:{job_id} が見つかりませんでした。"
+                yield message
+                return matching_queue.TaskResult(False, message, retryable=False)
             
             source_keywords = job_record.get('keywords')
+            source_skill_ids = job_record.get('skill_ids')
+            source_ancestor_ids = job_record.get('skill_ancestor_ids')
             job_doc = job_record.get('document')
             project_name = job_record.get('project_name')
 
-            if not source_keywords or not isinstance(source_keywords, list):
-                yield f"⚠️ 案件『{project_name}』にキーワードが登録されていません。先に「AI情報更新」を実行してください。"
-                return
+            if not source_keywords or not isinstance(source_keywords, list) or not source_skill_ids:
+                message = f"⚠️ 案件『{project_name}』にキーワードが登録されていません。先に「AI情報更新」を実行してください。"
+                yield message
+                return matching_queue.TaskResult(False, message, retryable=False)
             yield f"  > ✅ 取得キーワード: `{', '.join(source_keywords)}`"
 
 
@@ -3809,69 +4074,36 @@ def rematch_job_with_keyword_filtering(job_id: int, target_rank: str, target_cou
             total_engineers = result['count'] if result else 0
             yield f"🔍 全{total_engineers}名の技術者の中から、キーワードに一致する候補を検索します..."
 
-            # --- ステップ2b: 登録済みキーワードで技術者をDBから絞り込み ---
-            query_clauses = ["%s = ANY(keywords)" for _ in source_keywords]
-            params = tuple(source_keywords)
-            
-            sql = f"""
-                SELECT * FROM engineers
-                WHERE is_hidden = 0 AND ({' OR '.join(query_clauses)});
-            """
-            cur.execute(sql, params)
-            candidate_engineers = cur.fetchall()
-
-
-
-
-            if not candidate_engineers:
-                yield "ℹ️ キーワードに一致する技術者が見つかりませんでした。既存のマッチングをクリアします。"
-                cur.execute("DELETE FROM matching_results WHERE job_id = %s", (job_id,))
-                conn.commit()
-                yield "✅ 処理が完了しました。"
-                return
-            
-
-            yield f"  > ✅ 全{total_engineers}名の中から、**{len(candidate_engineers)}名**の評価対象候補に絞り込みました。"
-
-
-            # --- ステップ3: 既存マッチングのクリアとAI評価の実行 ---
-            yield f"🗑️ 案件『{project_name}』の既存マッチング結果をクリアしています..."
-            cur.execute("DELETE FROM matching_results WHERE job_id = %s", (job_id,))
-            
-            yield "🔄 絞り込んだ候補技術者リストに対して、順にAI評価を開始します..."
-            
-            found_count = 0
-            processed_count = 0
-            
-            for engineer in candidate_engineers:
-                processed_count += 1
-                yield f"  `({processed_count}/{len(candidate_engineers)})` 技術者 **{engineer['name']}** とマッチング評価中..."
-                
-                llm_result = get_match_summary_with_llm(job_doc, engineer['document'])
-                
-                if llm_result and llm_result.get('summary'):
-                    grade = llm_result.get('summary')
-                    if grade in valid_ranks:
-                        create_or_update_match_record(job_id, engineer['id'], 0.0, grade, llm_result, conn)
-                        yield f"    -> 評価: **{grade}** ... ✅ ヒット！ DBに保存しました。"
-                        found_count += 1
-                    else:
-                        yield f"    -> 評価: **{grade}** ... ⏭️ スキップ"
-                else:
-                    yield "    -> ⚠️ LLM評価失敗のためスキップ"
+            # --- ステップ2b: スキルが1つでも重なる技術者の数を数える（候補そのものはステップ3で重なりの多い順に読む） ---
+            candidate_total = _count_skill_candidates(cur, 'engineers', source_skill_ids, source_ancestor_ids)
 
-                if found_count >= target_count:
-                    yield f"\n🎉 目標の {target_count} 件に到達したため、処理を終了します。"
-                    break
+            if candidate_total:
+                yield f"  > ✅ 全{total_engineers}名の中から、**{candidate_total}名**の評価対象候補に絞り込みました。"
+            else:
+                yield "ℹ️ キーワードに一致する技術者が見つかりませんでした。既存のマッチング結果の確認だけを行います。"
+
+            # --- ステップ3: 差分の再マッチング（既存の結果は消さず、新しい候補・内容が変わった候補だけをAI評価する） ---
+            yield "🔄 スキルの重なりが大きい技術者から順に、AI評価を開始します（変更のない組は前回の評価を使います）..."
+            stats = {}
+            candidates = _stream_skill_candidates(conn, 'engineers', 'name', source_skill_ids, source_ancestor_ids)
+            yield from _diff_rematch(conn, 'job', job_id, job_doc, candidates, candidate_total, valid_ranks, target_count,
+                                     stats, reevaluate_all=reevaluate_all)
+            # 途中で打ち切った場合も、コミットの前にサーバーサイドカーソルを閉じる
+            candidates.close()
+            yield _diff_rematch_summary(stats)
         
         conn.commit()
-        yield "🎉 すべての処理が正常に完了しました。"
+        message = "🎉 すべての処理が正常に完了しました。"
+        yield message
+        return matching_queue.TaskResult(True, message)
 
     except Exception as e:
         if conn: conn.rollback()
         import traceback
-        yield f"❌ 処理中に予期せぬエラーが発生しました: {e}"
+        message = f"❌ 処理中に予期せぬエラーが発生しました: {e}"
+        yield message
         yield f"```\n{traceback.format_exc()}\n```"
+        return matching_queue.TaskResult(False, message)
     finally:
         if conn: conn.close()
 
@@ -3879,61 +4111,64 @@ def rematch_job_with_keyword_filtering(job_id: int, target_rank: str, target_cou
 
 
 
-# backend.py の末尾に、以下の新しい関数を追加してください
-# backend.py の rematch_engineer_with_keyword_filtering 関数をこちらに置き換えてください
-
-def rematch_engineer_with_keyword_filtering(engineer_id, target_rank='B', target_count=5):
+def rematch_engineer_with_keyword_filtering(engineer_id, target_rank='B', target_count=5, reevaluate_all=False):
     """
     【技術者詳細ページ専用・完成版】
     AIキーワード抽出→DB絞り込み→逐次評価を行うジェネレータ。
     DIパターンに対応し、st.secretsに依存しない。
+    既存のマッチング結果は消さず、内容が変わっていない組は前回の評価を使う（_diff_rematch）。
+    最後に実行結果（matching_queue.TaskResult）を return する。
     """
     if not engineer_id:
-        yield "❌ 技術者IDが指定されていません。"
-        return
+        message = "❌ 技術者IDが指定されていません。"
+        yield message
+        return matching_queue.TaskResult(False, message, retryable=False)
 
 
-    # ▼▼▼【ここからが修正の核】▼▼▼
     # --- 1. 引数で渡されたランクと件数を基に、評価条件を設定 ---
     rank_order = ['S', 'A', 'B', 'C', 'D']
     try:
         valid_ranks = rank_order[:rank_order.index(target_rank) + 1]
     except ValueError:
-        yield f"❌ 無効な目標ランクが指定されました: {target_rank}"
-        return
+        message = f"❌ 無効な目標ランクが指定されました: {target_rank}"
+        yield message
+        return matching_queue.TaskResult(False, message, retryable=False)
     
     yield f"🎯 目標: 「**{target_rank}**」ランク以上のマッチングを最大 **{target_count}** 件探します。"
-    # ▲▲▲【修正ここまで】▲▲▲
 
 
     # ★★★ DIパターンのため、この関数はUIから直接呼び出されることを前提とし、
     # get_db_connection() を使う。バッチ処理からは呼ばない。
     conn = get_db_connection()
     if not conn:
-        yield "❌ データベース接続に失敗しました。"
-        return
+        message = "❌ データベース接続に失敗しました。"
+        yield message
+        return matching_queue.TaskResult(False, message)
 
     try:
         with conn.cursor() as cursor:
 
-            # ▼▼▼【ここからが修正の核】▼▼▼
             # --- ステップ1: 技術者の「キーワード」「ドキュメント」「名前」をDBから取得 ---
             yield "📄 対象技術者の登録済みキーワード情報を取得しています..."
-            cursor.execute("SELECT keywords, document, name FROM engineers WHERE id = %s", (engineer_id,))
+            cursor.execute("SELECT keywords, skill_ids, skill_ancestor_ids, document, name FROM engineers WHERE id = %s", (engineer_id,))
             engineer_record = cursor.fetchone()
             
             if not engineer_record:
-                yield f"❌ 技術者ID:{engineer_id} が見つかりませんでした。"
-                return
+                message = f"❌ 技術者ID:{engineer_id} が見つかりませんでした。"
+                yield message
+                return matching_queue.TaskResult(False, message, retryable=False)
             
             # 取得したキーワードを source_keywordsとして使用
             source_keywords = engineer_record.get('keywords')
+            source_skill_ids = engineer_record.get('skill_ids')
+            source_ancestor_ids = engineer_record.get('skill_ancestor_ids')
             engineer_doc = engineer_record.get('document')
             engineer_name = engineer_record.get('name')
 
-            if not source_keywords or not isinstance(source_keywords, list):
-                yield f"⚠️ 技術者『{engineer_name}』にキーワードが登録されていません。先に「AI情報更新」でキーワードを生成してください。"
-                return
+            if not source_keywords or not isinstance(source_keywords, list) or not source_skill_ids:
+                message = f"⚠️ 技術者『{engineer_name}』にキーワードが登録されていません。先に「AI情報更新」でキーワードを生成してください。"
+                yield message
+                return matching_queue.TaskResult(False, message, retryable=False)
             yield f"  > ✅ 登録済みキーワード: `{', '.join(source_keywords)}`"
 
             # --- ステップ2: 登録済みキーワードで案件をDBから絞り込み ---
@@ -3947,87 +4182,93 @@ def rematch_engineer_with_keyword_filtering(engineer_id, target_rank='B', target
 
             yield f"🔍 全{total_jobs}件の案件の中から、キーワードに一致する候補を検索します..."
 
-            # --- ステップ2b: 登録済みキーワードで案件をDBから絞り込み ---
-            query_clauses = ["%s = ANY(keywords)" for _ in source_keywords]
-            params = tuple(source_keywords)
-            
-            sql = f"""
-                SELECT * FROM jobs
-                WHERE is_hidden = 0 AND ({' OR '.join(query_clauses)});
-            """
-            cursor.execute(sql, params)
-            candidate_jobs = cursor.fetchall()
-
+            # --- ステップ2b: スキルが1つでも重なる案件の数を数える（候補そのものはステップ4で重なりの多い順に読む） ---
+            candidate_total = _count_skill_candidates(cursor, 'jobs', source_skill_ids, source_ancestor_ids)
 
-            if not candidate_jobs:
-                yield "⚠️ キーワードに一致する案件が見つかりませんでした。"; conn.commit(); return
-            yield f"  > DBから最新 **{len(candidate_jobs)}件** の評価対象候補をリストアップしました。"
-            
-
-            # --- ステップ4: 既存マッチングのクリアと逐次評価 ---
-            # このトランザクション内でDELETEを実行
-            cursor.execute("DELETE FROM matching_results WHERE engineer_id = %s", (engineer_id,))
-            yield f"🗑️ 技術者ID:{engineer_id} の既存マッチング結果をクリアしました。"
-            
-            yield "🔄 絞り込んだ候補案件リストに対して、順にマッチング処理を開始します..."
-
-            found_count = 0
-            processed_count = 0
-            
-            # 取得した candidate_jobs を直接ループで回す
-            for job in candidate_jobs:
-                processed_count += 1
-                yield f"  `({processed_count}/{len(candidate_jobs)})` 案件 **{job['project_name']}** とマッチング評価中..."
-                
-                
-                # ★★★【ここからが修正の核】★★★
-                # AI評価の実行前に、アクティビティログを記録する
-                try:
-                    cursor.execute(
-                        "INSERT INTO ai_activity_log (activity_type) VALUES ('evaluation')"
-                    )
-                except Exception as log_err:
-                    yield f"  - ⚠️ AIアクティビティログの記録に失敗: {log_err}"
-                # ★★★【修正ここまで】★★★
 
-                llm_result = get_match_summary_with_llm(job['document'], engineer_doc)
-                if llm_result and 'summary' in llm_result:
-                    grade = llm_result.get('summary')
-                    # ▼▼▼【ここが修正箇所】▼▼▼
-                    # 評価ランクが、引数で指定された有効なランクに含まれるかチェック
-                    if grade in valid_ranks:
-                        # (DBへの保存処理)
-                        create_or_update_match_record(job['id'], engineer_id, 0.0, grade, llm_result, conn=conn)
-                        yield f"    -> 評価: **{grade}** ... ✅ ヒット！ DBに保存しました。"
-                        found_count += 1
-                    else:
-                        yield f"    -> 評価: **{grade}** ... ⏭️ スキップ"
-                    # ▲▲▲【修正ここまで】▲▲▲
-                else:
-                    yield f"    -> <span style='color: #ffc107;'>⏭️ スキップ</span> (評価: {llm_result.get('summary', '失敗') if llm_result else '失敗'})"
-                
-                # ▼▼▼【ここが修正箇所】▼▼▼
-                # ヒット数が目標件数に達したら、ループを中断
-                if found_count >= target_count:
-                    yield f"\n🎉 目標の {target_count} 件に到達したため、処理を終了します。"
-                    break
-                
-                
-            if found_count < target_count:
-                yield f"ℹ️ すべての候補案件の評価が完了しました。(ヒット数: {found_count}件)"
+            if not candidate_total:
+                yield "⚠️ キーワードに一致する案件が見つかりませんでした。既存のマッチング結果の確認だけを行います。"
+            else:
+                yield f"  > **{candidate_total}件** の評価対象候補が見つかりました。"
+
+            # --- ステップ4: 差分の再マッチング（既存の結果は消さず、新しい候補・内容が変わった候補だけをAI評価する） ---
+            yield "🔄 スキルの重なりが大きい案件から順に、マッチング処理を開始します（変更のない組は前回の評価を使います）..."
+            stats = {}
+            # 候補はサーバーサイドカーソルから少しずつ読む
+            candidates = _stream_skill_candidates(conn, 'jobs', 'project_name', source_skill_ids, source_ancestor_ids)
+            yield from _diff_rematch(conn, 'engineer', engineer_id, engineer_doc, candidates, candidate_total, valid_ranks,
+                                     target_count, stats, reevaluate_all=reevaluate_all, log_activity=True)
+            # 途中で打ち切った場合も、コミットの前にサーバーサイドカーソルを閉じる
+            candidates.close()
+
+            if stats['found'] < target_count:
+                yield f"ℹ️ すべての候補案件の評価が完了しました。(ヒット数: {stats['found']}件)"
+            yield _diff_rematch_summary(stats)
 
         conn.commit()
-        yield "✅ すべての処理が正常に完了しました。"
+        message = "✅ すべての処理が正常に完了しました。"
+        yield message
+        return matching_queue.TaskResult(True, message)
     except Exception as e:
         conn.rollback()
-        yield f"❌ 再評価・再マッチング中に予期せぬエラーが発生しました: {e}"
+        message = f"❌ 再評価・再マッチング中に予期せぬエラーが発生しました: {e}"
+        yield message
         import traceback; yield f"```\n{traceback.format_exc()}\n```"
+        return matching_queue.TaskResult(False, message)
     finally:
         if conn:
             conn.close()
 
 
 
+# ==============================================================================
+# 再マッチングのキュー（run_matching_worker.py が実行する）
+# ==============================================================================
+# 画面は再マッチングをその場で実行せず、matching_queue に登録して進捗を読む。
+# 同じ案件・技術者の再マッチングは、待ち・実行中のものが1つだけになるようにする（dedup_key）。
+
+def _rematch_dedup_key(item_type: str, item_id: int) -> str:
+    return f"rematch_{item_type}:{item_id}"
+
+
+def enqueue_rematch(item_type: str, item_id: int, target_rank: str, target_count: int, requested_by: str | None = None,
+                    reevaluate_all: bool = False) -> tuple:
+    """
+    案件（item_type='job'）または技術者（'engineer'）の再マッチングをキューに登録し、(タスクID, 新しく登録したか) を返す。
+    同じ案件・技術者の再マッチングが待ち・実行中なら、新しくは登録せずそのタスクIDを返す。
+    reevaluate_all=True の場合は、内容が変わっていない組も前回の評価を使わずにAI評価し直す。
+    """
+    if item_type not in ('job', 'engineer'):
+        raise ValueError(f"不正な item_type です: {item_type}")
+    payload = {f"{item_type}_id": int(item_id), "target_rank": target_rank, "target_count": int(target_count),
+               "reevaluate_all": bool(reevaluate_all)}
+    with get_db_connection() as conn:
+        return matching_queue.enqueue(conn, f"rematch_{item_type}", payload, priority=matching_queue.INTERACTIVE_PRIORITY,
+                                      dedup_key=_rematch_dedup_key(item_type, item_id), requested_by=requested_by)
+
+
+def get_active_rematch_task(item_type: str, item_id: int):
+    """案件・技術者の、待ち・実行中の再マッチングのタスク（無ければ None）。"""
+    with get_db_connection() as conn:
+        return matching_queue.find_active_task(conn, _rematch_dedup_key(item_type, item_id))
+
+
+def get_matching_task(task_id: int):
+    with get_db_connection() as conn:
+        return matching_queue.get_task(conn, task_id)
+
+
+def get_matching_task_progress(task_id: int, after_id: int = 0) -> list:
+    with get_db_connection() as conn:
+        return matching_queue.get_progress(conn, task_id, after_id)
+
+
+def cancel_matching_task(task_id: int) -> str | None:
+    with get_db_connection() as conn:
+        return matching_queue.cancel(conn, task_id)
+
+
+
 def convert_to_jst_str(dt_object: datetime, format_str: str = '%Y-%m-%d %H:%M:%S') -> str:
     """
     【JST基準DB対応版】
@@ -0,0 +1,121 @@
+# ==============================================================================
+# benchmarks/bench_excel_extractor.py
+# ==============================================================================
+# Excel抽出のベンチマーク。
+# 数MBのワークブックを生成し、従来の pandas 実装（run_email_processor / backend の旧版）と
+# attachment_extractor.extract_text_from_excel（openpyxl read_only のストリーミング版）の
+# 処理時間とピークRSSを比較する。
+#
+# 各計測は独立した子プロセスで行い、子プロセスの ru_maxrss をピークRSSとして報告する。
+#
+# 使い方:
+#   python benchmarks/bench_excel_extractor.py
+#   python benchmarks/bench_excel_extractor.py --rows 20000 50000 --cols 30 --sheets 3
+# ==============================================================================
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+# --- 比較対象: 従来の実装（リファクタリング前のコードをそのまま残している） ---
+
+def legacy_processor_extract(file_bytes: bytes) -> str:
+    # run_email_processor.py の旧実装（シートごとに read_excel を2回呼ぶ）
+    import pandas as pd
+    from attachment_extractor import clean_and_format_text
+    xls = pd.ExcelFile(io.BytesIO(file_bytes))
+    all_text_parts = [f"\n### シート: {name}\n{pd.read_excel(xls, sheet_name=name, header=None).to_string(header=False, index=False, na_rep='')}" for name in xls.sheet_names if not pd.read_excel(xls, sheet_name=name, header=None).empty]
+    if not all_text_parts: return "[Excelテキスト抽出失敗: 内容が空です]"
+    return clean_and_format_text("".join(all_text_parts))
+
+def legacy_backend_extract(file_bytes: bytes) -> str:
+    # backend.py の旧実装（DataFrame を作って to_string で整形）
+    import pandas as pd
+    xls = pd.ExcelFile(io.BytesIO(file_bytes))
+    parts = []
+    for sheet_name in xls.sheet_names:
+        df = pd.read_excel(xls, sheet_name=sheet_name, header=None)
+        if not df.empty:
+            parts.append(f"\n--- シート: {sheet_name} ---\n{df.to_string(header=False, index=False, na_rep='')}")
+    return "".join(parts)
+
+def streaming_extract_unlimited(file_bytes: bytes) -> str:
+    from attachment_extractor import extract_text_from_excel
+    return extract_text_from_excel(file_bytes)
+
+def streaming_extract_default_limits(file_bytes: bytes) -> str:
+    from attachment_extractor import DEFAULT_EXTRACTION_LIMITS, extract_text_from_excel
+    return extract_text_from_excel(file_bytes, DEFAULT_EXTRACTION_LIMITS["max_rows"], DEFAULT_EXTRACTION_LIMITS["max_cols"])
+
+IMPLEMENTATIONS = {
+    "旧: run_email_processor": legacy_processor_extract,
+    "旧: backend": legacy_backend_extract,
+    "新: streaming（上限なし）": streaming_extract_unlimited,
+    "新: streaming（既定の上限）": streaming_extract_default_limits,
+}
+
+
+# --- ワークブックの生成と計測 ---
+
+def build_workbook(path: str, rows: int, cols: int, sheets: int):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for s in range(sheets):
+        sheet = workbook.create_sheet(f"スキルシート{s + 1}")
+        sheet.append([f"項目{c + 1}" for c in range(cols)])
+        for r in range(rows):
+            sheet.append([f"Java/Spring 案件{r} 備考{c}" if c % 3 == 0 else (r * cols + c) for c in range(cols)])
+    workbook.save(path)
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位で返る
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def _measure(impl_name: str, path: str, result_queue):
+    with open(path, "rb") as f: file_bytes = f.read()
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    text = IMPLEMENTATIONS[impl_name](file_bytes)
+    elapsed = time.perf_counter() - started
+    result_queue.put({"elapsed": elapsed, "peak_rss_mb": _peak_rss_mb(), "baseline_rss_mb": baseline, "chars": len(text)})
+
+def run_isolated(impl_name: str, path: str) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(impl_name, path, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel抽出の処理時間とピークRSSを比較する")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 40000], help="1シートあたりの行数（複数指定可）")
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--sheets", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in args.rows:
+            path = os.path.join(tmp_dir, f"bench_{rows}.xlsx")
+            build_workbook(path, rows, args.cols, args.sheets)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            print(f"\n=== {args.sheets}シート × {rows}行 × {args.cols}列（{size_mb:.1f}MB） ===")
+            print(f"{'実装':<28}{'時間(秒)':>10}{'ピークRSS(MB)':>16}{'増分(MB)':>12}{'文字数':>12}")
+            for impl_name in IMPLEMENTATIONS:
+                r = run_isolated(impl_name, path)
+                print(f"{impl_name:<28}{r['elapsed']:>10.2f}{r['peak_rss_mb']:>16.1f}{r['peak_rss_mb'] - r['baseline_rss_mb']:>12.1f}{r['chars']:>12,}")
+
+
+if __name__ == "__main__":
+    main()
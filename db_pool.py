@@ -0,0 +1,147 @@
+# ==============================================================================
+# db_pool.py
+# ==============================================================================
+# PostgreSQL のコネクションプール。
+# psycopg2 の ThreadedConnectionPool を包み、次の機能を足している。
+#   - 上限（max_connections）に達したら、空きが出るまで acquire_timeout_seconds 秒だけ待つ
+#     （ThreadedConnectionPool 単体では即座に PoolError になる）
+#   - 一定時間使われていなかった接続は、貸し出す前に SELECT 1 で生存確認し、切れていれば張り直す
+#   - get_db_connection() の戻り値として、従来の psycopg2 の接続と同じように使える PooledConnection を返す
+#
+# UI（backend.py）では st.cache_resource で、バッチ（run_email_processor.py など）ではモジュール変数で
+# プロセスに1つだけ生成して使い回す。
+# ==============================================================================
+
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool as pg_pool
+from psycopg2.extras import DictCursor
+
+PoolError = pg_pool.PoolError
+
+
+DEFAULT_POOL_SETTINGS = {
+    # 返却後も張ったまま保持する接続数。ThreadedConnectionPool はこれを超えて返却された接続を閉じる
+    "min_connections": 2,
+    "max_connections": 10,
+    "acquire_timeout_seconds": 30,        # 全ての接続が貸し出し中のとき、空きを待つ最大秒数
+    "health_check_interval_seconds": 30,  # これより長く使われていなかった接続は、貸し出す前に生存確認する
+}
+
+def load_pool_settings(config: dict) -> dict:
+    settings = dict(DEFAULT_POOL_SETTINGS)
+    settings.update((config or {}).get("database_pool", {}))
+    settings["max_connections"] = max(1, settings["max_connections"])
+    settings["min_connections"] = min(max(0, settings["min_connections"]), settings["max_connections"])
+    return settings
+
+
+class PooledConnection:
+    """
+    プールから借りた接続。psycopg2 の接続と同じ属性・メソッドをそのまま使える。
+    close() と with ブロックの終了でプールへ返却される（with は従来どおり、正常終了でコミット・例外でロールバックする）。
+    """
+
+    def __init__(self, owner: "ConnectionPool", raw_conn):
+        self._owner = owner
+        self._raw = raw_conn
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None: raise psycopg2.InterfaceError("プールに返却済みの接続は使用できません。")
+        return getattr(raw, name)
+
+    @property
+    def closed(self):
+        # 返却済みの接続は、呼び出し側からは閉じた接続として見えるようにする
+        return 1 if self._raw is None else self._raw.closed
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None: self._owner._release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._raw is not None and not self._raw.closed:
+                if exc_type is None: self._raw.commit()
+                else: self._raw.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # close し忘れた接続も、参照が無くなった時点でプールへ戻す
+        try: self.close()
+        except Exception: pass
+
+
+class ConnectionPool:
+    """スレッドセーフなコネクションプール。getconn() で PooledConnection を貸し出す。"""
+
+    def __init__(self, dsn: str, settings: dict | None = None, cursor_factory=DictCursor):
+        self.settings = load_pool_settings({"database_pool": settings or {}})
+        self._pool = pg_pool.ThreadedConnectionPool(self.settings["min_connections"], self.settings["max_connections"], dsn, cursor_factory=cursor_factory)
+        self._slots = threading.BoundedSemaphore(self.settings["max_connections"])
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.stats = {"checkouts": 0, "reconnects": 0, "waits": 0}
+
+    def getconn(self) -> PooledConnection:
+        if not self._slots.acquire(blocking=False):
+            with self._lock: self.stats["waits"] += 1
+            if not self._slots.acquire(timeout=self.settings["acquire_timeout_seconds"]):
+                raise pg_pool.PoolError(f"{self.settings['acquire_timeout_seconds']}秒待ってもデータベース接続の空きがありませんでした（上限 {self.settings['max_connections']}）。")
+        try:
+            raw = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock: self.stats["checkouts"] += 1
+        return PooledConnection(self, raw)
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: の形で使う。ブロックを抜けるとコミット（例外時はロールバック）して返却する。"""
+        conn = self.getconn()
+        with conn:
+            yield conn
+
+    def closeall(self):
+        self._pool.closeall()
+
+    # --- 内部処理 ---
+    def _checkout_healthy(self):
+        raw = self._pool.getconn()
+        last_used = self._last_used.get(id(raw))
+        # 新しく張った接続と、直前まで使われていた接続は確認を省く
+        if not raw.closed and (last_used is None or time.monotonic() - last_used < self.settings["health_check_interval_seconds"]):
+            return raw
+        try:
+            if raw.closed: raise psycopg2.InterfaceError("connection already closed")
+            with raw.cursor() as cursor: cursor.execute("SELECT 1")
+            raw.rollback()
+            return raw
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # サーバー側で切断された接続は捨てて、新しく張り直す
+            self._pool.putconn(raw, close=True)
+            with self._lock: self.stats["reconnects"] += 1
+            return self._pool.getconn()
+
+    def _release(self, raw):
+        try:
+            broken = bool(raw.closed)
+            if not broken and raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                # コミットされずに返却された変更は破棄する（次の利用者に持ち越さない）
+                try: raw.rollback()
+                except psycopg2.Error: broken = True
+            self._last_used[id(raw)] = time.monotonic()
+            self._pool.putconn(raw, close=broken)
+            if raw.closed: self._last_used.pop(id(raw), None)
+        finally:
+            self._slots.release()
@@ -0,0 +1,106 @@
+# ==============================================================================
+# ingest_dedup.py
+# ==============================================================================
+# メール取り込み時の重複検知（完全一致の sha256 と、MinHash/LSH による近似重複）。
+# 同じスキルシートや案件情報が複数の取引先から届いても、LLMによる抽出を1回で済ませるために使う。
+# DBへの読み書きは呼び出し側（run_email_processor）が行い、ここでは指紋の計算と比較だけを扱う。
+# ==============================================================================
+
+import hashlib
+import re
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+
+
+DEFAULT_DEDUP_SETTINGS = {
+    "enabled": True,
+    "num_perm": 64,            # MinHash の署名長
+    "bands": 16,               # LSH のバンド数（num_perm を割り切れること）
+    "shingle_size": 5,         # 文字 n-gram の長さ（日本語は単語区切りが無いため文字単位）
+    "threshold": 0.9,          # 近似重複とみなす推定 Jaccard 係数
+    "length_tolerance": 0.05,  # 近似重複とみなす本文長の差（割合）。引用に新しい提案を書き足した返信を誤判定しないため
+    "min_length": 200,         # これより短いテキストは近似重複の判定をしない
+    "lookback_days": 30,       # この日数より前に登録された指紋とは照合しない
+}
+
+def load_dedup_settings(config: dict) -> dict:
+    settings = dict(DEFAULT_DEDUP_SETTINGS)
+    settings.update((config or {}).get("dedup", {}))
+    return settings
+
+
+@dataclass
+class Fingerprint:
+    content_hash: str
+    signature: list          # MinHash 署名（num_perm 個の整数）。短いテキストでは None
+    band_keys: list          # LSH のバンドキー。短いテキストでは空
+    text_length: int
+
+
+# --- 正規化 ---
+_WS = re.compile(r'\s+')
+_NOISE = re.compile(r'[-=_*#~・■□◆◇●○★☆※＿─━]+')
+
+def normalize_text(text: str) -> str:
+    """NFKC正規化・小文字化し、罫線や装飾記号と空白の揺れを取り除く。"""
+    if not text: return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _NOISE.sub(" ", text)
+    return _WS.sub(" ", text).strip()
+
+
+# --- MinHash / LSH ---
+_UPPER_32_SHIFT = np.uint64(32)
+
+def _permutations(num_perm: int):
+    # 実行ごとに同じ署名になるよう、乱数の種は固定する
+    rng = np.random.default_rng(20240601)
+    a = rng.integers(1, 2**63 - 1, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63 - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+_PERMUTATION_CACHE = {}
+
+def minhash_signature(normalized_text: str, num_perm: int = 64, shingle_size: int = 5) -> list:
+    """文字 n-gram の集合から MinHash 署名を計算する（multiply-shift ハッシュを num_perm 通り適用した最小値）。"""
+    if num_perm not in _PERMUTATION_CACHE: _PERMUTATION_CACHE[num_perm] = _permutations(num_perm)
+    a, b = _PERMUTATION_CACHE[num_perm]
+    shingles = {normalized_text[i:i + shingle_size] for i in range(max(1, len(normalized_text) - shingle_size + 1))}
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles), dtype=np.uint64, count=len(shingles))
+    # (a * x + b) mod 2^64 の上位32ビット。uint64 の桁あふれはそのまま mod 2^64 として扱う
+    with np.errstate(over="ignore"):
+        permuted = (np.outer(hashes, a) + b) >> _UPPER_32_SHIFT
+    return permuted.min(axis=0).astype(np.int64).tolist()
+
+def lsh_band_keys(signature: list, bands: int = 16) -> list:
+    """署名を bands 個のバンドに分け、バンドごとのキー文字列を返す。キーが1つでも一致したものが候補になる。"""
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        chunk = ",".join(str(v) for v in signature[band * rows:(band + 1) * rows])
+        keys.append(f"{band}:{hashlib.md5(chunk.encode()).hexdigest()[:16]}")
+    return keys
+
+def estimate_jaccard(signature_a: list, signature_b: list) -> float:
+    if not signature_a or not signature_b or len(signature_a) != len(signature_b): return 0.0
+    return float(np.mean(np.asarray(signature_a) == np.asarray(signature_b)))
+
+
+def compute_fingerprint(text: str, settings: dict | None = None) -> Fingerprint:
+    settings = settings or DEFAULT_DEDUP_SETTINGS
+    normalized = normalize_text(text)
+    content_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    if len(normalized) < settings["min_length"]:
+        return Fingerprint(content_hash, None, [], len(normalized))
+    signature = minhash_signature(normalized, settings["num_perm"], settings["shingle_size"])
+    return Fingerprint(content_hash, signature, lsh_band_keys(signature, settings["bands"]), len(normalized))
+
+def is_near_duplicate(fp: Fingerprint, other_signature: list, other_length: int, settings: dict | None = None) -> float | None:
+    """近似重複と判定できれば推定 Jaccard 係数を、そうでなければ None を返す。"""
+    settings = settings or DEFAULT_DEDUP_SETTINGS
+    if not fp.signature or not other_signature or not other_length: return None
+    if abs(fp.text_length - other_length) / max(fp.text_length, other_length) > settings["length_tolerance"]: return None
+    similarity = estimate_jaccard(fp.signature, other_signature)
+    return similarity if similarity >= settings["threshold"] else None
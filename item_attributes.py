@@ -0,0 +1,184 @@
+# ==============================================================================
+# item_attributes.py
+# ==============================================================================
+# 案件・技術者の document 先頭のメタ情報（「[単価: 60〜70万円] [勤務地: 東京都（一部リモート）] ... \n---\n」）から、
+# 絞り込みに使う値を型付きで取り出す。取り出した値は jobs / engineers の列
+# （migrations/006_item_attributes.sql）に、登録時と run_attribute_backfill.py で保存する。
+#   price_min / price_max   単価（案件）・希望単価（技術者）の範囲。万円単位
+#   work_style              remote（フルリモート）/ hybrid（リモート併用）/ onsite（常駐）
+#   prefecture              都道府県名（「東京都」など）
+#   available_from          開始時期（案件）・稼働可能日（技術者）
+# 国籍の条件は document から計算する生成列（requires_japanese_national / is_japanese_national）で持っている。
+# 解析の規則を変えたら ATTRIBUTES_VERSION を上げる。古い版で解析した行はバックフィルで解析し直される。
+# ==============================================================================
+
+import re
+import unicodedata
+from datetime import date, datetime
+
+ATTRIBUTES_VERSION = 1
+
+# item_type ごとの、メタ情報の項目名（backend._build_meta_info_string と同じ表記）
+META_LABELS = {
+    'job': {'price': '単価', 'location': '勤務地', 'available': '開始時期'},
+    'engineer': {'price': '希望単価', 'location': '希望勤務地', 'available': '稼働可能日'},
+}
+
+ATTRIBUTE_COLUMNS = ('price_min', 'price_max', 'work_style', 'prefecture', 'available_from', 'attributes_version')
+
+_META_ITEM = re.compile(r'\[([^\[\]:]+):\s*([^\]]*)\]')
+_UNKNOWN_VALUES = {'', '不明', 'none', 'null', 'n/a', '-'}
+
+
+def parse_meta_prefix(document: str) -> dict:
+    """document の「---」より前にある [項目名: 値] を辞書にする。値が「不明」などのときは含めない。"""
+    if not document: return {}
+    head = document.split("\n---\n", 1)[0] if "\n---\n" in document else ""
+    meta = {}
+    for label, value in _META_ITEM.findall(head):
+        value = value.strip()
+        if value.lower() not in _UNKNOWN_VALUES: meta[label.strip()] = value
+    return meta
+
+
+# ==============================================================================
+# 1. 単価
+# ==============================================================================
+# 精算幅（140-180h）や年数・人数などの数字は単価として扱わない
+_NOT_PRICE = re.compile(r'\d+(?:\.\d+)?(?:\s*[-~〜]\s*\d+(?:\.\d+)?)?\s*(?:h|H|時間|年|ヶ月|か月|カ月|ケ月|歳|才|名|人|%|日|社)')
+_PRICE_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+def parse_price_range(text: str) -> tuple:
+    """
+    "80万円"、"75万～85万"、"〜90"、"600,000円" のような文字列から (下限, 上限) を万円単位で返す。
+    1000 以上の数字は円とみなして万円に換算する。取り出せなければ (None, None)。
+    """
+    if not text or not isinstance(text, str): return None, None
+    normalized = unicodedata.normalize("NFKC", text).replace(",", "")
+    normalized = _NOT_PRICE.sub(" ", normalized)
+    values = []
+    for number in _PRICE_NUMBER.findall(normalized):
+        value = float(number)
+        if value >= 1000: value = value / 10000
+        if 1 <= value <= 500: values.append(round(value, 1))
+    if not values: return None, None
+    return min(values), max(values)
+
+
+# ==============================================================================
+# 2. 勤務地・リモート
+# ==============================================================================
+_PREFECTURES = (
+    "北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県", "茨城県", "栃木県", "群馬県",
+    "埼玉県", "千葉県", "東京都", "神奈川県", "新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県",
+    "岐阜県", "静岡県", "愛知県", "三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県",
+    "鳥取県", "島根県", "岡山県", "広島県", "山口県", "徳島県", "香川県", "愛媛県", "高知県", "福岡県",
+    "佐賀県", "長崎県", "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県",
+)
+# 都道府県名を書かずに市区名・駅名だけで書かれることが多い地名
+_PLACE_ALIASES = {
+    "23区": "東京都", "渋谷": "東京都", "新宿": "東京都", "品川": "東京都", "港区": "東京都", "千代田": "東京都",
+    "大手町": "東京都", "丸の内": "東京都", "六本木": "東京都", "秋葉原": "東京都", "池袋": "東京都", "田町": "東京都",
+    "横浜": "神奈川県", "川崎": "神奈川県", "名古屋": "愛知県", "梅田": "大阪府", "博多": "福岡県",
+    "札幌": "北海道", "仙台": "宮城県", "さいたま": "埼玉県", "幕張": "千葉県",
+}
+_PLACE_NAMES = {name if name == "北海道" else name[:-1]: name for name in _PREFECTURES}
+_PLACE_NAMES.update(_PLACE_ALIASES)
+_PLACE_PATTERN = re.compile("|".join(sorted(map(re.escape, _PLACE_NAMES), key=len, reverse=True)))
+
+_ONSITE_ONLY = re.compile(r'リモート不可|在宅不可|フル出社|完全出社|常駐のみ')
+_FULL_REMOTE = re.compile(r'フルリモ|完全リモート|完全在宅|フル在宅|リモートのみ|在宅のみ')
+_PARTIAL_REMOTE = re.compile(r'リモート|在宅|テレワーク')
+_ONSITE = re.compile(r'常駐|出社|オンサイト')
+
+def parse_work_style(text: str) -> str | None:
+    """勤務地の記述から remote / hybrid / onsite を判定する。判定できなければ None。"""
+    if not text: return None
+    normalized = unicodedata.normalize("NFKC", text)
+    if _ONSITE_ONLY.search(normalized): return "onsite"
+    if _FULL_REMOTE.search(normalized): return "remote"
+    if _PARTIAL_REMOTE.search(normalized): return "hybrid"
+    if _ONSITE.search(normalized) or parse_prefecture(normalized): return "onsite"
+    return None
+
+def parse_prefecture(text: str) -> str | None:
+    """勤務地の記述で最初に出てくる都道府県（地名からの推定を含む）を返す。"""
+    if not text: return None
+    match = _PLACE_PATTERN.search(unicodedata.normalize("NFKC", text))
+    return _PLACE_NAMES[match.group(0)] if match else None
+
+
+# ==============================================================================
+# 3. 開始時期・稼働可能日
+# ==============================================================================
+_IMMEDIATE = re.compile(r'即日|即可|即稼働|即時|すぐ|ASAP', re.IGNORECASE)
+_FULL_DATE = re.compile(r'(\d{4})\s*[/\-.年]\s*(\d{1,2})(?:\s*[/\-.月]\s*(\d{1,2}))?')
+_MONTH_DATE = re.compile(r'(\d{1,2})\s*月\s*(?:(\d{1,2})\s*日|(上旬|初旬|頭|中旬|下旬|末))?')
+_PART_OF_MONTH = {"上旬": 1, "初旬": 1, "頭": 1, "中旬": 11, "下旬": 21, "末": 21}
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def _safe_date(year: int, month: int, day: int) -> date | None:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_available_from(text: str, reference: date | None = None) -> date | None:
+    """
+    "即日"、"2024年7月"、"7月中旬"、"来月から" のような記述を日付にする。
+    年の無い月は reference（登録日）の年とし、reference より3か月以上前の月になるときは翌年とみなす。
+    """
+    if not text: return None
+    reference = reference or date.today()
+    normalized = unicodedata.normalize("NFKC", text)
+    if _IMMEDIATE.search(normalized): return reference
+    if "再来月" in normalized: return _add_months(reference, 2)
+    if "来月" in normalized: return _add_months(reference, 1)
+    if "今月" in normalized: return _add_months(reference, 0)
+
+    match = _FULL_DATE.search(normalized)
+    if match:
+        return _safe_date(int(match.group(1)), int(match.group(2)), int(match.group(3) or 1))
+
+    match = _MONTH_DATE.search(normalized)
+    if match:
+        month = int(match.group(1))
+        if not 1 <= month <= 12: return None
+        day = int(match.group(2)) if match.group(2) else _PART_OF_MONTH.get(match.group(3), 1)
+        year = reference.year + (1 if month < reference.month - 2 else 0)
+        return _safe_date(year, month, day)
+    return None
+
+
+# ==============================================================================
+# 4. まとめて取り出す
+# ==============================================================================
+
+def _as_date(value) -> date | None:
+    if isinstance(value, datetime): return value.date()
+    if isinstance(value, date): return value
+    if isinstance(value, str):
+        try: return datetime.fromisoformat(value.strip()[:19]).date()
+        except ValueError: return None
+    return None
+
+def extract_attributes(item_type: str, document: str, reference=None) -> dict:
+    """
+    document のメタ情報から ATTRIBUTE_COLUMNS の値を取り出す。
+    reference は開始時期の年を補うための基準日（登録日時）で、省略時は今日。
+    """
+    labels = META_LABELS.get(item_type, {})
+    meta = parse_meta_prefix(document)
+    location = meta.get(labels.get('location'), "")
+    price_min, price_max = parse_price_range(meta.get(labels.get('price'), ""))
+    return {
+        'price_min': price_min,
+        'price_max': price_max,
+        'work_style': parse_work_style(location),
+        'prefecture': parse_prefecture(location),
+        'available_from': parse_available_from(meta.get(labels.get('available'), ""), _as_date(reference)),
+        'attributes_version': ATTRIBUTES_VERSION,
+    }
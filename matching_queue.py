@@ -0,0 +1,219 @@
+# ==============================================================================
+# matching_queue.py
+# ==============================================================================
+# 再マッチングなどの重い処理のキュー（migrations/009_matching_queue.sql の jobs_queue）の操作。
+# 画面（backend.enqueue_rematch など）から登録し、run_matching_worker.py が取り出して実行する。
+# どの関数も psycopg2 の接続（DictCursor）を受け取り、自分の変更をその場でコミットする。
+# ワーカーはマッチング処理とは別の接続でこのモジュールを使うため、進捗はマッチング処理のトランザクションが
+# 終わるのを待たずに画面から見える。
+# ==============================================================================
+
+import json
+from dataclasses import dataclass
+
+# 待ち・実行中（画面で「処理中」として扱う状態）
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# 画面から登録するタスクの優先度（バッチから登録するタスクは 0）
+INTERACTIVE_PRIORITY = 10
+
+# 再試行までの待ち時間（秒）。attempts 回目の失敗のあと RETRY_BASE_SECONDS * 2^(attempts-1) 秒待つ
+RETRY_BASE_SECONDS = 30
+
+
+@dataclass
+class TaskResult:
+    """
+    タスクの処理（進捗を yield するジェネレータ）が最後に return する実行結果。
+    進捗のメッセージは画面に表示するだけで、成功・失敗は succeeded で判断する（finish に渡す）。
+    retryable=False は、入力が足りない・指定が正しくないなど、やり直しても同じ結果になる失敗（再試行しない）。
+    defer_seconds を指定すると、成功・失敗のどちらにもせず、その秒数のあとに実行し直す（再試行の回数には数えない。defer）。
+    """
+    succeeded: bool
+    message: str = ""
+    retryable: bool = True
+    defer_seconds: float | None = None
+
+
+def enqueue(conn, task_type: str, payload: dict, priority: int = 0, dedup_key: str | None = None,
+            requested_by: str | None = None, max_attempts: int = 3) -> tuple:
+    """
+    タスクを登録し、(タスクID, 新しく登録したか) を返す。
+    dedup_key が同じ待ち・実行中のタスクが既にあれば登録せず、そのタスクのIDを返す。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO jobs_queue (task_type, payload, priority, dedup_key, requested_by, max_attempts)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (dedup_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        """, (task_type, json.dumps(payload, ensure_ascii=False), priority, dedup_key, requested_by, max(1, max_attempts)))
+        row = cursor.fetchone()
+        if row:
+            conn.commit()
+            return row['id'], True
+        cursor.execute("SELECT id FROM jobs_queue WHERE dedup_key = %s AND status IN ('queued', 'running')", (dedup_key,))
+        row = cursor.fetchone()
+    conn.commit()
+    # 登録と入れ違いに既存のタスクが終わった場合は、もう一度登録する
+    return (row['id'], False) if row else enqueue(conn, task_type, payload, priority, dedup_key, requested_by, max_attempts)
+
+
+def claim(conn, worker_id: str, task_types=None):
+    """
+    実行できるタスクを優先度の高い順に1件取り出して running にし、その行を返す（無ければ None）。
+    他のワーカーが取り出し中の行は SKIP LOCKED で飛ばすため、ワーカー同士で待ち合わせない。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs_queue SET status = 'running', attempts = attempts + 1, worker_id = %(worker_id)s,
+                   started_at = now(), heartbeat_at = now(), finished_at = NULL
+            WHERE id = (
+                SELECT id FROM jobs_queue
+                WHERE status = 'queued' AND run_after <= now()
+                  AND (%(task_types)s::text[] IS NULL OR task_type = ANY(%(task_types)s::text[]))
+                ORDER BY priority DESC, run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, {"worker_id": worker_id, "task_types": list(task_types) if task_types else None})
+        task = cursor.fetchone()
+    conn.commit()
+    return task
+
+
+def report_progress(conn, task, message: str) -> bool:
+    """進捗を1行追記し、ハートビートを更新する。キャンセルが依頼されていれば True を返す。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            WITH progress AS (
+                INSERT INTO jobs_queue_progress (queue_id, attempt, message) VALUES (%(id)s, %(attempt)s, %(message)s)
+            )
+            UPDATE jobs_queue SET heartbeat_at = now() WHERE id = %(id)s AND worker_id = %(worker_id)s
+            RETURNING cancel_requested
+        """, {"id": task['id'], "attempt": task['attempts'], "message": message, "worker_id": task['worker_id']})
+        row = cursor.fetchone()
+    conn.commit()
+    # 行が返らないのは、止まったとみなされて別のワーカーに引き取られた場合。処理を打ち切る
+    return row is None or row['cancel_requested']
+
+
+def finish(conn, task, succeeded: bool, message: str | None = None, error: str | None = None,
+           retryable: bool = True) -> str:
+    """
+    実行の結果を記録し、新しい状態を返す。
+    失敗で再試行の回数が残っていれば、待ち時間をおいて queued に戻す。キャンセルが依頼されていれば cancelled にする。
+    retryable=False の失敗は、再試行の回数が残っていても failed にする。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs_queue SET
+                status = CASE
+                    WHEN cancel_requested THEN 'cancelled'
+                    WHEN %(succeeded)s THEN 'succeeded'
+                    WHEN %(retryable)s AND attempts < max_attempts THEN 'queued'
+                    ELSE 'failed' END,
+                run_after = CASE WHEN NOT %(succeeded)s AND NOT cancel_requested AND %(retryable)s AND attempts < max_attempts
+                                 THEN now() + make_interval(secs => %(retry_base)s * power(2, attempts - 1))
+                                 ELSE run_after END,
+                result_message = %(message)s,
+                last_error = coalesce(%(error)s, last_error),
+                worker_id = CASE WHEN cancel_requested OR %(succeeded)s OR NOT %(retryable)s OR attempts >= max_attempts
+                                 THEN worker_id END,
+                heartbeat_at = now(),
+                finished_at = CASE WHEN cancel_requested OR %(succeeded)s OR NOT %(retryable)s OR attempts >= max_attempts
+                                   THEN now() END
+            WHERE id = %(id)s AND worker_id = %(worker_id)s AND status = 'running'
+            RETURNING status
+        """, {"id": task['id'], "worker_id": task['worker_id'], "succeeded": succeeded, "message": message,
+              "error": error, "retryable": retryable, "retry_base": RETRY_BASE_SECONDS})
+        row = cursor.fetchone()
+    conn.commit()
+    return row['status'] if row else 'lost'
+
+
+def defer(conn, task, seconds: float, message: str | None = None) -> str:
+    """
+    実行中のタスクを、再試行の回数を使わずに seconds 秒後の待ちに戻し、新しい状態を返す。
+    ロックが重なったなど、タスク自体は失敗していないが今は実行できない場合に使う。キャンセルが依頼されていれば cancelled にする。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs_queue SET
+                status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END,
+                attempts = CASE WHEN cancel_requested THEN attempts ELSE greatest(attempts - 1, 0) END,
+                run_after = CASE WHEN cancel_requested THEN run_after ELSE now() + make_interval(secs => %(seconds)s) END,
+                result_message = %(message)s,
+                worker_id = CASE WHEN cancel_requested THEN worker_id END,
+                heartbeat_at = now(),
+                finished_at = CASE WHEN cancel_requested THEN now() END
+            WHERE id = %(id)s AND worker_id = %(worker_id)s AND status = 'running'
+            RETURNING status
+        """, {"id": task['id'], "worker_id": task['worker_id'], "seconds": seconds, "message": message})
+        row = cursor.fetchone()
+    conn.commit()
+    return row['status'] if row else 'lost'
+
+
+def cancel(conn, task_id: int) -> str | None:
+    """待ちのタスクはその場で cancelled にし、実行中のタスクにはキャンセルを依頼する。新しい状態を返す。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs_queue SET
+                cancel_requested = true,
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END
+            WHERE id = %s AND status IN ('queued', 'running')
+            RETURNING status
+        """, (task_id,))
+        row = cursor.fetchone()
+    conn.commit()
+    return row['status'] if row else None
+
+
+def requeue_stale(conn, stale_seconds: int) -> int:
+    """
+    ハートビートが stale_seconds 秒以上途絶えた実行中のタスク（ワーカーが落ちたもの）を、
+    再試行の回数が残っていれば queued に、残っていなければ failed にする。処理した件数を返す。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE jobs_queue SET
+                status = CASE WHEN cancel_requested THEN 'cancelled' WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                last_error = 'ワーカー ' || coalesce(worker_id, '?') || ' からの応答が途絶えました',
+                worker_id = NULL,
+                finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts THEN now() END
+            WHERE id IN (
+                SELECT id FROM jobs_queue
+                WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (stale_seconds,))
+        count = cursor.rowcount
+    conn.commit()
+    return count
+
+
+def get_task(conn, task_id: int):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM jobs_queue WHERE id = %s", (task_id,))
+        return cursor.fetchone()
+
+
+def find_active_task(conn, dedup_key: str):
+    """dedup_key の待ち・実行中のタスクを返す（無ければ None）。画面を開き直したときに進捗の表示を再開するのに使う。"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM jobs_queue WHERE dedup_key = %s AND status IN ('queued', 'running')", (dedup_key,))
+        return cursor.fetchone()
+
+
+def get_progress(conn, task_id: int, after_id: int = 0, limit: int = 500) -> list:
+    """after_id より後の進捗の行を古い順に返す（画面は最後に読んだIDを覚えておき、続きだけを読む）。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, attempt, message, created_at FROM jobs_queue_progress
+            WHERE queue_id = %s AND id > %s ORDER BY id LIMIT %s
+        """, (task_id, after_id, limit))
+        return cursor.fetchall()
@@ -0,0 +1,112 @@
+-- ==============================================================================
+-- 000_baseline_schema.sql
+-- ==============================================================================
+-- アプリ本体のテーブル。以前は init_database() がページを開くたびに information_schema を調べて
+-- 足りない列を追加していたものを、1つのマイグレーションにまとめた。
+-- 稼働中のデータベースにもそのまま適用できるよう、すべて IF NOT EXISTS で書いている
+-- （既存の列の型は変更しない）。
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    project_name TEXT,
+    document TEXT NOT NULL,
+    source_data_json TEXT,
+    created_at TIMESTAMP,
+    assigned_user_id INTEGER REFERENCES users(id),
+    is_hidden INTEGER NOT NULL DEFAULT 0,
+    received_at TIMESTAMP WITH TIME ZONE,
+    keywords TEXT[]
+);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS assigned_user_id INTEGER REFERENCES users(id);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS is_hidden INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS received_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS keywords TEXT[];
+
+CREATE TABLE IF NOT EXISTS engineers (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    document TEXT NOT NULL,
+    source_data_json TEXT,
+    created_at TIMESTAMP,
+    assigned_user_id INTEGER REFERENCES users(id),
+    is_hidden INTEGER NOT NULL DEFAULT 0,
+    received_at TIMESTAMP WITH TIME ZONE,
+    keywords TEXT[]
+);
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS assigned_user_id INTEGER REFERENCES users(id);
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS is_hidden INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS received_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS keywords TEXT[];
+
+CREATE TABLE IF NOT EXISTS matching_results (
+    id SERIAL PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    engineer_id INTEGER NOT NULL REFERENCES engineers (id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    is_hidden INTEGER DEFAULT 0,
+    grade TEXT,
+    positive_points TEXT,
+    concern_points TEXT,
+    proposal_text TEXT,
+    status TEXT DEFAULT '新規',
+    status_updated_at TIMESTAMP WITH TIME ZONE,
+    feedback_status TEXT,
+    feedback_comment TEXT,
+    feedback_user_id INTEGER REFERENCES users(id),
+    feedback_at TIMESTAMP WITH TIME ZONE,
+    ai_learning_summary TEXT,
+    internal_memo TEXT,
+    UNIQUE (job_id, engineer_id)
+);
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS positive_points TEXT;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS concern_points TEXT;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS status TEXT DEFAULT '新規';
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS status_updated_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS feedback_status TEXT;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS feedback_comment TEXT;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS feedback_user_id INTEGER REFERENCES users(id);
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS feedback_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS ai_learning_summary TEXT;
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS internal_memo TEXT;
+
+-- 自動マッチング依頼（案件・技術者ごとに1件。新着が登録されるたびに last_processed_* 以降を評価する）
+CREATE TABLE IF NOT EXISTS auto_matching_requests (
+    id SERIAL PRIMARY KEY,
+    item_id INTEGER NOT NULL,
+    item_type TEXT NOT NULL,
+    target_rank TEXT,
+    notification_email TEXT,
+    created_by_user_id INTEGER REFERENCES users(id),
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    last_processed_job_id INTEGER,
+    last_processed_engineer_id INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (item_id, item_type)
+);
+
+-- AI の呼び出し回数の記録（ダッシュボードの本日のAI処理件数）
+CREATE TABLE IF NOT EXISTS ai_activity_log (
+    id SERIAL PRIMARY KEY,
+    activity_type TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 初回のみ、担当者の選択肢となるユーザーを登録する
+INSERT INTO users (username, email)
+SELECT v.username, v.email
+FROM (VALUES
+    ('熊崎', 'yamada@example.com'), ('岩本', 'suzuki@example.com'), ('小関', 'sato@example.com'),
+    ('内山', 'sato@example.com'), ('島田', 'sato@example.com'), ('長谷川', 'sato@example.com'),
+    ('北島', 'sato@example.com'), ('岩崎', 'sato@example.com'), ('根岸', 'sato@example.com'),
+    ('添田', 'sato@example.com'), ('山浦', 'sato@example.com'), ('福田', 'sato@example.com')
+) AS v (username, email)
+WHERE NOT EXISTS (SELECT 1 FROM users);
@@ -0,0 +1,50 @@
+-- migrate: no-transaction
+-- ==============================================================================
+-- 001_hot_query_indexes.sql
+-- ==============================================================================
+-- 一覧・ダッシュボード・マッチング候補の検索で使う列にインデックスを追加する。
+-- 稼働中のテーブルをロックしないよう CONCURRENTLY で作成するため、トランザクションの外で1文ずつ実行する。
+-- 途中で失敗した場合は INVALID なインデックスが残るので、DROP INDEX してから再実行すること。
+-- ==============================================================================
+
+-- ILIKE '%キーワード%' の検索に使う（gin_trgm_ops）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- --- matching_results ---
+-- job_id 始まりの検索は UNIQUE (job_id, engineer_id) で足りるため、engineer_id 単独の検索用だけを追加する
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matching_results_engineer_id
+    ON matching_results (engineer_id);
+-- 提案中の件数（status IN (...)）と、本日の採用数（status = '採用' AND status_updated_at の範囲）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matching_results_status_updated
+    ON matching_results (status, status_updated_at);
+-- 本日のマッチング数・ライブログ（is_hidden = 0 AND created_at の範囲、created_at 降順）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matching_results_visible_created
+    ON matching_results (created_at DESC) WHERE is_hidden = 0;
+-- フィードバック履歴（feedback_status IS NOT NULL を feedback_at 降順で）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matching_results_feedback_at
+    ON matching_results (feedback_at DESC) WHERE feedback_status IS NOT NULL;
+
+-- --- jobs ---
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_visible_created
+    ON jobs (created_at DESC) WHERE is_hidden = 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_keywords
+    ON jobs USING GIN (keywords);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_document_trgm
+    ON jobs USING GIN (document gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_project_name_trgm
+    ON jobs USING GIN (project_name gin_trgm_ops);
+
+-- --- engineers ---
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_visible_created
+    ON engineers (created_at DESC) WHERE is_hidden = 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_keywords
+    ON engineers USING GIN (keywords);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_document_trgm
+    ON engineers USING GIN (document gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_name_trgm
+    ON engineers USING GIN (name gin_trgm_ops);
+
+-- プランナーが新しいインデックスを選べるよう、統計情報を更新する
+ANALYZE matching_results;
+ANALYZE jobs;
+ANALYZE engineers;
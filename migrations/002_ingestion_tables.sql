@@ -0,0 +1,69 @@
+-- ==============================================================================
+-- 002_ingestion_tables.sql
+-- ==============================================================================
+-- メール取り込み（run_email_processor.py）が使うテーブル。
+-- 以前は取り込みのたびに CREATE TABLE IF NOT EXISTS を実行していたものを移した。
+-- ==============================================================================
+
+-- IMAP の処理済み位置（メールボックスごとの UIDVALIDITY と最終UID）
+CREATE TABLE IF NOT EXISTS imap_sync_state (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity BIGINT NOT NULL,
+    last_uid BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 添付ファイルの抽出結果のキャッシュ（sha256 がキー）
+CREATE TABLE IF NOT EXISTS attachment_text_cache (
+    sha256 TEXT PRIMARY KEY,
+    filename TEXT,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 取り込み時の重複検知（ingest_dedup.py の指紋）
+CREATE TABLE IF NOT EXISTS ingest_fingerprints (
+    id SERIAL PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    minhash BIGINT[],
+    lsh_bands TEXT[],
+    text_length INTEGER,
+    canonical_hash TEXT,
+    similarity REAL,
+    job_ids INTEGER[] DEFAULT '{}',
+    engineer_ids INTEGER[] DEFAULT '{}',
+    subject TEXT,
+    sender TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_fingerprints_hash ON ingest_fingerprints (content_hash);
+CREATE INDEX IF NOT EXISTS idx_ingest_fingerprints_bands ON ingest_fingerprints USING GIN (lsh_bands);
+
+-- 返信メールの取り込み済みセグメント（reply_segmenter.py のハッシュ）
+CREATE TABLE IF NOT EXISTS ingest_segments (
+    segment_hash TEXT PRIMARY KEY,
+    job_ids INTEGER[] DEFAULT '{}',
+    engineer_ids INTEGER[] DEFAULT '{}',
+    seen_count INTEGER DEFAULT 1,
+    first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 取り込み台帳（メールごとの処理段階。中断した実行の再開に使う）
+CREATE TABLE IF NOT EXISTS ingested_messages (
+    message_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    mailbox TEXT,
+    uidvalidity BIGINT,
+    uid BIGINT,
+    status TEXT NOT NULL DEFAULT 'fetched',
+    analysis_json JSONB,
+    job_ids INTEGER[] DEFAULT '{}',
+    engineer_ids INTEGER[] DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (message_id, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_ingested_messages_uid ON ingested_messages (mailbox, uidvalidity, uid);
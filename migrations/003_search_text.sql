@@ -0,0 +1,66 @@
+-- ==============================================================================
+-- 003_search_text.sql
+-- ==============================================================================
+-- 管理画面・ダッシュボードのキーワード検索用の列（search_text）。
+-- 名前（案件名・氏名）・担当者名・本文を NFKC 正規化・小文字化して1列にまとめ、pg_trgm の GIN インデックスで
+-- 部分一致（LIKE '%キーワード%'）を検索する。列は書き込み時にトリガーで更新する。
+-- 検索側の正規化は text_search.normalize_search_text と同じ規則にしている。
+-- 日本語の trigram を作るには、データベースの LC_CTYPE が C 以外（ja_JP.UTF-8 / C.UTF-8 など）である必要がある。
+-- ==============================================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION search_normalize(value TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT btrim(regexp_replace(lower(normalize(coalesce(value, ''), NFKC)), '\s+', ' ', 'g'))
+$$;
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS search_text TEXT;
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS search_text TEXT;
+
+UPDATE jobs j SET search_text = search_normalize(concat_ws(' ', j.project_name, (SELECT u.username FROM users u WHERE u.id = j.assigned_user_id), j.document));
+UPDATE engineers e SET search_text = search_normalize(concat_ws(' ', e.name, (SELECT u.username FROM users u WHERE u.id = e.assigned_user_id), e.document));
+
+-- TG_ARGV[0] は名前の列（jobs は project_name、engineers は name）
+CREATE OR REPLACE FUNCTION refresh_item_search_text() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    assignee TEXT;
+BEGIN
+    SELECT username INTO assignee FROM users WHERE id = NEW.assigned_user_id;
+    NEW.search_text := search_normalize(concat_ws(' ', to_jsonb(NEW) ->> TG_ARGV[0], assignee, NEW.document));
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_search_text ON jobs;
+CREATE TRIGGER trg_jobs_search_text
+    BEFORE INSERT OR UPDATE OF project_name, document, assigned_user_id ON jobs
+    FOR EACH ROW EXECUTE FUNCTION refresh_item_search_text('project_name');
+
+DROP TRIGGER IF EXISTS trg_engineers_search_text ON engineers;
+CREATE TRIGGER trg_engineers_search_text
+    BEFORE INSERT OR UPDATE OF name, document, assigned_user_id ON engineers
+    FOR EACH ROW EXECUTE FUNCTION refresh_item_search_text('name');
+
+-- 担当者名が変わったら、その担当者の案件・技術者の search_text を作り直す（上のトリガーを発火させる）
+CREATE OR REPLACE FUNCTION refresh_assignee_search_text() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE jobs SET assigned_user_id = assigned_user_id WHERE assigned_user_id = NEW.id;
+    UPDATE engineers SET assigned_user_id = assigned_user_id WHERE assigned_user_id = NEW.id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_search_text ON users;
+CREATE TRIGGER trg_users_search_text
+    AFTER UPDATE OF username ON users
+    FOR EACH ROW WHEN (OLD.username IS DISTINCT FROM NEW.username)
+    EXECUTE FUNCTION refresh_assignee_search_text();
+
+CREATE INDEX IF NOT EXISTS idx_jobs_search_text_trgm ON jobs USING GIN (search_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_engineers_search_text_trgm ON engineers USING GIN (search_text gin_trgm_ops);
+
+ANALYZE jobs;
+ANALYZE engineers;
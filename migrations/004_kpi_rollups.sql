@@ -0,0 +1,227 @@
+-- ==============================================================================
+-- 004_kpi_rollups.sql
+-- ==============================================================================
+-- ライブダッシュボード（backend.get_live_dashboard_data）の KPI を、集計済みの行から読むための集計テーブル。
+--   kpi_daily_counts      日付（JST）× 指標ごとの件数
+--                         jobs / engineers（表示中の登録件数）、matches（表示中のマッチング件数）、
+--                         adopted（「採用」に変更された件数。status_updated_at の日付）、ai:<activity_type>
+--   kpi_status_counts     matching_results のステータス別件数
+--   item_match_counts     案件・技術者ごとの表示中マッチング件数（自動マッチング依頼の50件上限の判定用）
+--   kpi_monthly_adoptions 月（JST、マッチング作成日）× 案件ごとの採用件数（担当者別ランキング用）
+--
+-- 元テーブルのトリガーは増減を kpi_deltas に追記するだけにして、集計テーブルの行は kpi_fold() がまとめて更新する。
+-- 再マッチングのように1トランザクションで大量に書き込む処理があるため、トリガーから集計行を直接更新すると、
+-- その行ロックがトランザクションの終わりまで残り、他の書き込みを待たせてしまう。
+-- kpi_fold() はダッシュボードの表示時と run_kpi_refresh.py（cron）が呼ぶ。
+-- 集計がずれた場合（トリガーを通らない一括投入など）は、python run_kpi_refresh.py --rebuild で作り直す。
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS kpi_daily_counts (
+    day DATE NOT NULL,
+    metric TEXT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, metric)
+);
+
+CREATE TABLE IF NOT EXISTS kpi_status_counts (
+    status TEXT PRIMARY KEY,
+    count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS item_match_counts (
+    item_type TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    match_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (item_type, item_id)
+);
+
+CREATE TABLE IF NOT EXISTS kpi_monthly_adoptions (
+    month DATE NOT NULL,
+    job_id INTEGER NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, job_id)
+);
+
+-- kind: daily（day, key=指標）/ status（key=ステータス）/ item（key=job|engineer, item_id）/ adoption（day=月, item_id=案件ID）
+CREATE TABLE IF NOT EXISTS kpi_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    day DATE,
+    key TEXT,
+    item_id INTEGER,
+    delta INTEGER NOT NULL
+);
+
+
+-- ==============================================================================
+-- 1. 日付の変換
+-- ==============================================================================
+-- タイムゾーン無しの列（jobs / engineers の created_at など）は、取り込み処理が JST で書き込んでいるのでそのまま日付にする。
+-- タイムゾーン付きの列は JST に変換してから日付にする。
+CREATE OR REPLACE FUNCTION kpi_jst_date(value TIMESTAMP) RETURNS DATE
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT value::date $$;
+
+CREATE OR REPLACE FUNCTION kpi_jst_date(value TIMESTAMPTZ) RETURNS DATE
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT (value AT TIME ZONE 'Asia/Tokyo')::date $$;
+
+-- 古いスキーマで created_at が TEXT のまま残っているデータベース向け
+CREATE OR REPLACE FUNCTION kpi_jst_date(value TEXT) RETURNS DATE
+LANGUAGE sql STABLE AS $$ SELECT value::timestamp::date $$;
+
+
+-- ==============================================================================
+-- 2. 増減を記録するトリガー
+-- ==============================================================================
+-- jobs / engineers: TG_ARGV[0] は指標名（jobs / engineers）
+CREATE OR REPLACE FUNCTION kpi_log_item_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(OLD.is_hidden, 0) = 0 AND OLD.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(OLD.created_at), TG_ARGV[0], -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(NEW.is_hidden, 0) = 0 AND NEW.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(NEW.created_at), TG_ARGV[0], 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kpi_log_match_row(r matching_results, delta INTEGER) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF COALESCE(r.is_hidden, 0) = 0 THEN
+        IF r.created_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(r.created_at), 'matches', delta);
+        END IF;
+        INSERT INTO kpi_deltas (kind, key, item_id, delta) VALUES ('item', 'job', r.job_id, delta), ('item', 'engineer', r.engineer_id, delta);
+    END IF;
+    IF r.status IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, key, delta) VALUES ('status', r.status, delta);
+    END IF;
+    IF r.status = '採用' THEN
+        IF r.status_updated_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(r.status_updated_at), 'adopted', delta);
+        END IF;
+        IF r.created_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, item_id, delta) VALUES ('adoption', date_trunc('month', kpi_jst_date(r.created_at))::date, r.job_id, delta);
+        END IF;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kpi_log_match_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN PERFORM kpi_log_match_row(OLD, -1); END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN PERFORM kpi_log_match_row(NEW, 1); END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kpi_log_activity_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND OLD.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(OLD.created_at), 'ai:' || OLD.activity_type, -1);
+    END IF;
+    IF TG_OP = 'INSERT' AND NEW.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(NEW.created_at), 'ai:' || NEW.activity_type, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_kpi ON jobs;
+CREATE TRIGGER trg_jobs_kpi
+    AFTER INSERT OR DELETE OR UPDATE OF is_hidden, created_at ON jobs
+    FOR EACH ROW EXECUTE FUNCTION kpi_log_item_change('jobs');
+
+DROP TRIGGER IF EXISTS trg_engineers_kpi ON engineers;
+CREATE TRIGGER trg_engineers_kpi
+    AFTER INSERT OR DELETE OR UPDATE OF is_hidden, created_at ON engineers
+    FOR EACH ROW EXECUTE FUNCTION kpi_log_item_change('engineers');
+
+-- 提案文・メモ・フィードバックなど集計に関係しない列の更新では発火させない
+DROP TRIGGER IF EXISTS trg_matching_results_kpi ON matching_results;
+CREATE TRIGGER trg_matching_results_kpi
+    AFTER INSERT OR DELETE OR UPDATE OF is_hidden, status, status_updated_at, created_at, job_id, engineer_id ON matching_results
+    FOR EACH ROW EXECUTE FUNCTION kpi_log_match_change();
+
+DROP TRIGGER IF EXISTS trg_ai_activity_log_kpi ON ai_activity_log;
+CREATE TRIGGER trg_ai_activity_log_kpi
+    AFTER INSERT OR DELETE ON ai_activity_log
+    FOR EACH ROW EXECUTE FUNCTION kpi_log_activity_change();
+
+
+-- ==============================================================================
+-- 3. 集計テーブルへの反映・作り直し
+-- ==============================================================================
+-- kpi_deltas をまとめて集計テーブルへ足し込み、反映した件数を返す。
+-- 同時に呼ばれた場合は1つだけが実行し、他は何もせず 0 を返す（次の呼び出しで反映される）。
+CREATE OR REPLACE FUNCTION kpi_fold() RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    folded INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('kpi_fold')) THEN
+        RETURN 0;
+    END IF;
+    -- データ変更を含む WITH 句は、参照されなくてもすべて実行される
+    WITH moved AS (
+        DELETE FROM kpi_deltas RETURNING kind, day, key, item_id, delta
+    ), daily AS (
+        INSERT INTO kpi_daily_counts (day, metric, count)
+        SELECT day, key, SUM(delta) FROM moved WHERE kind = 'daily' GROUP BY day, key
+        ON CONFLICT (day, metric) DO UPDATE SET count = kpi_daily_counts.count + EXCLUDED.count
+    ), statuses AS (
+        INSERT INTO kpi_status_counts (status, count)
+        SELECT key, SUM(delta) FROM moved WHERE kind = 'status' GROUP BY key
+        ON CONFLICT (status) DO UPDATE SET count = kpi_status_counts.count + EXCLUDED.count
+    ), items AS (
+        INSERT INTO item_match_counts (item_type, item_id, match_count)
+        SELECT key, item_id, SUM(delta) FROM moved WHERE kind = 'item' AND item_id IS NOT NULL GROUP BY key, item_id
+        ON CONFLICT (item_type, item_id) DO UPDATE SET match_count = item_match_counts.match_count + EXCLUDED.match_count
+    ), adoptions AS (
+        INSERT INTO kpi_monthly_adoptions (month, job_id, count)
+        SELECT day, item_id, SUM(delta) FROM moved WHERE kind = 'adoption' AND item_id IS NOT NULL GROUP BY day, item_id
+        ON CONFLICT (month, job_id) DO UPDATE SET count = kpi_monthly_adoptions.count + EXCLUDED.count
+    )
+    SELECT count(*) INTO folded FROM moved;
+    RETURN folded;
+END;
+$$;
+
+-- 元テーブルからすべての集計を作り直す。集計中の書き込みを止めるため、元テーブルを SHARE モードでロックする。
+CREATE OR REPLACE FUNCTION kpi_rebuild() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('kpi_fold'));
+    LOCK TABLE jobs, engineers, matching_results, ai_activity_log IN SHARE MODE;
+    TRUNCATE kpi_deltas, kpi_daily_counts, kpi_status_counts, item_match_counts, kpi_monthly_adoptions;
+
+    INSERT INTO kpi_daily_counts (day, metric, count)
+    SELECT kpi_jst_date(created_at), 'jobs', COUNT(*) FROM jobs WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'engineers', COUNT(*) FROM engineers WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'matches', COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(status_updated_at), 'adopted', COUNT(*) FROM matching_results WHERE status = '採用' AND status_updated_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'ai:' || activity_type, COUNT(*) FROM ai_activity_log WHERE created_at IS NOT NULL GROUP BY 1, 2;
+
+    INSERT INTO kpi_status_counts (status, count)
+    SELECT status, COUNT(*) FROM matching_results WHERE status IS NOT NULL GROUP BY status;
+
+    INSERT INTO item_match_counts (item_type, item_id, match_count)
+    SELECT 'job', job_id, COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND job_id IS NOT NULL GROUP BY job_id
+    UNION ALL
+    SELECT 'engineer', engineer_id, COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND engineer_id IS NOT NULL GROUP BY engineer_id;
+
+    INSERT INTO kpi_monthly_adoptions (month, job_id, count)
+    SELECT date_trunc('month', kpi_jst_date(created_at))::date, job_id, COUNT(*) FROM matching_results
+    WHERE status = '採用' AND created_at IS NOT NULL AND job_id IS NOT NULL GROUP BY 1, 2;
+END;
+$$;
+
+SELECT kpi_rebuild();
@@ -0,0 +1,30 @@
+-- migrate: no-transaction
+-- ==============================================================================
+-- 005_dashboard_list_columns.sql
+-- ==============================================================================
+-- ダッシュボードのマッチング結果一覧（backend.get_dashboard_match_page）を、1ページずつ
+-- キーセット方式（AI評価の優先度・作成日時・ID の降順）で読むための列とインデックス。
+--   matching_results.grade_priority       AI評価の並び順（S=5 … D=1、それ以外は 0）
+--   jobs.requires_japanese_national       本文に「外国籍不可」または「日本人」を含む案件
+--   engineers.is_japanese_national        本文に「国籍: 日本」を含む技術者
+-- いずれも本文・評価から計算する生成列（STORED）なので、書き込み側の変更は要らない。
+-- 列の追加ではテーブルが書き換えられる（その間は読み書きが待たされる）ため、利用の少ない時間に適用すること。
+-- ==============================================================================
+
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS grade_priority SMALLINT
+    GENERATED ALWAYS AS (CASE grade WHEN 'S' THEN 5 WHEN 'A' THEN 4 WHEN 'B' THEN 3 WHEN 'C' THEN 2 WHEN 'D' THEN 1 ELSE 0 END) STORED;
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS requires_japanese_national BOOLEAN
+    GENERATED ALWAYS AS (coalesce(strpos(document, '外国籍不可') > 0 OR strpos(document, '日本人') > 0, false)) STORED;
+
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS is_japanese_national BOOLEAN
+    GENERATED ALWAYS AS (coalesce(strpos(document, '国籍: 日本') > 0, false)) STORED;
+
+-- 一覧の並び順（ORDER BY grade_priority DESC, created_at DESC, id DESC）と、次のページの条件
+-- （(grade_priority, created_at, id) < (前のページの最後の行)）をこのインデックスの範囲スキャンで読む
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_matching_results_list_order
+    ON matching_results (grade_priority DESC, created_at DESC, id DESC);
+
+ANALYZE matching_results;
+ANALYZE jobs;
+ANALYZE engineers;
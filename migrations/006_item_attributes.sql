@@ -0,0 +1,51 @@
+-- ==============================================================================
+-- 006_item_attributes.sql
+-- ==============================================================================
+-- 案件・技術者の単価・勤務地・開始時期を、document のメタ情報の文字列ではなく型付きの列で持つ。
+-- 値は item_attributes.extract_attributes で取り出し、登録時（run_email_processor など）と
+-- run_attribute_backfill.py で保存する。インデックスは 007_item_attribute_indexes.sql で作成する。
+--   price_min / price_max   単価・希望単価（万円）
+--   work_style              remote / hybrid / onsite
+--   prefecture              都道府県名
+--   available_from          開始時期・稼働可能日
+--   attributes_version      値を取り出したときの item_attributes.ATTRIBUTES_VERSION（未解析は NULL）
+-- 列の追加は既存の行を書き換えない（NULL のまま追加される）ため、すぐに終わる。
+-- ==============================================================================
+
+ALTER TABLE jobs
+    ADD COLUMN IF NOT EXISTS price_min REAL,
+    ADD COLUMN IF NOT EXISTS price_max REAL,
+    ADD COLUMN IF NOT EXISTS work_style TEXT,
+    ADD COLUMN IF NOT EXISTS prefecture TEXT,
+    ADD COLUMN IF NOT EXISTS available_from DATE,
+    ADD COLUMN IF NOT EXISTS attributes_version SMALLINT;
+
+ALTER TABLE engineers
+    ADD COLUMN IF NOT EXISTS price_min REAL,
+    ADD COLUMN IF NOT EXISTS price_max REAL,
+    ADD COLUMN IF NOT EXISTS work_style TEXT,
+    ADD COLUMN IF NOT EXISTS prefecture TEXT,
+    ADD COLUMN IF NOT EXISTS available_from DATE,
+    ADD COLUMN IF NOT EXISTS attributes_version SMALLINT;
+
+-- document だけが書き換えられた行は、値が古くなるので未解析（attributes_version = NULL）に戻す。
+-- 同じ UPDATE で attributes_version も設定した場合（登録・再解析の処理）はそのままにする。
+CREATE OR REPLACE FUNCTION reset_item_attributes_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.document IS DISTINCT FROM OLD.document AND NEW.attributes_version IS NOT DISTINCT FROM OLD.attributes_version THEN
+        NEW.attributes_version := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_attributes_version ON jobs;
+CREATE TRIGGER trg_jobs_attributes_version
+    BEFORE UPDATE OF document ON jobs
+    FOR EACH ROW EXECUTE FUNCTION reset_item_attributes_version();
+
+DROP TRIGGER IF EXISTS trg_engineers_attributes_version ON engineers;
+CREATE TRIGGER trg_engineers_attributes_version
+    BEFORE UPDATE OF document ON engineers
+    FOR EACH ROW EXECUTE FUNCTION reset_item_attributes_version();
@@ -0,0 +1,31 @@
+-- migrate: no-transaction
+-- ==============================================================================
+-- 007_item_attribute_indexes.sql
+-- ==============================================================================
+-- 006_item_attributes.sql の列で、マッチング候補を SQL で事前に絞り込むためのインデックス。
+-- 稼働中のテーブルをロックしないよう CONCURRENTLY で作成する。
+-- ==============================================================================
+
+-- 単価の事前フィルター（案件単価 + 5万円 >= 技術者の希望単価）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_price_min
+    ON jobs (price_min) WHERE is_hidden = 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_price_min
+    ON engineers (price_min) WHERE is_hidden = 0;
+
+-- 開始時期・稼働可能日の範囲
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_available_from
+    ON jobs (available_from) WHERE is_hidden = 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_available_from
+    ON engineers (available_from) WHERE is_hidden = 0;
+
+-- リモート可否・都道府県
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_work_style_prefecture
+    ON jobs (work_style, prefecture) WHERE is_hidden = 0;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_work_style_prefecture
+    ON engineers (work_style, prefecture) WHERE is_hidden = 0;
+
+-- バックフィルの対象（未解析・古い版で解析した行）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_attributes_version
+    ON jobs (id) WHERE attributes_version IS NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engineers_attributes_version
+    ON engineers (id) WHERE attributes_version IS NULL;
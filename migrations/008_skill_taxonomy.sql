@@ -0,0 +1,181 @@
+-- ==============================================================================
+-- 008_skill_taxonomy.sql
+-- ==============================================================================
+-- キーワード（LLM が抽出した小文字の TEXT[]）を、スキル辞書の整数IDに正規化して持つ。
+--   skills             正規のスキル名と親スキル（Spring Boot の親は Spring、など）
+--   skill_aliases      表記ゆれ（skill_key で正規化した文字列）→ スキルID
+--   jobs.skill_ids / engineers.skill_ids
+--                      keywords を辞書で引いたスキルIDに、親スキルのIDを加えた昇順の配列
+-- skill_ids は keywords を書き込んだときにトリガーで更新する（書き込み側の変更は要らない）。
+-- 辞書に無いキーワードは、その表記を正規名とする新しいスキルとして登録する。
+-- 「springboot」と「spring」のような派生は、親スキルを配列に含めることで重なりとして数える
+-- （従来の calculate_keyword_score の部分一致に相当し、「java」と「javascript」は別のスキルになる）。
+-- 表記ゆれの正規化は skill_taxonomy.normalize_skill_key と同じ規則にしている。
+-- 別名・親スキルを直したら、SELECT skill_reindex(); で既存の行の skill_ids を作り直す。
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS skills (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    parent_id INTEGER REFERENCES skills(id) ON DELETE SET NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS skill_aliases (
+    alias TEXT PRIMARY KEY,
+    skill_id INTEGER NOT NULL REFERENCES skills(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_skills_parent_id ON skills (parent_id);
+
+-- 全角・半角と大文字・小文字をそろえ、空白と「. _ - ・」を取り除く（"Node.js" → "nodejs"、"Spring Boot" → "springboot"）
+CREATE OR REPLACE FUNCTION skill_key(value TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT regexp_replace(lower(normalize(coalesce(value, ''), NFKC)), '[\s._\-・]+', '', 'g')
+$$;
+
+-- スキル自身と、その親・祖先のID（親子関係が循環していても止まるよう、深さを制限する）
+CREATE OR REPLACE FUNCTION skill_with_ancestors(skill INTEGER) RETURNS INTEGER[]
+LANGUAGE sql STABLE AS $$
+    WITH RECURSIVE chain (id, parent_id, depth) AS (
+        SELECT id, parent_id, 0 FROM skills WHERE id = skill
+        UNION ALL
+        SELECT s.id, s.parent_id, c.depth + 1 FROM skills s JOIN chain c ON s.id = c.parent_id WHERE c.depth < 8
+    )
+    SELECT coalesce(array_agg(DISTINCT id), '{}') FROM chain
+$$;
+
+-- キーワードの配列をスキルIDの配列（親スキルを含む、昇順・重複なし）にする。辞書に無いキーワードはスキルとして登録する
+CREATE OR REPLACE FUNCTION resolve_skill_ids(keywords TEXT[]) RETURNS INTEGER[]
+LANGUAGE plpgsql AS $$
+DECLARE
+    keyword TEXT;
+    alias_key TEXT;
+    skill INTEGER;
+    result INTEGER[] := '{}';
+BEGIN
+    IF keywords IS NULL THEN RETURN NULL; END IF;
+    FOREACH keyword IN ARRAY keywords LOOP
+        alias_key := skill_key(keyword);
+        CONTINUE WHEN alias_key = '';
+        SELECT skill_id INTO skill FROM skill_aliases WHERE alias = alias_key;
+        IF skill IS NULL THEN
+            INSERT INTO skills (name) VALUES (btrim(keyword))
+                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id INTO skill;
+            -- 別のトランザクションが同じ表記を先に登録していた場合は、そちらのスキルを使う
+            INSERT INTO skill_aliases (alias, skill_id) VALUES (alias_key, skill) ON CONFLICT (alias) DO NOTHING;
+            SELECT skill_id INTO skill FROM skill_aliases WHERE alias = alias_key;
+        END IF;
+        result := result || skill_with_ancestors(skill);
+    END LOOP;
+    RETURN ARRAY(SELECT DISTINCT unnest(result) ORDER BY 1);
+END;
+$$;
+
+-- ==============================================================================
+-- よく使われるスキルと表記ゆれ（正規名の skill_key は別名に自動で加える）
+-- ==============================================================================
+CREATE TEMP TABLE skill_seed (name TEXT, parent TEXT, aliases TEXT[]) ON COMMIT DROP;
+INSERT INTO skill_seed (name, parent, aliases) VALUES
+    ('Java', NULL, '{}'),
+    ('Spring', 'Java', '{springframework}'),
+    ('Spring Boot', 'Spring', '{}'),
+    ('Kotlin', NULL, '{}'),
+    ('JavaScript', NULL, '{js,ecmascript}'),
+    ('TypeScript', 'JavaScript', '{ts}'),
+    ('Node.js', 'JavaScript', '{node}'),
+    ('React', 'JavaScript', '{reactjs}'),
+    ('Next.js', 'React', '{}'),
+    ('Vue.js', 'JavaScript', '{vue}'),
+    ('Nuxt.js', 'Vue.js', '{nuxt}'),
+    ('Angular', 'JavaScript', '{angularjs}'),
+    ('Python', NULL, '{}'),
+    ('Django', 'Python', '{}'),
+    ('Flask', 'Python', '{}'),
+    ('FastAPI', 'Python', '{}'),
+    ('Ruby', NULL, '{}'),
+    ('Ruby on Rails', 'Ruby', '{rails,ror}'),
+    ('PHP', NULL, '{}'),
+    ('Laravel', 'PHP', '{}'),
+    ('Go', NULL, '{golang}'),
+    ('C#', NULL, '{csharp}'),
+    ('.NET', 'C#', '{dotnet,aspnet,aspnetcore}'),
+    ('C++', NULL, '{cpp}'),
+    ('C', NULL, '{c言語}'),
+    ('Swift', NULL, '{}'),
+    ('SQL', NULL, '{}'),
+    ('MySQL', 'SQL', '{}'),
+    ('PostgreSQL', 'SQL', '{postgres}'),
+    ('Oracle', 'SQL', '{oracledb,oracledatabase}'),
+    ('SQL Server', 'SQL', '{mssql,mssqlserver}'),
+    ('AWS', NULL, '{amazonwebservices}'),
+    ('GCP', NULL, '{googlecloud,googlecloudplatform}'),
+    ('Azure', NULL, '{microsoftazure}'),
+    ('Docker', NULL, '{}'),
+    ('Kubernetes', NULL, '{k8s}'),
+    ('Terraform', NULL, '{}'),
+    ('Linux', NULL, '{}'),
+    ('Git', NULL, '{}'),
+    ('COBOL', NULL, '{}'),
+    ('SAP', NULL, '{}'),
+    ('PMO', NULL, '{}');
+
+INSERT INTO skills (name) SELECT name FROM skill_seed ON CONFLICT (name) DO NOTHING;
+UPDATE skills s SET parent_id = p.id
+FROM skill_seed seed JOIN skills p ON p.name = seed.parent
+WHERE s.name = seed.name;
+INSERT INTO skill_aliases (alias, skill_id)
+SELECT DISTINCT ON (alias) alias, s.id
+FROM skill_seed seed JOIN skills s ON s.name = seed.name
+CROSS JOIN LATERAL unnest(array_append(seed.aliases, skill_key(seed.name))) AS a (alias)
+ORDER BY alias
+ON CONFLICT (alias) DO NOTHING;
+
+-- ==============================================================================
+-- 案件・技術者のスキルID
+-- ==============================================================================
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS skill_ids INTEGER[];
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS skill_ids INTEGER[];
+
+CREATE OR REPLACE FUNCTION refresh_item_skill_ids() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.skill_ids := resolve_skill_ids(NEW.keywords);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_skill_ids ON jobs;
+CREATE TRIGGER trg_jobs_skill_ids
+    BEFORE INSERT OR UPDATE OF keywords ON jobs
+    FOR EACH ROW EXECUTE FUNCTION refresh_item_skill_ids();
+
+DROP TRIGGER IF EXISTS trg_engineers_skill_ids ON engineers;
+CREATE TRIGGER trg_engineers_skill_ids
+    BEFORE INSERT OR UPDATE OF keywords ON engineers
+    FOR EACH ROW EXECUTE FUNCTION refresh_item_skill_ids();
+
+-- 既存の行の skill_ids を作り直す（別名・親スキルを直したあとにも使う）。更新した行数を返す
+CREATE OR REPLACE FUNCTION skill_reindex() RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    job_rows BIGINT;
+    engineer_rows BIGINT;
+BEGIN
+    UPDATE jobs SET skill_ids = resolve_skill_ids(keywords) WHERE skill_ids IS DISTINCT FROM resolve_skill_ids(keywords);
+    GET DIAGNOSTICS job_rows = ROW_COUNT;
+    UPDATE engineers SET skill_ids = resolve_skill_ids(keywords) WHERE skill_ids IS DISTINCT FROM resolve_skill_ids(keywords);
+    GET DIAGNOSTICS engineer_rows = ROW_COUNT;
+    RETURN job_rows + engineer_rows;
+END;
+$$;
+
+SELECT skill_reindex();
+
+CREATE INDEX IF NOT EXISTS idx_jobs_skill_ids ON jobs USING GIN (skill_ids);
+CREATE INDEX IF NOT EXISTS idx_engineers_skill_ids ON engineers USING GIN (skill_ids);
+
+ANALYZE skills;
+ANALYZE jobs;
+ANALYZE engineers;
@@ -0,0 +1,50 @@
+-- ==============================================================================
+-- 009_matching_queue.sql
+-- ==============================================================================
+-- 再マッチングなどの重い処理を、Streamlit の画面から切り離して実行するためのキュー。
+-- 画面は jobs_queue に登録（matching_queue.enqueue）して進捗を読むだけにし、
+-- run_matching_worker.py が SELECT ... FOR UPDATE SKIP LOCKED で1件ずつ取り出して実行する。
+-- ワーカーは何プロセス・何台で動かしてもよい（同じタスクを2つのワーカーが取ることはない）。
+--   status          queued（待ち）/ running（実行中）/ succeeded / failed / cancelled
+--   priority        大きいほど先に実行する（画面からの依頼は 10、バッチからは 0）
+--   run_after       この時刻以降に実行する（再試行の待ち時間に使う）
+--   dedup_key       同じキーの待ち・実行中のタスクは1つだけにする（同じ案件の再マッチングを重ねない）
+--   heartbeat_at    実行中のワーカーが進捗を書くたびに更新する。古いままのタスクは別のワーカーが引き取る
+-- 進捗のメッセージは jobs_queue_progress に1行ずつ追記する。
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS jobs_queue (
+    id BIGSERIAL PRIMARY KEY,
+    task_type TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    priority SMALLINT NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+    dedup_key TEXT,
+    requested_by TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+    cancel_requested BOOLEAN NOT NULL DEFAULT false,
+    worker_id TEXT,
+    heartbeat_at TIMESTAMPTZ,
+    result_message TEXT,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+-- 次に実行するタスクの取り出し（matching_queue.claim の ORDER BY と同じ並び）
+CREATE INDEX IF NOT EXISTS idx_jobs_queue_ready ON jobs_queue (priority DESC, run_after, id) WHERE status = 'queued';
+-- 止まったワーカーのタスクの検出
+CREATE INDEX IF NOT EXISTS idx_jobs_queue_running ON jobs_queue (heartbeat_at) WHERE status = 'running';
+CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_queue_active_dedup ON jobs_queue (dedup_key) WHERE status IN ('queued', 'running');
+
+CREATE TABLE IF NOT EXISTS jobs_queue_progress (
+    id BIGSERIAL PRIMARY KEY,
+    queue_id BIGINT NOT NULL REFERENCES jobs_queue(id) ON DELETE CASCADE,
+    attempt INTEGER NOT NULL DEFAULT 1,
+    message TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue_progress_queue ON jobs_queue_progress (queue_id, id);
@@ -0,0 +1,59 @@
+-- ==============================================================================
+-- 010_change_notifications.sql
+-- ==============================================================================
+-- 案件・技術者・マッチング結果・キューの変更を pg_notify で知らせるトリガー。
+-- run_matching_worker.py はこれらのチャンネルを LISTEN し、cron の実行や一定間隔のポーリングを待たずに
+-- 数秒以内に反応する（新着の自動マッチング・KPI集計の反映をキューに登録し、登録されたタスクをすぐ取り出す）。
+--   item_changes   jobs / engineers の登録、マッチングに関係する列（keywords, document, is_hidden）の更新
+--                  payload: {"table": "jobs", "op": "INSERT", "id": 123}
+--                  matching_results の登録・更新・削除（1文につき1回）
+--                  payload: {"table": "matching_results", "op": "INSERT"}
+--   jobs_queue     jobs_queue へのタスクの登録。payload はタスクの種類（task_type）
+-- 通知はトランザクションのコミット時に届き、同じトランザクション内の同じ payload は1つにまとめられる。
+-- LISTEN している接続が無ければ通知は捨てられるだけなので、ワーカーを動かしていない環境にも適用してよい。
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION notify_item_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('item_changes', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', NEW.id)::text);
+    RETURN NULL;
+END;
+$$;
+
+-- マッチング結果は再マッチングで数十行まとめて書かれるため、行ごとではなく文ごとに1回だけ通知する
+CREATE OR REPLACE FUNCTION notify_statement_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('item_changes', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP)::text);
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION notify_queue_insert() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('jobs_queue', NEW.task_type);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_notify ON jobs;
+CREATE TRIGGER trg_jobs_notify
+    AFTER INSERT OR UPDATE OF keywords, document, is_hidden ON jobs
+    FOR EACH ROW EXECUTE FUNCTION notify_item_change();
+
+DROP TRIGGER IF EXISTS trg_engineers_notify ON engineers;
+CREATE TRIGGER trg_engineers_notify
+    AFTER INSERT OR UPDATE OF keywords, document, is_hidden ON engineers
+    FOR EACH ROW EXECUTE FUNCTION notify_item_change();
+
+DROP TRIGGER IF EXISTS trg_matching_results_notify ON matching_results;
+CREATE TRIGGER trg_matching_results_notify
+    AFTER INSERT OR UPDATE OR DELETE ON matching_results
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_statement_change();
+
+DROP TRIGGER IF EXISTS trg_jobs_queue_notify ON jobs_queue;
+CREATE TRIGGER trg_jobs_queue_notify
+    AFTER INSERT ON jobs_queue
+    FOR EACH ROW EXECUTE FUNCTION notify_queue_insert();
@@ -0,0 +1,59 @@
+-- ==============================================================================
+-- 011_match_evaluations.sql
+-- ==============================================================================
+-- 差分の再マッチングのための、内容の版とAI評価の記録。
+--   jobs.content_version / engineers.content_version
+--       document または keywords が実際に変わるたびに 1 ずつ増える版（トリガーで更新する）
+--   match_evaluations
+--       LLM による（案件, 技術者）の評価を、評価したときの両方の版と一緒に記録する。目標ランクに届かなかった評価も残す。
+-- 再マッチング（backend._diff_rematch）は、両方の版が記録と同じ組は LLM を呼ばずに前回の評価を使い、
+-- 新しい組・どちらかの内容が変わった組だけを評価し直す。
+-- 既存のマッチング結果は、今の内容に対する評価として（版 1 で）記録に移す。
+-- ==============================================================================
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 1;
+
+CREATE OR REPLACE FUNCTION bump_content_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.document IS DISTINCT FROM OLD.document OR NEW.keywords IS DISTINCT FROM OLD.keywords THEN
+        NEW.content_version := OLD.content_version + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_jobs_content_version ON jobs;
+CREATE TRIGGER trg_jobs_content_version
+    BEFORE UPDATE OF document, keywords ON jobs
+    FOR EACH ROW EXECUTE FUNCTION bump_content_version();
+
+DROP TRIGGER IF EXISTS trg_engineers_content_version ON engineers;
+CREATE TRIGGER trg_engineers_content_version
+    BEFORE UPDATE OF document, keywords ON engineers
+    FOR EACH ROW EXECUTE FUNCTION bump_content_version();
+
+CREATE TABLE IF NOT EXISTS match_evaluations (
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    engineer_id INTEGER NOT NULL REFERENCES engineers (id) ON DELETE CASCADE,
+    job_content_version INTEGER NOT NULL,
+    engineer_content_version INTEGER NOT NULL,
+    grade TEXT,
+    positive_points TEXT,
+    concern_points TEXT,
+    evaluated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (job_id, engineer_id)
+);
+-- 技術者側からの再マッチングで、その技術者の評価をまとめて読む（案件側は主キーの先頭列で引ける）
+CREATE INDEX IF NOT EXISTS idx_match_evaluations_engineer ON match_evaluations (engineer_id);
+
+INSERT INTO match_evaluations (job_id, engineer_id, job_content_version, engineer_content_version, grade, positive_points, concern_points)
+SELECT m.job_id, m.engineer_id, j.content_version, e.content_version, m.grade, m.positive_points, m.concern_points
+FROM matching_results m
+JOIN jobs j ON j.id = m.job_id
+JOIN engineers e ON e.id = m.engineer_id
+WHERE m.grade IS NOT NULL
+ON CONFLICT (job_id, engineer_id) DO NOTHING;
+
+ANALYZE match_evaluations;
@@ -0,0 +1,13 @@
+-- ==============================================================================
+-- 012_match_retirement.sql
+-- ==============================================================================
+-- 差分の再マッチング（backend._diff_rematch）が自動で非表示にしたマッチング結果の印。
+--   matching_results.retired_at
+--       相手が非表示になった・評価し直して目標ランクに届かなくなった、という理由で再マッチングが非表示にした日時。
+--       利用者が手動で非表示にした結果は NULL のまま（hide_match は retired_at を消す）。
+-- 非表示の扱い（一覧・KPI）は従来どおり is_hidden で行い、retired_at は「再び目標ランクに届いたら表示に戻してよい」
+-- ことだけを表す。再マッチングは retired_at のある結果だけを表示に戻し、手動で非表示にした結果には触れない。
+-- このマイグレーションより前に再マッチングが非表示にした結果は、手動の非表示と区別できないため NULL のままにする。
+-- ==============================================================================
+
+ALTER TABLE matching_results ADD COLUMN IF NOT EXISTS retired_at TIMESTAMPTZ;
@@ -0,0 +1,77 @@
+-- ==============================================================================
+-- 013_kpi_null_hidden.sql
+-- ==============================================================================
+-- is_hidden が NULL の行を、画面と同じく表示中として KPI に数える。
+-- 004 のトリガーと kpi_rebuild() は is_hidden = 0 で判定していたため NULL の行を数えず、集計が実際の件数からずれていた。
+-- 004 を適用済みのデータベース向けに、COALESCE(is_hidden, 0) = 0 で判定する版に置き換えてから集計を作り直す。
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION kpi_log_item_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(OLD.is_hidden, 0) = 0 AND OLD.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(OLD.created_at), TG_ARGV[0], -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(NEW.is_hidden, 0) = 0 AND NEW.created_at IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(NEW.created_at), TG_ARGV[0], 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kpi_log_match_row(r matching_results, delta INTEGER) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF COALESCE(r.is_hidden, 0) = 0 THEN
+        IF r.created_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(r.created_at), 'matches', delta);
+        END IF;
+        INSERT INTO kpi_deltas (kind, key, item_id, delta) VALUES ('item', 'job', r.job_id, delta), ('item', 'engineer', r.engineer_id, delta);
+    END IF;
+    IF r.status IS NOT NULL THEN
+        INSERT INTO kpi_deltas (kind, key, delta) VALUES ('status', r.status, delta);
+    END IF;
+    IF r.status = '採用' THEN
+        IF r.status_updated_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, key, delta) VALUES ('daily', kpi_jst_date(r.status_updated_at), 'adopted', delta);
+        END IF;
+        IF r.created_at IS NOT NULL THEN
+            INSERT INTO kpi_deltas (kind, day, item_id, delta) VALUES ('adoption', date_trunc('month', kpi_jst_date(r.created_at))::date, r.job_id, delta);
+        END IF;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kpi_rebuild() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('kpi_fold'));
+    LOCK TABLE jobs, engineers, matching_results, ai_activity_log IN SHARE MODE;
+    TRUNCATE kpi_deltas, kpi_daily_counts, kpi_status_counts, item_match_counts, kpi_monthly_adoptions;
+
+    INSERT INTO kpi_daily_counts (day, metric, count)
+    SELECT kpi_jst_date(created_at), 'jobs', COUNT(*) FROM jobs WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'engineers', COUNT(*) FROM engineers WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'matches', COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND created_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(status_updated_at), 'adopted', COUNT(*) FROM matching_results WHERE status = '採用' AND status_updated_at IS NOT NULL GROUP BY 1
+    UNION ALL
+    SELECT kpi_jst_date(created_at), 'ai:' || activity_type, COUNT(*) FROM ai_activity_log WHERE created_at IS NOT NULL GROUP BY 1, 2;
+
+    INSERT INTO kpi_status_counts (status, count)
+    SELECT status, COUNT(*) FROM matching_results WHERE status IS NOT NULL GROUP BY status;
+
+    INSERT INTO item_match_counts (item_type, item_id, match_count)
+    SELECT 'job', job_id, COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND job_id IS NOT NULL GROUP BY job_id
+    UNION ALL
+    SELECT 'engineer', engineer_id, COUNT(*) FROM matching_results WHERE COALESCE(is_hidden, 0) = 0 AND engineer_id IS NOT NULL GROUP BY engineer_id;
+
+    INSERT INTO kpi_monthly_adoptions (month, job_id, count)
+    SELECT date_trunc('month', kpi_jst_date(created_at))::date, job_id, COUNT(*) FROM matching_results
+    WHERE status = '採用' AND created_at IS NOT NULL AND job_id IS NOT NULL GROUP BY 1, 2;
+END;
+$$;
+
+SELECT kpi_rebuild();
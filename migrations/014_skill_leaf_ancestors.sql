@@ -0,0 +1,98 @@
+-- ==============================================================================
+-- 014_skill_leaf_ancestors.sql
+-- ==============================================================================
+-- 案件・技術者のスキルIDを、キーワードそのもののスキルと親・祖先のスキルに分けて持つ。
+--   jobs.skill_ids / engineers.skill_ids
+--                      keywords を辞書で引いたスキルID（親スキルは含めない。昇順・重複なし）
+--   jobs.skill_ancestor_ids / engineers.skill_ancestor_ids
+--                      skill_ids の各スキルの親・祖先のID（昇順・重複なし）
+-- 008 では skill_ids に親スキルも入れて共通するIDをすべて数えていたため、
+-- 「Spring Boot」1つの一致が Spring Boot・Spring・Java の3つとして数えられ、
+-- React だけの案件と Vue.js だけの技術者も、共通の親の JavaScript で重なってしまっていた。
+-- 重なりは、一方のスキルが他方のスキルそのもの、またはその親・祖先である組だけを数え、
+-- 一致したスキル（より一般的な方）を1回ずつ数える（skill_taxonomy.overlap_matrix）。
+-- 共通の親・祖先だけの一致は数えない（従来の calculate_keyword_score の部分一致と同じ考え方）。
+-- 別名・親スキルを直したら、SELECT skill_reindex(); で既存の行を作り直す。
+-- ==============================================================================
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS skill_ancestor_ids INTEGER[];
+ALTER TABLE engineers ADD COLUMN IF NOT EXISTS skill_ancestor_ids INTEGER[];
+
+-- キーワードの配列をスキルIDの配列（昇順・重複なし）にする。辞書に無いキーワードはスキルとして登録する
+CREATE OR REPLACE FUNCTION resolve_skill_ids(keywords TEXT[]) RETURNS INTEGER[]
+LANGUAGE plpgsql AS $$
+DECLARE
+    keyword TEXT;
+    alias_key TEXT;
+    skill INTEGER;
+    result INTEGER[] := '{}';
+BEGIN
+    IF keywords IS NULL THEN RETURN NULL; END IF;
+    FOREACH keyword IN ARRAY keywords LOOP
+        alias_key := skill_key(keyword);
+        CONTINUE WHEN alias_key = '';
+        SELECT skill_id INTO skill FROM skill_aliases WHERE alias = alias_key;
+        IF skill IS NULL THEN
+            INSERT INTO skills (name) VALUES (btrim(keyword))
+                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id INTO skill;
+            -- 別のトランザクションが同じ表記を先に登録していた場合は、そちらのスキルを使う
+            INSERT INTO skill_aliases (alias, skill_id) VALUES (alias_key, skill) ON CONFLICT (alias) DO NOTHING;
+            SELECT skill_id INTO skill FROM skill_aliases WHERE alias = alias_key;
+        END IF;
+        result := result || skill;
+    END LOOP;
+    RETURN ARRAY(SELECT DISTINCT unnest(result) ORDER BY 1);
+END;
+$$;
+
+-- スキルIDの配列の、各スキルの親・祖先のID（スキル自身は含めない。昇順・重複なし）
+CREATE OR REPLACE FUNCTION resolve_skill_ancestor_ids(skill_ids INTEGER[]) RETURNS INTEGER[]
+LANGUAGE sql STABLE AS $$
+    SELECT CASE WHEN skill_ids IS NULL THEN NULL ELSE ARRAY(
+        SELECT DISTINCT a.id
+        FROM unnest(skill_ids) AS s (id)
+        CROSS JOIN LATERAL unnest(skill_with_ancestors(s.id)) AS a (id)
+        WHERE a.id <> s.id
+        ORDER BY 1
+    ) END
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_item_skill_ids() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.skill_ids := resolve_skill_ids(NEW.keywords);
+    NEW.skill_ancestor_ids := resolve_skill_ancestor_ids(NEW.skill_ids);
+    RETURN NEW;
+END;
+$$;
+
+-- 既存の行の skill_ids / skill_ancestor_ids を作り直す（別名・親スキルを直したあとにも使う）。更新した行数を返す
+CREATE OR REPLACE FUNCTION skill_reindex() RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    job_rows BIGINT;
+    engineer_rows BIGINT;
+BEGIN
+    UPDATE jobs t SET skill_ids = r.skill_ids, skill_ancestor_ids = resolve_skill_ancestor_ids(r.skill_ids)
+    FROM (SELECT id, resolve_skill_ids(keywords) AS skill_ids FROM jobs) r
+    WHERE t.id = r.id
+      AND (t.skill_ids IS DISTINCT FROM r.skill_ids OR t.skill_ancestor_ids IS DISTINCT FROM resolve_skill_ancestor_ids(r.skill_ids));
+    GET DIAGNOSTICS job_rows = ROW_COUNT;
+    UPDATE engineers t SET skill_ids = r.skill_ids, skill_ancestor_ids = resolve_skill_ancestor_ids(r.skill_ids)
+    FROM (SELECT id, resolve_skill_ids(keywords) AS skill_ids FROM engineers) r
+    WHERE t.id = r.id
+      AND (t.skill_ids IS DISTINCT FROM r.skill_ids OR t.skill_ancestor_ids IS DISTINCT FROM resolve_skill_ancestor_ids(r.skill_ids));
+    GET DIAGNOSTICS engineer_rows = ROW_COUNT;
+    RETURN job_rows + engineer_rows;
+END;
+$$;
+
+SELECT skill_reindex();
+
+-- 候補の検索（backend._stream_skill_candidates）は skill_ids と skill_ancestor_ids の両方を && で引く
+CREATE INDEX IF NOT EXISTS idx_jobs_skill_ancestor_ids ON jobs USING GIN (skill_ancestor_ids);
+CREATE INDEX IF NOT EXISTS idx_engineers_skill_ancestor_ids ON engineers USING GIN (skill_ancestor_ids);
+
+ANALYZE jobs;
+ANALYZE engineers;
@@ -64,7 +64,7 @@ with st.expander("絞り込み・並び替え", expanded=True):
         # --- ソートと非表示設定 ---
         col3, col4, col5 = st.columns(3)
         with col3:
-            sort_options = ["登録日", "プロジェクト名", "担当者名"]
+            sort_options = ["登録日", "関連度", "プロジェクト名", "担当者名"]
             sort_column = st.selectbox("並び替え", sort_options, index=sort_options.index(params["sort_column"]))
         with col4:
             order_options = ["降順", "昇順"]
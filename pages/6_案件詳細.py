@@ -244,6 +244,7 @@ if job_data:
     RUN_KEY = f"run_rematch_job_{selected_id}"
     RANK_KEY = f"rematch_rank_job_{selected_id}"
     COUNT_KEY = f"rematch_count_job_{selected_id}"
+    REEVALUATE_KEY = f"rematch_reevaluate_job_{selected_id}"
 
     if CONFIRM_KEY not in st.session_state:
         st.session_state[CONFIRM_KEY] = False
@@ -266,6 +267,10 @@ if job_data:
                 "最大ヒット件数(1-10件)", 1, 10, 5, key=COUNT_KEY,
                 help="指定ランク以上のマッチングがこの件数に達すると処理を終了します。"
             )
+        st.checkbox(
+            "変更のない候補もAIで評価し直す", value=False, key=REEVALUATE_KEY,
+            help="オフの場合、前回の評価から内容が変わっていない候補は前回の評価を使い、新しい候補・内容が変わった候補だけをAIで評価します。"
+        )
 
         if st.button("🔄 AIマッチングを実行する", type="primary", use_container_width=True):
             st.session_state[CONFIRM_KEY] = True
@@ -274,14 +279,15 @@ if job_data:
     # --- 確認UIと実行トリガー ---
     if st.session_state.get(CONFIRM_KEY):
         with st.container(border=True):
-            st.warning(f"**本当にAIマッチングを実行しますか？**\n\nこの案件に関する既存のマッチング結果は**すべて削除**されます。")
+            st.warning(f"**本当にAIマッチングを実行しますか？**\n\nこの案件に関する既存のマッチング結果は削除されず、ステータスやメモもそのまま残ります。相手が非表示になった結果と、評価し直して目標ランクに届かなくなった結果は非表示になります。非表示になった結果も、再び目標ランクに届けば表示に戻ります（手動で非表示にした結果はそのままです）。")
             st.markdown(f"""
             **実行条件:**
             - **目標ランク:** `{st.session_state.get(RANK_KEY, 'A')}` ランク以上
             - **目標件数:** `{st.session_state.get(COUNT_KEY, 5)}` 件
+            - **AI評価:** `{'すべての候補' if st.session_state.get(REEVALUATE_KEY) else '新しい候補・内容が変わった候補のみ'}`
             """)
             
-            agree = st.checkbox("はい、既存のマッチング結果の削除を承認し、実行します。", key=f"agree_job_{selected_id}")
+            agree = st.checkbox("はい、上記の条件で実行します。", key=f"agree_job_{selected_id}")
             
             col_run, col_cancel = st.columns(2)
             with col_run:
@@ -294,39 +300,31 @@ if job_data:
                     st.session_state[CONFIRM_KEY] = False
                     st.rerun()
 
-    # --- 実行ロジック (st.status) ---
+    # --- 実行ロジック（キューに登録し、run_matching_worker.py が実行する） ---
+    TASK_KEY = f"rematch_task_job_{selected_id}"
     if st.session_state.get(RUN_KEY):
         st.session_state[RUN_KEY] = False
-        
-        with st.status("AIマッチングを実行中...", expanded=True) as status:
-            try:
-                # ★★★ 案件用の専用関数を呼び出す ★★★
-                response_generator = be.rematch_job_with_keyword_filtering(
-                    job_id=selected_id,
-                    target_rank=st.session_state[RANK_KEY],
-                    target_count=st.session_state[COUNT_KEY]
-                )
-                
-                final_message = ""
-                for log_message in response_generator:
-                    status.markdown(log_message, unsafe_allow_html=True)
-                    if isinstance(log_message, str):
-                        final_message = log_message
-
-                # 完了判定
-                if any(icon in final_message for icon in ["✅", "🎉", "ℹ️"]):
-                    status.update(label="処理が正常に完了しました！", state="complete", expanded=False)
-                    st.success("AIマッチングが完了しました。ページが自動でリフレッシュされます。")
-                    st.balloons()
-                    time.sleep(2)
-                    st.rerun()
-                else:
-                    status.update(label="処理が完了しませんでした。", state="error", expanded=True)
-                    st.error("処理が完了しませんでした。上記のログを確認してください。")
-
-            except Exception as e:
-                st.error(f"UI処理中に予期せぬエラーが発生しました: {e}")
-                status.update(label="UIエラー", state="error", expanded=True)
+        try:
+            task_id, created = be.enqueue_rematch(
+                'job', selected_id,
+                target_rank=st.session_state[RANK_KEY],
+                target_count=st.session_state[COUNT_KEY],
+                requested_by=st.session_state.get("username"),
+                reevaluate_all=st.session_state.get(REEVALUATE_KEY, False)
+            )
+            st.session_state[TASK_KEY] = task_id
+            if not created:
+                st.info("この案件のAIマッチングは既に実行中です。その進捗を表示します。")
+        except Exception as e:
+            st.error(f"AIマッチングの登録中に予期せぬエラーが発生しました: {e}")
+
+    # 画面を開き直した場合も、待ち・実行中のタスクがあれば進捗の表示を再開する
+    if TASK_KEY not in st.session_state:
+        active_task = be.get_active_rematch_task('job', selected_id)
+        if active_task:
+            st.session_state[TASK_KEY] = active_task['id']
+    if st.session_state.get(TASK_KEY):
+        ui.render_matching_task(st.session_state[TASK_KEY], TASK_KEY)
 
     st.divider()
 
@@ -0,0 +1,107 @@
+# ==============================================================================
+# reply_segmenter.py
+# ==============================================================================
+# 返信メールの本文を「最新の返信」と「引用された過去のメール」に分割し、セグメントごとにハッシュを付ける。
+# 取り込み済みのセグメント（過去に処理したメールの引用部分や、同じ添付ファイル）をLLMに送らないために使う。
+# DBへの読み書きは呼び出し側（run_email_processor）が行い、ここでは分割とハッシュ計算だけを扱う。
+# ==============================================================================
+
+import hashlib
+import re
+
+from ingest_dedup import normalize_text
+
+
+DEFAULT_SEGMENT_SETTINGS = {
+    "enabled": True,
+    "min_segment_chars": 40,   # 正規化後これより短いセグメントはハッシュを付けず、常に新規として扱う
+    "min_new_chars": 40,       # 引用を除いた新規テキストがこれより短ければ、LLMを呼ばずに既存の登録に紐付ける
+}
+
+def load_segment_settings(config: dict) -> dict:
+    settings = dict(DEFAULT_SEGMENT_SETTINGS)
+    settings.update((config or {}).get("reply_segmentation", {}))
+    return settings
+
+
+# --- 引用の境界の検出 ---
+_QUOTE_PREFIX = re.compile(r'^[ \t]*[>＞] ?')
+_SEPARATOR_LINE = re.compile(r'^[ \t]*-{2,}[ \t]*(Original Message|Forwarded message|Forwarded Message|元のメッセージ|転送されたメッセージ)[ \t]*-{2,}', re.IGNORECASE)
+_ATTRIBUTION_LINE = re.compile(
+    r'^[ \t]*(On .{4,200} wrote:|.{0,200}さんは書きました[:：]'
+    r'|\d{4}[年/]\d{1,2}[月/]\d{1,2}日?.{0,120}<[^>]+@[^>]+>[ \t]*[:：]?[ \t]*)$'
+)
+_HEADER_FIELD = re.compile(r'^[ \t]*(From|Sent|Date|To|Cc|Subject|差出人|送信者|送信日時|日時|日付|宛先|件名|CC)[ \t]*[:：]', re.IGNORECASE)
+_HEADER_START = re.compile(r'^[ \t]*(From|差出人|送信者)[ \t]*[:：]', re.IGNORECASE)
+
+
+def _header_block_end(lines: list, start: int) -> int:
+    """start 行から続くメールヘッダー（差出人: / 送信日時: など）の直後の行番号を返す。"""
+    i = start
+    while i < len(lines) and _HEADER_FIELD.match(lines[i]): i += 1
+    return i
+
+def _is_forwarded_header(lines: list, i: int) -> bool:
+    # Outlook 形式の引用は「差出人:」の次の数行に「送信日時:」「件名:」などが続く
+    if not _HEADER_START.match(lines[i]): return False
+    return _header_block_end(lines, i) - i >= 2
+
+
+def _split_lines(lines: list, segments: list):
+    current = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if _QUOTE_PREFIX.match(line):
+            # 連続した「>」行を1つの引用ブロックとし、1段階だけ外して再帰的に分割する（多重引用に対応）
+            block = []
+            while i < len(lines) and (_QUOTE_PREFIX.match(lines[i]) or (not lines[i].strip() and i + 1 < len(lines) and _QUOTE_PREFIX.match(lines[i + 1]))):
+                block.append(_QUOTE_PREFIX.sub('', lines[i], count=1))
+                i += 1
+            segments.append("\n".join(current))
+            current = []
+            _split_lines(block, segments)
+            continue
+        if _SEPARATOR_LINE.match(line) or _ATTRIBUTION_LINE.match(line) or _is_forwarded_header(lines, i):
+            # 境界の行と、続くヘッダー行は日時や宛名がメールごとに変わるため、セグメントに含めない
+            segments.append("\n".join(current))
+            _split_lines(lines[_header_block_end(lines, i + 1 if not _HEADER_START.match(line) else i):], segments)
+            return
+        current.append(line)
+        i += 1
+    segments.append("\n".join(current))
+
+
+def split_reply_segments(body: str) -> list:
+    """本文を [最新の返信, 引用1, 引用2, ...] に分割する。空のセグメントは除く。"""
+    segments = []
+    _split_lines((body or "").splitlines(), segments)
+    return [s.strip() for s in segments if s.strip()]
+
+
+def segment_hash(text: str, settings: dict | None = None) -> str | None:
+    """正規化したテキストの sha256。短すぎるセグメントは None（照合の対象にしない）。"""
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    normalized = normalize_text(text)
+    if len(normalized) < settings["min_segment_chars"]: return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def build_segments(source_data: dict, settings: dict | None = None) -> list:
+    """本文の各セグメントと、各添付ファイルを1セグメントとして、ハッシュ付きのリストを返す。"""
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    segments = [{"filename": None, "text": text, "hash": segment_hash(text, settings)} for text in split_reply_segments(source_data.get('body', ''))]
+    for att in source_data.get('attachments', []):
+        if att.get('content'):
+            segments.append({"filename": att['filename'], "text": att['content'], "hash": segment_hash(att['content'], settings)})
+    return segments
+
+
+def assemble_llm_text(segments: list, seen_hashes) -> str:
+    """取り込み済みのセグメントを除いて、LLMに渡すテキストを組み立てる（build_llm_input_text と同じ書式）。"""
+    body_parts, attachment_parts = [], []
+    for segment in segments:
+        if segment["hash"] and segment["hash"] in seen_hashes: continue
+        if segment["filename"] is None: body_parts.append(segment["text"])
+        else: attachment_parts.append(f"\n\n--- 添付ファイル: {segment['filename']} ---\n{segment['text']}")
+    return "\n\n".join(body_parts) + "".join(attachment_parts)
@@ -0,0 +1,98 @@
+# ==============================================================================
+# run_attribute_backfill.py
+# ==============================================================================
+# jobs / engineers の単価・勤務地・開始時期の列（migrations/006_item_attributes.sql）を、
+# document のメタ情報から取り出して埋める（item_attributes.extract_attributes）。
+# 対象は未解析（attributes_version が NULL）の行と、古い版の規則で解析した行。
+# 登録時に値を保存するようになる前の行と、document だけが書き換えられた行（トリガーで NULL に戻る）がこれに当たる。
+# ID 順に batch_size 行ずつ処理し、バッチごとにコミットするため、途中で止めても続きから再開できる。
+#
+# 使い方:
+#   python run_attribute_backfill.py                 # 未解析・古い版の行だけを解析する
+#   python run_attribute_backfill.py --all           # すべての行を解析し直す
+#   python run_attribute_backfill.py --batch-size 200
+# ==============================================================================
+
+import argparse
+import sys
+import time
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import DictCursor, execute_values
+
+import item_attributes
+import run_migrations
+
+TABLES = (('job', 'jobs'), ('engineer', 'engineers'))
+
+
+def backfill_table(conn, item_type: str, table_name: str, batch_size: int, reparse_all: bool) -> dict:
+    """1テーブル分を埋め、{処理行数, 単価あり, 勤務地あり, 開始時期あり} を返す。"""
+    columns = item_attributes.ATTRIBUTE_COLUMNS
+    stats = {"rows": 0, "price": 0, "location": 0, "available": 0}
+    stale_clause = "" if reparse_all else "AND (attributes_version IS NULL OR attributes_version < %(version)s)"
+    last_id = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT id, document, created_at, md5(document) AS document_md5 FROM {table_name}
+                WHERE id > %(last_id)s {stale_clause}
+                ORDER BY id LIMIT %(limit)s
+            """, {"last_id": last_id, "version": item_attributes.ATTRIBUTES_VERSION, "limit": batch_size})
+            rows = cursor.fetchall()
+            if not rows: break
+
+            values = []
+            for row in rows:
+                attributes = item_attributes.extract_attributes(item_type, row['document'], row['created_at'])
+                values.append((row['id'], row['document_md5']) + tuple(attributes[column] for column in columns))
+                stats["price"] += attributes['price_min'] is not None
+                stats["location"] += attributes['work_style'] is not None or attributes['prefecture'] is not None
+                stats["available"] += attributes['available_from'] is not None
+
+            # 解析している間に document が書き換えられた行は更新しない（次回の実行で解析し直す）
+            execute_values(cursor, f"""
+                UPDATE {table_name} AS t SET {', '.join(f'{column} = v.{column}' for column in columns)}
+                FROM (VALUES %s) AS v (id, document_md5, {', '.join(columns)})
+                WHERE t.id = v.id AND md5(t.document) = v.document_md5
+            """, values, template="(%s, %s, %s::real, %s::real, %s::text, %s::text, %s::date, %s::smallint)")
+        conn.commit()
+        stats["rows"] += len(rows)
+        last_id = rows[-1]['id']
+        print(f"  > {table_name}: ID {last_id} まで処理しました（累計 {stats['rows']}行）")
+    return stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="案件・技術者の単価・勤務地・開始時期の列を document から埋める")
+    parser.add_argument("--all", action="store_true", help="解析済みの行も含めて、すべて解析し直す")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回のコミットで更新する行数")
+    args = parser.parse_args()
+
+    print(f"--- [ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ] 属性列のバックフィルを開始します ---")
+    db_url = run_migrations.get_db_url_from_secrets()
+    if not db_url: return 1
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        pending = run_migrations.pending_migrations(conn)
+        if pending:
+            print(f"❌ データベースに未適用のマイグレーションがあります（{', '.join(m['filename'] for m in pending)}）。先に `python run_migrations.py` を実行してください。")
+            return 1
+        for item_type, table_name in TABLES:
+            started = time.perf_counter()
+            stats = backfill_table(conn, item_type, table_name, max(1, args.batch_size), args.all)
+            if not stats["rows"]:
+                print(f"ℹ️ {table_name}: 解析が必要な行はありません。")
+                continue
+            print(f"✅ {table_name}: {stats['rows']}行を解析しました（単価 {stats['price']} / 勤務地 {stats['location']} / 開始時期 {stats['available']}、{time.perf_counter() - started:.1f}秒）")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ バックフィル中にエラーが発生しました: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+# ==============================================================================
+# run_auto_matcher.py
+# ==============================================================================
+# 自動マッチング依頼（auto_matching_requests）を、有効な依頼すべてについて1回の実行でまとめて処理する。
+#   案件の依頼     その案件と、前回から新しく登録された技術者を照合する（last_processed_engineer_id より後）
+#   技術者の依頼   その技術者と、前回から新しく登録された案件を照合する（last_processed_job_id より後）
+# 依頼ごとに全件を検索し直すのではなく、
+#   1. 依頼の中で最も古い「最後に処理したID」より後に登録された案件・技術者を、1回だけ読む
+#   2. （新着 × 依頼）の候補の行列を、スキルの重なり（skill_taxonomy）と埋め込みベクトルの類似度で計算する
+#      単価・国籍の条件に合わない組と、依頼ごとの「最後に処理したID」以前の組は除外し、依頼ごとに上位だけを残す
+#   3. 複数の依頼で同じ（案件, 技術者）の組になったものは1回だけ、既に matching_results にある組と
+#      今の内容で評価済みの組（match_evaluations）は評価しない
+#   4. 残った組を、1回の実行あたりのAI評価の上限（max_evaluations_per_run）まで LLM で評価する
+#   5. 目標ランク以上の組の保存（create_or_update_match_record）と「最後に処理したID」の更新を、1つのトランザクションで行う
+# ので、1回の実行の重さは新着の件数で決まり、依頼の数 × 全件には比例しない。
+# 上限に達して評価できなかった組がある依頼は、その組の手前までしか「最後に処理したID」を進めない（次回の実行で続きを評価する）。
+#
+# run_cron_tasks.sh からメール処理のあとに実行する。backend.py を読み込むため、プロジェクトのルートで実行する。
+#
+# 使い方:
+#   python run_auto_matcher.py                       # 評価して保存し、依頼者にメールで通知する
+#   python run_auto_matcher.py --dry-run             # 候補の件数だけを表示する（AI評価・保存・通知をしない）
+#   python run_auto_matcher.py --max-evaluations 20  # 今回のAI評価の上限を変える
+# ==============================================================================
+
+import argparse
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import psycopg2
+import toml
+from psycopg2.extras import DictCursor
+
+import matching_queue
+import run_migrations
+import skill_taxonomy
+
+DEFAULT_AUTO_MATCHER_SETTINGS = {
+    "max_new_items_per_run": 2000,
+    "max_evaluations_per_run": 100,
+    "max_candidates_per_request": 10,
+    "min_skill_overlap": 2,
+    "min_similarity": 0.85,
+    "use_vectors": True,
+}
+
+RANK_ORDER = ['S', 'A', 'B', 'C', 'D']
+
+# 同時に2つ実行されないようにするための advisory lock のキー
+_LOCK_KEY = "run_auto_matcher"
+
+# ワーカーのタスクがロックを取れなかったとき、もう一度実行するまでの秒数
+LOCK_BUSY_DEFER_SECONDS = 60
+
+# 依頼の種類ごとの向き（依頼元のテーブルと、新着として読む相手のテーブル）
+DIRECTIONS = {
+    'job': {
+        "source_table": "jobs", "source_name": "project_name", "source_japanese": "requires_japanese_national",
+        "new_table": "engineers", "new_name": "name", "new_japanese": "is_japanese_national",
+        "watermark": "last_processed_engineer_id",
+    },
+    'engineer': {
+        "source_table": "engineers", "source_name": "name", "source_japanese": "is_japanese_national",
+        "new_table": "jobs", "new_name": "project_name", "new_japanese": "requires_japanese_national",
+        "watermark": "last_processed_job_id",
+    },
+}
+
+
+def log(message: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def load_auto_matcher_settings() -> dict:
+    settings = dict(DEFAULT_AUTO_MATCHER_SETTINGS)
+    try:
+        with open("config.toml", "r", encoding="utf-8") as f:
+            settings.update(toml.load(f).get("auto_matcher", {}))
+    except FileNotFoundError:
+        pass
+    return settings
+
+
+# ==============================================================================
+# 1. 依頼と新着の読み込み
+# ==============================================================================
+
+def load_requests(cursor, item_type: str) -> list:
+    """有効な依頼を、依頼元の案件・技術者の情報と一緒に読む（依頼元が非表示のものは除く）。"""
+    d = DIRECTIONS[item_type]
+    cursor.execute(f"""
+        SELECT r.id, r.item_id, r.target_rank, r.notification_email, r.{d['watermark']} AS watermark,
+               s.{d['source_name']} AS name, s.document, s.skill_ids, s.skill_ancestor_ids, s.price_min,
+               s.{d['source_japanese']} AS japanese
+        FROM auto_matching_requests r
+        JOIN {d['source_table']} s ON s.id = r.item_id
+        WHERE r.is_active AND r.item_type = %s AND s.is_hidden = 0
+        ORDER BY r.id
+    """, (item_type,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def load_new_items(cursor, item_type: str, after_id: int, upto_id: int, limit: int) -> tuple:
+    """
+    after_id より後、upto_id 以前に登録された相手側の行を、ID順に最大 limit 件読む。
+    (行のリスト, 今回読み終えたとみなせる最後のID) を返す。limit で打ち切った場合は、読んだ最後の行のIDまで。
+    """
+    d = DIRECTIONS[item_type]
+    cursor.execute(f"""
+        SELECT id, {d['new_name']} AS name, document, skill_ids, skill_ancestor_ids, price_min, {d['new_japanese']} AS japanese
+        FROM {d['new_table']}
+        WHERE id > %s AND id <= %s AND is_hidden = 0
+        ORDER BY id
+        LIMIT %s
+    """, (after_id, upto_id, limit))
+    items = [dict(row) for row in cursor.fetchall()]
+    return items, (items[-1]['id'] if len(items) >= limit else upto_id)
+
+
+# ==============================================================================
+# 2. 候補の行列
+# ==============================================================================
+
+def _document_body(document) -> str:
+    return str(document or "").split('\n---\n', 1)[-1]
+
+
+def embed_documents(model, documents: list, prefix: str) -> np.ndarray:
+    """backend.update_index / search と同じ前処理（本文だけ、e5 の接頭辞、正規化）で埋め込む。"""
+    return model.encode([prefix + _document_body(doc) for doc in documents], normalize_embeddings=True,
+                        show_progress_bar=False, batch_size=32)
+
+
+def _prices(rows) -> np.ndarray:
+    return np.array([row['price_min'] if row['price_min'] is not None else np.nan for row in rows], dtype=np.float64)
+
+
+def _flags(rows) -> np.ndarray:
+    return np.array([bool(row['japanese']) for row in rows], dtype=bool)
+
+
+def rank_candidates(item_type: str, requests: list, items: list, settings: dict, model=None) -> dict:
+    """
+    （依頼 × 新着）の候補の行列を計算し、依頼IDごとに [(新着の行, 共通スキル数, 類似度), ...] を優先度の高い順に返す。
+    候補にするのは、依頼の「最後に処理したID」より後に登録され、単価・国籍の条件に合い、
+    共通スキルが min_skill_overlap 以上か、類似度が min_similarity 以上の組。依頼ごとに max_candidates_per_request 件まで。
+    """
+    if not requests or not items: return {}
+    overlap = skill_taxonomy.overlap_matrix([r['skill_ids'] for r in requests], [i['skill_ids'] for i in items],
+                                            [r['skill_ancestor_ids'] for r in requests], [i['skill_ancestor_ids'] for i in items])
+
+    item_ids = np.array([i['id'] for i in items], dtype=np.int64)
+    watermarks = np.array([r['watermark'] for r in requests], dtype=np.int64)
+    eligible = item_ids[None, :] > watermarks[:, None]
+
+    # 行列の向きは常に（依頼 × 新着）。単価・国籍は案件側・技術者側に並べ替えて判定する
+    source_prices, item_prices = _prices(requests)[:, None], _prices(items)[None, :]
+    source_flags, item_flags = _flags(requests)[:, None], _flags(items)[None, :]
+    if item_type == 'job':
+        job_prices, engineer_prices, requires_japanese, is_japanese = source_prices, item_prices, source_flags, item_flags
+    else:
+        job_prices, engineer_prices, requires_japanese, is_japanese = item_prices, source_prices, item_flags, source_flags
+    # 技術者の希望単価が案件単価を5万円より上回る組は除外する（再マッチングの候補の条件と同じ）
+    with np.errstate(invalid='ignore'):
+        eligible &= np.isnan(job_prices) | np.isnan(engineer_prices) | (engineer_prices <= job_prices + 5)
+    eligible &= ~requires_japanese | is_japanese
+
+    if model is not None:
+        similarity = embed_documents(model, [r['document'] for r in requests], "query: ") @ \
+            embed_documents(model, [i['document'] for i in items], "passage: ").T
+        hit = (overlap >= int(settings["min_skill_overlap"])) | (similarity >= float(settings["min_similarity"]))
+    else:
+        similarity = np.zeros(overlap.shape, dtype=np.float32)
+        hit = overlap >= int(settings["min_skill_overlap"])
+
+    # 共通スキルの数を優先し、同じ数なら類似度の高い順
+    priority = np.where(eligible & hit, overlap + similarity, -np.inf)
+    limit = min(int(settings["max_candidates_per_request"]), len(items))
+    top = np.argsort(-priority, axis=1, kind='stable')[:, :limit]
+
+    ranked = {}
+    for row, request in enumerate(requests):
+        columns = [c for c in top[row] if np.isfinite(priority[row, c])]
+        if columns:
+            ranked[request['id']] = [(items[c], int(overlap[row, c]), float(similarity[row, c])) for c in columns]
+    return ranked
+
+
+def collect_pairs(item_type: str, requests: list, ranked: dict, pairs: dict):
+    """依頼ごとの候補を（案件ID, 技術者ID）の組にまとめる。複数の依頼から同じ組が出た場合は、1つの組に依頼を追加する。"""
+    requests_by_id = {r['id']: r for r in requests}
+    for request_id, candidates in ranked.items():
+        request = requests_by_id[request_id]
+        for item, overlap, similarity in candidates:
+            if item_type == 'job':
+                key, job, engineer = (request['item_id'], item['id']), request, item
+            else:
+                key, job, engineer = (item['id'], request['item_id']), item, request
+            pair = pairs.setdefault(key, {
+                "job_id": key[0], "engineer_id": key[1], "job_name": job['name'], "engineer_name": engineer['name'],
+                "job_document": job['document'], "engineer_document": engineer['document'],
+                "overlap": overlap, "similarity": similarity, "requests": [],
+            })
+            pair["requests"].append({"request": request, "item_type": item_type, "new_item_id": item['id']})
+
+
+def drop_existing_pairs(cursor, pairs: dict) -> int:
+    """
+    既に matching_results にある組と、今の内容で評価済みの組（match_evaluations。目標ランクに届かなかった評価を含む）を
+    取り除き、取り除いた数を返す。
+    """
+    if not pairs: return 0
+    job_ids, engineer_ids = zip(*pairs.keys())
+    cursor.execute("""
+        SELECT p.job_id, p.engineer_id FROM unnest(%s::int[], %s::int[]) AS p(job_id, engineer_id)
+        WHERE EXISTS (SELECT 1 FROM matching_results m WHERE m.job_id = p.job_id AND m.engineer_id = p.engineer_id)
+           OR EXISTS (SELECT 1 FROM match_evaluations ev
+                      JOIN jobs j ON j.id = ev.job_id AND j.content_version = ev.job_content_version
+                      JOIN engineers e ON e.id = ev.engineer_id AND e.content_version = ev.engineer_content_version
+                      WHERE ev.job_id = p.job_id AND ev.engineer_id = p.engineer_id)
+    """, (list(job_ids), list(engineer_ids)))
+    existing = [(row['job_id'], row['engineer_id']) for row in cursor.fetchall()]
+    for key in existing:
+        pairs.pop(key, None)
+    return len(existing)
+
+
+# ==============================================================================
+# 3. AI評価と保存
+# ==============================================================================
+
+def _valid_ranks(target_rank: str) -> list:
+    return RANK_ORDER[:RANK_ORDER.index(target_rank) + 1] if target_rank in RANK_ORDER else []
+
+
+def evaluate_pairs(be, pairs: list, budget: int) -> tuple:
+    """組を先頭から最大 budget 件 LLM で評価する。(評価した組のリスト, 評価できなかった組のリスト) を返す。"""
+    evaluated = []
+    for index, pair in enumerate(pairs[:budget], start=1):
+        pair["llm_result"] = be.get_match_summary_with_llm(pair["job_document"], pair["engineer_document"])
+        grade = (pair["llm_result"] or {}).get('summary', '失敗')
+        log(f"  ({index}/{min(budget, len(pairs))}) 案件『{pair['job_name']}』× 技術者『{pair['engineer_name']}』"
+            f"（共通スキル {pair['overlap']}件、類似度 {pair['similarity']:.2f}）: {grade}")
+        evaluated.append(pair)
+    return evaluated, pairs[budget:]
+
+
+def save_results(conn, be, evaluated: list, pending: list, watermark_targets: dict) -> dict:
+    """
+    目標ランク以上の組を保存し、依頼ごとの「最後に処理したID」を進める（コミットは呼び出し元）。
+    評価できなかった組が残っている依頼は、その組の新着のIDの手前までしか進めない。依頼IDごとのヒットのリストを返す。
+    """
+    hits = {}
+    with conn.cursor() as cursor:
+        for pair in evaluated:
+            cursor.execute("INSERT INTO ai_activity_log (activity_type) VALUES ('evaluation')")
+            grade = (pair["llm_result"] or {}).get('summary')
+            if grade:
+                be.record_match_evaluation(cursor, pair["job_id"], pair["engineer_id"], pair["llm_result"])
+            matched = [entry for entry in pair["requests"] if grade in _valid_ranks(entry["request"]['target_rank'])]
+            if not matched: continue
+            match_id = be.create_or_update_match_record(
+                pair["job_id"], pair["engineer_id"], round(pair["similarity"] * 100, 2), grade, pair["llm_result"], conn=conn)
+            if match_id is None: continue
+            for entry in matched:
+                hits.setdefault(entry["request"]['id'], []).append({**pair, "grade": grade, "match_id": match_id})
+
+    for pair in pending:
+        for entry in pair["requests"]:
+            target = watermark_targets[entry["request"]['id']]
+            target["upto"] = min(target["upto"], entry["new_item_id"] - 1)
+
+    for request_id, target in watermark_targets.items():
+        if target["upto"] > (target["watermark"] or 0):
+            if target["item_type"] == 'job':
+                be.update_auto_match_last_processed_ids(request_id, None, target["upto"], conn=conn)
+            else:
+                be.update_auto_match_last_processed_ids(request_id, target["upto"], None, conn=conn)
+    return hits
+
+
+def notify(be, requests_by_id: dict, hits: dict):
+    """ヒットがあった依頼の登録者に、今回見つかった組をメールで知らせる。"""
+    for request_id, request_hits in hits.items():
+        request = requests_by_id[request_id]
+        if not request['notification_email']: continue
+        lines = [f"自動マッチング依頼『{request['name']}』に、新しいマッチング候補が {len(request_hits)}件 見つかりました。", ""]
+        for hit in request_hits:
+            lines.append(f"- [{hit['grade']}] 案件『{hit['job_name']}』× 技術者『{hit['engineer_name']}』（マッチングID: {hit['match_id']}）")
+        be.send_email_notification(request['notification_email'], f"【自動マッチング】{request['name']} に {len(request_hits)}件の候補", "\n".join(lines))
+
+
+# ==============================================================================
+# 4. 実行
+# ==============================================================================
+
+def try_lock(conn) -> bool:
+    """他の自動マッチング（cron・ワーカー）が実行中でなければロックを取って True を返す。ロックは接続を閉じると外れる。"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", (_LOCK_KEY,))
+        locked = cursor.fetchone()['locked']
+    conn.commit()
+    return locked
+
+
+def run(conn, be, settings: dict, max_evaluations: int, dry_run: bool = False) -> str:
+    """1回分の自動マッチングを実行し、結果のメッセージを返す。"""
+    started = time.perf_counter()
+    model = None
+    if settings["use_vectors"]:
+        model = be.load_embedding_model()
+        if model is None: log("⚠️ 埋め込みモデルを読み込めなかったため、スキルの重なりだけで候補を選びます。")
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT (SELECT max(id) FROM jobs) AS job_max, (SELECT max(id) FROM engineers) AS engineer_max")
+        snapshot = cursor.fetchone()
+        pairs, requests_by_id, watermark_targets = {}, {}, {}
+
+        for item_type, d in DIRECTIONS.items():
+            requests = load_requests(cursor, item_type)
+            snapshot_id = snapshot['engineer_max' if item_type == 'job' else 'job_max'] or 0
+            # 「最後に処理したID」が未設定の依頼は、今回の時点から照合を始める
+            for r in requests:
+                if r['watermark'] is None: r['watermark'] = snapshot_id
+            if not requests: continue
+            after_id = min(r['watermark'] for r in requests)
+            items, upto_id = load_new_items(cursor, item_type, after_id, snapshot_id, int(settings["max_new_items_per_run"]))
+            ranked = rank_candidates(item_type, requests, items, settings, model)
+            collect_pairs(item_type, requests, ranked, pairs)
+            log(f"ℹ️ {item_type}の依頼 {len(requests)}件 × 新着の{d['new_table']} {len(items)}件（ID {after_id + 1}〜{upto_id}）"
+                f" → 候補 {sum(len(c) for c in ranked.values())}組")
+            for r in requests:
+                requests_by_id[r['id']] = r
+                watermark_targets[r['id']] = {"item_type": item_type, "watermark": r['watermark'], "upto": max(upto_id, r['watermark'])}
+
+        skipped = drop_existing_pairs(cursor, pairs)
+    conn.commit()
+
+    # 古い新着から順に評価する（上限で打ち切った場合も、「最後に処理したID」をできるだけ先へ進められる）
+    ordered = sorted(pairs.values(), key=lambda p: (min(e["new_item_id"] for e in p["requests"]), p["job_id"], p["engineer_id"]))
+    shared = sum(1 for p in ordered if len(p["requests"]) > 1)
+    log(f"ℹ️ 評価対象 {len(ordered)}組（複数の依頼で共通 {shared}組、評価済みのため除外 {skipped}組）、今回の評価の上限 {max_evaluations}件")
+    if dry_run:
+        return "ℹ️ --dry-run のため、AI評価・保存・通知は行いません。"
+
+    evaluated, pending = evaluate_pairs(be, ordered, max_evaluations)
+    with conn:
+        hits = save_results(conn, be, evaluated, pending, watermark_targets)
+    notify(be, requests_by_id, hits)
+    return (f"✅ {len(evaluated)}組を評価し、{sum(len(h) for h in hits.values())}件のヒットを保存しました"
+            f"（未評価 {len(pending)}組は次回に持ち越し、{time.perf_counter() - started:.1f}秒）。")
+
+
+def run_auto_match_task(db_url: str, be):
+    """
+    run_matching_worker.py のタスク（auto_match）としての入口。進捗のメッセージを yield し、実行結果を return する。
+    cron の実行などとロックが重なった場合は、失敗にはせず LOCK_BUSY_DEFER_SECONDS 秒後の待ちに戻す
+    （再試行の回数は使わない。実行中の方が読み始めたあとに登録された新着を、次の実行で拾う）。
+    """
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        if not try_lock(conn):
+            message = f"ℹ️ 別の自動マッチングが実行中のため、{LOCK_BUSY_DEFER_SECONDS}秒後にもう一度実行します。"
+            yield message
+            return matching_queue.TaskResult(False, message, defer_seconds=LOCK_BUSY_DEFER_SECONDS)
+        settings = load_auto_matcher_settings()
+        yield "▶️ 新着の案件・技術者について、自動マッチングを開始します..."
+        message = run(conn, be, settings, int(settings["max_evaluations_per_run"]))
+        yield message
+        return matching_queue.TaskResult(True, message)
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="自動マッチング依頼を、新着の案件・技術者についてまとめて処理する")
+    parser.add_argument("--max-evaluations", type=int, default=None, help="今回のAI評価の上限（既定: config.toml の max_evaluations_per_run）")
+    parser.add_argument("--dry-run", action="store_true", help="候補の件数だけを表示する")
+    args = parser.parse_args()
+    settings = load_auto_matcher_settings()
+    max_evaluations = args.max_evaluations if args.max_evaluations is not None else int(settings["max_evaluations_per_run"])
+
+    db_url = run_migrations.get_db_url_from_secrets()
+    if not db_url: return 1
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        pending = run_migrations.pending_migrations(conn)
+        if pending:
+            print(f"❌ データベースに未適用のマイグレーションがあります（{', '.join(m['filename'] for m in pending)}）。先に `python run_migrations.py` を実行してください。")
+            return 1
+        if not try_lock(conn):
+            log("ℹ️ 別の自動マッチングが実行中のため、今回は何もしません。")
+            return 0
+
+        import backend as be  # 埋め込みモデル・LLM の設定を読み込むため、起動確認が済んでから読み込む
+        log("--- 自動マッチングを開始します ---")
+        log(run(conn, be, settings, max_evaluations, dry_run=args.dry_run))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
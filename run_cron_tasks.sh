@@ -17,6 +17,9 @@ PYTHON_EXEC="/Users/tomokazuhatanaka/Documents/GitHub/universal-ai-matching-syst
 EMAIL_PROCESSOR_SCRIPT="run_email_processor.py"
 AUTO_MATCHER_SCRIPT="run_auto_matcher.py"
 CLEANUP_SCRIPT="run_cleanup.py" # ★★★ 追加 ★★★
+MIGRATIONS_SCRIPT="run_migrations.py"
+KPI_REFRESH_SCRIPT="run_kpi_refresh.py"
+ATTRIBUTE_BACKFILL_SCRIPT="run_attribute_backfill.py"
 
 
 # --- 処理開始のログ ---
@@ -24,6 +27,15 @@ echo "============================================================" >> "${LOG_FI
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Cron task script started." >> "${LOG_FILE}"
 
 
+# --- 0. スキーマのマイグレーション（未適用のものが無ければ何もしない） ---
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting ${MIGRATIONS_SCRIPT}..." >> "${LOG_FILE}"
+"${PYTHON_EXEC}" "${MIGRATIONS_SCRIPT}" >> "${LOG_FILE}" 2>&1
+if [ $? -ne 0 ]; then
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] ERROR: ${MIGRATIONS_SCRIPT} failed. See log for details. Aborting." >> "${LOG_FILE}"
+    exit 1
+fi
+
+
 # --- 1. メール処理スクリプトの実行 ---
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting ${EMAIL_PROCESSOR_SCRIPT}..." >> "${LOG_FILE}"
 
@@ -40,6 +52,30 @@ else
 fi
 
 
+# --- 2. 単価・勤務地・開始時期の列の補完（document だけが更新された行など。対象が無ければ何もしない） ---
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting ${ATTRIBUTE_BACKFILL_SCRIPT}..." >> "${LOG_FILE}"
+"${PYTHON_EXEC}" "${ATTRIBUTE_BACKFILL_SCRIPT}" >> "${LOG_FILE}" 2>&1
+if [ $? -ne 0 ]; then
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] WARNING: ${ATTRIBUTE_BACKFILL_SCRIPT} failed. See log for details." >> "${LOG_FILE}"
+fi
+
+
+# --- 3. 自動マッチング（新着の案件・技術者を、有効な依頼すべてとまとめて照合する） ---
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting ${AUTO_MATCHER_SCRIPT}..." >> "${LOG_FILE}"
+"${PYTHON_EXEC}" "${AUTO_MATCHER_SCRIPT}" >> "${LOG_FILE}" 2>&1
+if [ $? -ne 0 ]; then
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] WARNING: ${AUTO_MATCHER_SCRIPT} failed. See log for details." >> "${LOG_FILE}"
+fi
+
+
+# --- 4. ダッシュボードKPI集計の反映（失敗しても他の処理には影響しないため、中断しない） ---
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting ${KPI_REFRESH_SCRIPT}..." >> "${LOG_FILE}"
+"${PYTHON_EXEC}" "${KPI_REFRESH_SCRIPT}" >> "${LOG_FILE}" 2>&1
+if [ $? -ne 0 ]; then
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] WARNING: ${KPI_REFRESH_SCRIPT} failed. See log for details." >> "${LOG_FILE}"
+fi
+
+
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Cron task script finished." >> "${LOG_FILE}"
 echo "" >> "${LOG_FILE}" # ログの区切りとして空行を追加
 
@@ -0,0 +1,205 @@
+# ==============================================================================
+# run_email_daemon.py
+# ==============================================================================
+# IMAP IDLE で新着メールを待ち受け、run_email_processor の取り込みパイプラインへ流す常駐プロセス。
+# cron による定期実行（run_cron_tasks.sh の 1. メール処理）の代わりに起動しておくことで、
+# 1本の認証済み接続を保持したまま、新着メールを数秒以内に取り込む。
+#
+# 使い方:
+#   python run_email_daemon.py                 # secrets.toml の接続情報で常駐
+#   python run_email_daemon.py --once          # 1回だけ取り込んで終了
+#   python run_email_daemon.py --server 127.0.0.1 --port 3143 --no-ssl --user test --password test
+#                                              # ローカルのIMAPサーバー（GreenMail / Dovecot 等）で検証
+#
+# サーバーが IDLE に対応していない場合は NOOP による定期ポーリングに切り替える。
+# SIGTERM / SIGINT を受けると、処理中のバッチを完了させてから切断して終了する。
+# ==============================================================================
+
+import argparse
+import imaplib
+import re
+import select
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import run_email_processor as core
+
+# --- グローバル設定 ---
+_SHUTDOWN = threading.Event()
+_EXISTS_PATTERN = re.compile(rb'^\* \d+ (EXISTS|RECENT)')
+
+DEFAULT_DAEMON_SETTINGS = {
+    # IDLE を張り直す間隔（RFC 2177 により 29分未満にする）。タイムアウト時にも取りこぼし確認を行う
+    "idle_timeout_seconds": 600,
+    # IDLE 非対応サーバーでの NOOP ポーリング間隔
+    "poll_interval_seconds": 30,
+    # 新着通知を受けてから取り込みを始めるまでの待ち時間（連続した着信をまとめて処理する）
+    "settle_seconds": 2,
+    # 再接続時の待ち時間の上限（1秒から倍々に増やす）
+    "max_backoff_seconds": 300,
+    # 既読メールの削除処理を行う間隔（0で無効）
+    "sweep_interval_seconds": 600,
+}
+
+
+def log(message: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def _request_shutdown(signum, frame):
+    log(f"ℹ️ シグナル {signal.Signals(signum).name} を受信しました。処理中のバッチを完了してから終了します。")
+    _SHUTDOWN.set()
+
+
+def load_daemon_settings(config: dict) -> dict:
+    settings = dict(DEFAULT_DAEMON_SETTINGS)
+    settings.update((config or {}).get("email_daemon", {}))
+    return settings
+
+
+# ==============================================================================
+# IMAP IDLE
+# ==============================================================================
+
+def _socket_has_data(mail, timeout: float) -> bool:
+    sock = mail.sock
+    # SSLソケットは復号済みのデータを内部に保持していることがあるため、pending() も確認する
+    if getattr(sock, "pending", None) and sock.pending(): return True
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+
+def idle_wait(mail, timeout: float) -> bool:
+    """
+    IDLE コマンドで最大 timeout 秒待機する。新着（EXISTS / RECENT）の通知を受けたら True を返す。
+    タイムアウトまたは停止要求の場合は False。いずれの場合も DONE を送ってタグ付き応答まで読み終えてから返る。
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    response = mail.readline()
+    if not response.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"IDLE の開始に失敗しました: {response!r}")
+
+    got_new_mail = False
+    deadline = time.monotonic() + timeout
+    try:
+        while not _SHUTDOWN.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            # 停止要求に素早く反応できるよう、1秒単位で待つ
+            if not _socket_has_data(mail, min(remaining, 1.0)): continue
+            line = mail.readline()
+            if not line: raise imaplib.IMAP4.abort("IDLE 中にサーバーとの接続が切断されました。")
+            if _EXISTS_PATTERN.match(line):
+                got_new_mail = True
+                break
+    finally:
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line: raise imaplib.IMAP4.abort("IDLE 終了時にサーバーとの接続が切断されました。")
+            if line.startswith(tag): break
+    return got_new_mail
+
+
+# ==============================================================================
+# 常駐ループ
+# ==============================================================================
+
+def _run_cycle(mail, pipeline_settings: dict, state: dict, extractor, sweep_interval: float):
+    """新着メールの取り込みと、間隔を空けた既読メールの削除を1回分行う。"""
+    counters = core.process_mailbox(mail, pipeline_settings, extractor=extractor)
+    if counters["total"]:
+        log(f"✅ {counters['total']}件をチェックし、{counters['processed']}件を登録しました。")
+    if sweep_interval and time.monotonic() - state["last_sweep"] >= sweep_interval:
+        core.delete_seen_messages(mail)
+        state["last_sweep"] = time.monotonic()
+
+
+def serve(secrets: dict, pipeline_settings: dict, daemon_settings: dict, run_once: bool = False):
+    backoff = 1
+    state = {"last_sweep": 0.0}
+    extractor = core.create_attachment_extractor(pipeline_settings)
+    try:
+        while not _SHUTDOWN.is_set():
+            mail = None
+            try:
+                mail = core.connect_imap(secrets)
+                supports_idle = 'IDLE' in mail.capabilities
+                log(f"✅ メールサーバーに接続しました。（待ち受け方式: {'IDLE' if supports_idle else 'NOOP ポーリング'}）")
+
+                # 接続直後に、切断中に届いたメールを取り込む
+                _run_cycle(mail, pipeline_settings, state, extractor, daemon_settings["sweep_interval_seconds"])
+                backoff = 1
+                if run_once: return
+
+                while not _SHUTDOWN.is_set():
+                    if supports_idle:
+                        got_new_mail = idle_wait(mail, daemon_settings["idle_timeout_seconds"])
+                        if _SHUTDOWN.is_set(): break
+                        if got_new_mail:
+                            log("📨 新着メールの通知を受信しました。")
+                            _SHUTDOWN.wait(daemon_settings["settle_seconds"])
+                    else:
+                        if _SHUTDOWN.wait(daemon_settings["poll_interval_seconds"]): break
+                        mail.noop()
+                    # IDLE のタイムアウト時も取り込みを試み、通知の取りこぼしを拾う
+                    _run_cycle(mail, pipeline_settings, state, extractor, daemon_settings["sweep_interval_seconds"])
+
+            except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                if _SHUTDOWN.is_set(): break
+                log(f"⚠️ メールサーバーとの通信でエラーが発生しました: {e}。{backoff}秒後に再接続します。")
+                _SHUTDOWN.wait(backoff)
+                backoff = min(backoff * 2, daemon_settings["max_backoff_seconds"])
+            except Exception as e:
+                if _SHUTDOWN.is_set(): break
+                log(f"❌ 予期せぬエラーが発生しました: {e}。{backoff}秒後に再試行します。")
+                traceback.print_exc()
+                _SHUTDOWN.wait(backoff)
+                backoff = min(backoff * 2, daemon_settings["max_backoff_seconds"])
+            finally:
+                if mail is not None:
+                    try:
+                        if mail.state == 'SELECTED': mail.close()
+                        mail.logout()
+                    except Exception:
+                        pass
+    finally:
+        extractor.close()
+        log("ℹ️ メールサーバーから切断しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IMAP IDLE で新着メールを待ち受けて取り込む常駐プロセス")
+    parser.add_argument("--once", action="store_true", help="1回だけ取り込んで終了する")
+    parser.add_argument("--server", help="IMAPサーバー（secrets.toml の EMAIL_SERVER を上書き）")
+    parser.add_argument("--port", type=int, help="IMAPポート（secrets.toml の EMAIL_PORT を上書き）")
+    parser.add_argument("--no-ssl", action="store_true", help="平文のIMAPで接続する（ローカル検証用）")
+    parser.add_argument("--user", help="ログインユーザー（secrets.toml の EMAIL_USER を上書き）")
+    parser.add_argument("--password", help="ログインパスワード（secrets.toml の EMAIL_PASSWORD を上書き）")
+    args = parser.parse_args()
+
+    secrets = dict(core.load_secrets() or {})
+    overrides = {"EMAIL_SERVER": args.server, "EMAIL_PORT": args.port, "EMAIL_USER": args.user, "EMAIL_PASSWORD": args.password}
+    secrets.update({k: v for k, v in overrides.items() if v is not None})
+    if args.no_ssl: secrets["EMAIL_USE_SSL"] = False
+    if not all([secrets.get("EMAIL_SERVER"), secrets.get("EMAIL_USER"), secrets.get("EMAIL_PASSWORD")]):
+        print("❌ メールサーバーの接続情報が secrets.toml に設定されていません。")
+        return
+
+    signal.signal(signal.SIGTERM, _request_shutdown)
+    signal.signal(signal.SIGINT, _request_shutdown)
+
+    config = core.load_app_config()
+    if not core.require_current_schema(): return
+    core.configure_genai()
+    log("--- メール取り込みデーモンを開始します ---")
+    serve(secrets, core.load_pipeline_settings(config), load_daemon_settings(config), run_once=args.once)
+    log("--- メール取り込みデーモンを終了しました ---")
+
+
+if __name__ == "__main__":
+    main()
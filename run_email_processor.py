@@ -11,20 +11,19 @@ from email.header import decode_header, make_header
 from email.utils import parsedate_to_datetime
 from datetime import datetime
 import traceback
-import psycopg2
-from psycopg2.extras import DictCursor
+import queue
+import threading
+import time
+from psycopg2.extras import DictCursor, execute_values
 import google.generativeai as genai
 import json
 import re
-import io
-import fitz
-import docx
-import pandas as pd
-# run_email_processor.py 内
-
+import hashlib
+from email.parser import BytesHeaderParser
 import pytz # タイムゾーン処理に必要
-import json
-# ... 他の必要なimport文
+import db_pool
+import item_attributes
+import run_migrations
 
 
 # --- グローバル設定 ---
@@ -60,10 +59,32 @@ def load_app_config():
         print(f"❌ config.toml の読み込み中にエラー: {e}")
         return {}
 
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_connection_pool() -> db_pool.ConnectionPool:
+    """プロセス全体で共有するコネクションプール。パイプラインの各ワーカーはここから接続を借りる。"""
+    global _POOL
+    if _POOL is not None: return _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            secrets = load_secrets()
+            if not secrets or "DATABASE_URL" not in secrets: raise ValueError("DATABASE_URLがsecrets.tomlに設定されていません。")
+            _POOL = db_pool.ConnectionPool(secrets["DATABASE_URL"], db_pool.load_pool_settings(load_app_config()), cursor_factory=DictCursor)
+    return _POOL
+
 def get_db_connection():
-    secrets = load_secrets()
-    if not secrets or "DATABASE_URL" not in secrets: raise ValueError("DATABASE_URLがsecrets.tomlに設定されていません。")
-    return psycopg2.connect(secrets["DATABASE_URL"], cursor_factory=DictCursor)
+    """プールから接続を借りる。close() または with ブロックの終了でプールへ返却される。"""
+    return get_connection_pool().getconn()
+
+def require_current_schema() -> bool:
+    """起動時に1回だけ、未適用のマイグレーションが無いかを確認する。あれば案内を表示して False を返す。"""
+    with get_db_connection() as conn:
+        pending = run_migrations.pending_migrations(conn)
+    if pending:
+        print(f"❌ データベースに未適用のマイグレーションがあります（{', '.join(m['filename'] for m in pending)}）。先に `python run_migrations.py` を実行してください。")
+        return False
+    return True
 
 def configure_genai():
     secrets = load_secrets()
@@ -71,40 +92,54 @@ def configure_genai():
     genai.configure(api_key=secrets["GOOGLE_API_KEY"])
 
 # --- テキスト抽出・整形関連 ---
-def clean_and_format_text(text: str) -> str:
-    if not text: return ""
-    text_with_tabs = re.sub(r' {2,}', '\t', text)
-    full_text = "\n".join([line.strip() for line in text_with_tabs.splitlines()])
-    return re.sub(r'\n{3,}', '\n\n', full_text).strip()
+# 抽出関数の本体はプロセスプールから呼び出すため attachment_extractor.py に置いている
+from attachment_extractor import (
+    AttachmentExtractor, DEFAULT_EXTRACTION_LIMITS, clean_and_format_text, extract_attachment_text,
+    extract_text_from_docx, extract_text_from_excel, extract_text_from_pdf, is_supported_attachment,
+    load_extraction_limits, spool_attachment_payload,
+)
 
-def extract_text_from_pdf(file_bytes):
-    try:
-        with fitz.open(stream=file_bytes, filetype="pdf") as doc: raw_text = "".join(page.get_text() for page in doc)
-        formatted_text = clean_and_format_text(raw_text)
-        return formatted_text if formatted_text else "[PDFテキスト抽出失敗: 内容が空または画像PDF]"
-    except Exception as e: return f"[PDFテキスト抽出エラー: {e}]"
+from ingest_dedup import Fingerprint, compute_fingerprint, is_near_duplicate, load_dedup_settings, normalize_text
+from reply_segmenter import assemble_llm_text, build_segments, load_segment_settings
 
-def extract_text_from_docx(file_bytes):
-    try:
-        doc = docx.Document(io.BytesIO(file_bytes))
-        raw_text = "\n".join([p.text for p in doc.paragraphs])
-        formatted_text = clean_and_format_text(raw_text)
-        return formatted_text if formatted_text else "[DOCXテキスト抽出失敗: 内容が空]"
-    except Exception as e: return f"[DOCXテキスト抽出エラー: {e}]"
+class DbAttachmentTextCache:
+    """
+    添付ファイルの抽出結果を、AttachmentExtractor のキャッシュキー（sha256 と抽出上限から作った sha256）でDBへ保存する。
+    複数の取引先から転送される同じスキルシートの再抽出を防ぐ。
+    """
 
-def extract_text_from_excel(file_bytes: bytes) -> str:
-    try:
-        xls = pd.ExcelFile(io.BytesIO(file_bytes))
-        all_text_parts = [f"\n### シート: {name}\n{pd.read_excel(xls, sheet_name=name, header=None).to_string(header=False, index=False, na_rep='')}" for name in xls.sheet_names if not pd.read_excel(xls, sheet_name=name, header=None).empty]
-        if not all_text_parts: return "[Excelテキスト抽出失敗: 内容が空です]"
-        return clean_and_format_text("".join(all_text_parts))
-    except Exception as e: return f"[Excelテキスト抽出エラー: {e}]"
+    def get(self, digest: str):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT content FROM attachment_text_cache WHERE sha256 = %s", (digest,))
+                row = cursor.fetchone()
+            conn.commit()
+        return row['content'] if row else None
+
+    def put(self, digest: str, filename: str, content: str):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO attachment_text_cache (sha256, filename, content) VALUES (%s, %s, %s)
+                    ON CONFLICT (sha256) DO NOTHING
+                """, (digest, filename, content))
+            conn.commit()
+
+def create_attachment_extractor(settings: dict) -> AttachmentExtractor:
+    """config.toml の設定に従って、DBキャッシュ付きの AttachmentExtractor を生成する。"""
+    return AttachmentExtractor(settings["extraction_limits"], workers=settings["extract_workers"], persistent_cache=DbAttachmentTextCache())
 
-def get_email_contents(msg):
+def get_email_contents(msg, extractor: AttachmentExtractor | None = None):
+    """
+    メールから件名・差出人・本文・添付ファイルのテキストを取り出す。
+    extractor（AttachmentExtractor）が渡された場合、添付ファイルの抽出はプロセスプールで並列に実行する。
+    大きな添付ファイルは一時ファイルに書き出してパスで抽出関数に渡し、戻り値には抽出したテキストだけを残す。
+    """
+    limits = extractor.limits if extractor is not None else DEFAULT_EXTRACTION_LIMITS
     subject = str(make_header(decode_header(msg["subject"]))) if msg["subject"] else ""
     from_ = str(make_header(decode_header(msg["from"]))) if msg["from"] else ""
     received_at = parsedate_to_datetime(msg["Date"]) if msg["Date"] else None
-    body_text, attachments = "", []
+    body_text, attachments, pending_attachments = "", [], []
     if msg.is_multipart():
         for part in msg.walk():
             ctype, cdisp = part.get_content_type(), str(part.get("Content-Disposition"))
@@ -114,25 +149,30 @@ def get_email_contents(msg):
                 except: body_text += part.get_payload(decode=True).decode('utf-8', errors='ignore')
             if 'attachment' in cdisp and (fname := part.get_filename()):
                 filename = str(make_header(decode_header(fname)))
-                #print(f"  > 添付ファイル '{filename}' を発見しました。")
-                fb, lfname = part.get_payload(decode=True), filename.lower()
-                content = ""
-                if lfname.endswith(".pdf"): content = extract_text_from_pdf(fb)
-                elif lfname.endswith(".docx"): content = extract_text_from_docx(fb)
-                elif lfname.endswith((".xlsx", ".xls")): content = extract_text_from_excel(fb)
-                elif lfname.endswith(".txt"): content = fb.decode('utf-8', errors='ignore')
-                else: print(f"  > ℹ️ 添付ファイル '{filename}' は未対応形式のためスキップ。")
-                if content: attachments.append({"filename": filename, "content": content})
+                pending_attachments.append((filename, spool_attachment_payload(part, filename, limits) if is_supported_attachment(filename) else b""))
     else:
         charset = msg.get_content_charset()
         try: body_text = msg.get_payload(decode=True).decode(charset or 'utf-8', errors='ignore')
         except: body_text = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
+
+    try:
+        if extractor is not None:
+            contents = extractor.extract_many(pending_attachments)
+        else:
+            contents = [extract_attachment_text(filename, fb or b"") for filename, fb in pending_attachments]
+    finally:
+        for _, payload in pending_attachments:
+            if isinstance(payload, str):
+                try: os.remove(payload)
+                except OSError: pass
+    for (filename, _), content in zip(pending_attachments, contents):
+        if content is None: print(f"  > ℹ️ 添付ファイル '{filename}' は未対応形式のためスキップ。")
+        elif content: attachments.append({"filename": filename, "content": content})
     return {"subject": subject, "from": from_, "received_at": received_at, "body": body_text.strip(), "attachments": attachments}
 
 # --- LLM・DB処理関連 ---
 
 
-# ▼▼▼【ここに関数を追加】▼▼▼
 def extract_keywords_with_llm(text_content: str, item_type: str, count: int = 20) -> list:
     """
     AI(LLM)を使って、与えられたテキストから最も重要なスキルを「最大count個のリスト」として抽出する。
@@ -175,7 +215,6 @@ def extract_keywords_with_llm(text_content: str, item_type: str, count: int = 20
     except Exception as e:
         print(f"  > ❌ LLMによるキーワード抽出中にエラー: {e}")
         return []
-# ▲▲▲【追加ここまで】▲▲▲
 
 
 
@@ -239,9 +278,6 @@ def _build_meta_info_string(item_type, item_data):
 
 
 
-# run_email_processor.py の中で、既存の split_text_with_llm 関数を以下に置き換えてください。
-
-# ▼▼▼【ここが今回の修正の核となる関数】▼▼▼
 def split_text_with_llm(text_content: str) -> (dict | None, list):
     """
     【改良版】
@@ -363,7 +399,7 @@ def split_text_with_llm(text_content: str) -> (dict | None, list):
     # 処理対象のカテゴリでなければ、ここで処理を終了
     if category not in ["PROJECT_INFO", "ENGINEER_INFO"]:
         logs.append(f"  > ℹ️ このメールはカテゴリ '{category}' と判断されたため、処理をスキップします。")
-        return None, logs
+        return {"jobs": [], "engineers": [], "skipped": f"カテゴリ {category}"}, logs
 
     # 処理対象の場合、抽出用のプロンプトを決定
     if category == "PROJECT_INFO":
@@ -446,124 +482,265 @@ def split_text_with_llm(text_content: str) -> (dict | None, list):
         logs.append(traceback.format_exc())
         return None, logs
 
-# ▲▲▲【置き換えここまで】▲▲▲
 
 
 
 
 
-def process_single_email_core(source_data: dict) -> (bool, list):
+# DB登録先テーブルの定義（item_type → テーブル名・名前カラム・表示ラベル）
+_ITEM_TABLES = {
+    'job': {"table": "jobs", "name_column": "project_name", "label": "案件", "default_name": "名称未定の案件"},
+    'engineer': {"table": "engineers", "name_column": "name", "label": "技術者", "default_name": "名称不明の技術者"},
+}
+
+def _get_now_jst_naive():
+    # DBにはタイムゾーン情報を取り除いた JST の naive datetime を保存する
+    return datetime.now(pytz.timezone('Asia/Tokyo')).replace(tzinfo=None)
+
+
+def build_llm_input_text(source_data: dict) -> str:
+    """本文と添付ファイルのテキストを、LLMに渡す1本のテキストにまとめる。"""
+    valid_attachments_content = [f"\n\n--- 添付ファイル: {att['filename']} ---\n{att.get('content', '')}" for att in source_data.get('attachments', []) if att.get('content')]
+    return source_data.get('body', '') + "".join(valid_attachments_content)
+
+
+# --- 取り込み時の重複検知 ---
+
+def find_duplicate_fingerprint(cursor, fp: Fingerprint, settings: dict) -> dict | None:
     """
-    【完成版】
-    単一のメールコンテンツを解析、キーワードを抽出し、DBに登録する。
-    エラーハンドリングとタイムゾーン処理を強化。
+    過去に登録済みのメールと完全一致または近似重複していれば、正規レコードの情報を返す。
+    正規レコードから登録された案件・技術者が既に削除されている場合は重複とみなさない。
+    """
+    alive_condition = """
+        canonical_hash IS NULL
+        AND created_at >= NOW() - (%s * INTERVAL '1 day')
+        AND (EXISTS (SELECT 1 FROM jobs j WHERE j.id = ANY(f.job_ids))
+             OR EXISTS (SELECT 1 FROM engineers e WHERE e.id = ANY(f.engineer_ids)))
+    """
+    cursor.execute(f"""
+        SELECT content_hash, job_ids, engineer_ids FROM ingest_fingerprints f
+        WHERE content_hash = %s AND {alive_condition}
+        ORDER BY id LIMIT 1
+    """, (fp.content_hash, settings["lookback_days"]))
+    row = cursor.fetchone()
+    if row: return {"content_hash": row['content_hash'], "similarity": 1.0, "job_ids": row['job_ids'], "engineer_ids": row['engineer_ids']}
+
+    if not fp.band_keys: return None
+    cursor.execute(f"""
+        SELECT content_hash, minhash, text_length, job_ids, engineer_ids FROM ingest_fingerprints f
+        WHERE lsh_bands && %s::text[] AND {alive_condition}
+        ORDER BY id DESC LIMIT 50
+    """, (fp.band_keys, settings["lookback_days"]))
+    best = None
+    for row in cursor.fetchall():
+        similarity = is_near_duplicate(fp, row['minhash'], row['text_length'], settings)
+        if similarity is not None and (best is None or similarity > best["similarity"]):
+            best = {"content_hash": row['content_hash'], "similarity": similarity, "job_ids": row['job_ids'], "engineer_ids": row['engineer_ids']}
+    return best
+
+def record_fingerprint(cursor, fp: Fingerprint, source_data: dict, inserted: list = (), duplicate: dict | None = None):
+    """取り込んだメールの指紋を保存する。重複だった場合は canonical_hash で正規レコードに紐付ける。"""
+    job_ids = [item_id for item_type, item_id in inserted if item_type == 'job'] if not duplicate else duplicate["job_ids"]
+    engineer_ids = [item_id for item_type, item_id in inserted if item_type == 'engineer'] if not duplicate else duplicate["engineer_ids"]
+    cursor.execute("""
+        INSERT INTO ingest_fingerprints (content_hash, minhash, lsh_bands, text_length, canonical_hash, similarity, job_ids, engineer_ids, subject, sender)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (fp.content_hash, fp.signature, fp.band_keys or None, fp.text_length,
+          duplicate["content_hash"] if duplicate else None, duplicate["similarity"] if duplicate else None,
+          job_ids, engineer_ids, source_data.get('subject'), source_data.get('from')))
+
+def describe_duplicate(duplicate: dict) -> str:
+    refs = [f"案件ID {i}" for i in duplicate["job_ids"] or []] + [f"技術者ID {i}" for i in duplicate["engineer_ids"] or []]
+    kind = "完全一致" if duplicate["similarity"] >= 1.0 else f"近似重複（類似度 {duplicate['similarity']:.2f}）"
+    return f"  > ♻️ 登録済みの内容と{kind}のため、AI処理と登録をスキップします。（既存: {', '.join(refs)}）"
+
+
+# --- 返信メールの引用部分の除外 ---
+
+def plan_segments(cursor, source_data: dict, settings: dict, seen_in_run=()) -> dict:
+    """
+    本文を返信と引用に分割し、取り込み済みのセグメントを除いた LLM 入力を組み立てる。
+    引用部分から登録済みの案件・技術者のIDは quoted_refs として返す。
+    """
+    segments = build_segments(source_data, settings)
+    hashes = [segment["hash"] for segment in segments if segment["hash"]]
+    seen = {}
+    if hashes:
+        cursor.execute("SELECT segment_hash, job_ids, engineer_ids FROM ingest_segments WHERE segment_hash = ANY(%s)", (hashes,))
+        seen = {row['segment_hash']: row for row in cursor.fetchall()}
+    seen_hashes = set(seen) | (set(hashes) & set(seen_in_run))
+    quoted_refs = {"job_ids": [], "engineer_ids": []}
+    for row in seen.values():
+        for key in quoted_refs:
+            quoted_refs[key].extend(i for i in (row[key] or []) if i not in quoted_refs[key])
+    return {"segments": segments, "seen_hashes": seen_hashes, "quoted_refs": quoted_refs, "llm_text": assemble_llm_text(segments, seen_hashes)}
+
+def record_segments(cursor, plan: dict, inserted: list):
+    """メールのセグメントを記録する。新しいセグメントには、このメールから登録した案件・技術者のIDを紐付ける。"""
+    job_ids = [item_id for item_type, item_id in inserted if item_type == 'job']
+    engineer_ids = [item_id for item_type, item_id in inserted if item_type == 'engineer']
+    for segment_hash_ in {segment["hash"] for segment in plan["segments"] if segment["hash"]}:
+        is_new = segment_hash_ not in plan["seen_hashes"]
+        cursor.execute("""
+            INSERT INTO ingest_segments (segment_hash, job_ids, engineer_ids)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (segment_hash) DO UPDATE
+            SET seen_count = ingest_segments.seen_count + 1, last_seen_at = NOW(),
+                job_ids = ingest_segments.job_ids || EXCLUDED.job_ids,
+                engineer_ids = ingest_segments.engineer_ids || EXCLUDED.engineer_ids
+        """, (segment_hash_, job_ids if is_new else [], engineer_ids if is_new else []))
+
+def describe_segment_plan(plan: dict) -> str:
+    refs = [f"案件ID {i}" for i in plan["quoted_refs"]["job_ids"]] + [f"技術者ID {i}" for i in plan["quoted_refs"]["engineer_ids"]]
+    total = sum(1 for segment in plan["segments"] if segment["hash"])
+    message = f"  > ℹ️ 取り込み済みの引用・添付 {len(plan['seen_hashes'])}/{total} セグメントをAI処理から除外します。"
+    return message + (f"（既存: {', '.join(refs)}）" if refs else "")
+
+
+def analyze_email_content(source_data: dict, llm_text: str | None = None) -> (dict | None, list):
+    """
+    単一のメールコンテンツに対して、LLMによる分類・構造化・キーワード抽出までを行う。
+    DBには一切触れないため、複数スレッドから並行して呼び出してよい。
+    llm_text を渡した場合（引用部分を除いたテキストなど）は、本文と添付の代わりにそれをLLMに渡す。
+    戻り値の analysis は persist_analyzed_email にそのまま渡す。
+    登録対象ではないと判断したメール（テキストが無い、案件・技術者以外のカテゴリ）は、
+    items が空で skipped に理由を入れた analysis を返す。None を返すのはエラーのときだけ。
     """
     logs = []
     if not source_data: 
         logs.append("⚠️ 処理するデータが空です。")
-        return False, logs
+        return None, logs
 
     # --- 1. テキストコンテンツの準備 ---
-    valid_attachments_content = [f"\n\n--- 添付ファイル: {att['filename']} ---\n{att.get('content', '')}" for att in source_data.get('attachments', []) if att.get('content')]
-    if valid_attachments_content: 
-        logs.append(f"  > ℹ️ {len(valid_attachments_content)}件の添付ファイル内容を解析に含めます。")
+    full_text_for_llm = llm_text if llm_text is not None else build_llm_input_text(source_data)
+    attachment_count = sum(1 for att in source_data.get('attachments', []) if att.get('content'))
+    if attachment_count: 
+        logs.append(f"  > ℹ️ {attachment_count}件の添付ファイル内容を解析に含めます。")
     
-    full_text_for_llm = source_data.get('body', '') + "".join(valid_attachments_content)
     if not full_text_for_llm.strip(): 
-        logs.append("⚠️ 解析対象のテキストがありません。")
-        return False, logs
+        logs.append("ℹ️ 解析対象のテキストがありません。")
+        return {"source_data": source_data, "items": [], "skipped": "解析対象のテキストなし"}, logs
 
     # --- 2. AIによる情報構造化 ---
     parsed_data, llm_logs = split_text_with_llm(full_text_for_llm)
     logs.extend(llm_logs)
     if not parsed_data: 
-        return False, logs
+        return None, logs
+    if parsed_data.get("skipped"):
+        return {"source_data": source_data, "items": [], "skipped": parsed_data["skipped"]}, logs
     
     new_jobs = parsed_data.get("jobs", [])
     new_engineers = parsed_data.get("engineers", [])
     if not new_jobs and not new_engineers: 
         logs.append("⚠️ LLMはテキストから案件情報または技術者情報を抽出できませんでした。")
+        return None, logs
+
+    # --- 3. 登録対象ごとのキーワード抽出 ---
+    items = []
+    for item_type, item_list in (('job', new_jobs), ('engineer', new_engineers)):
+        table_info = _ITEM_TABLES[item_type]
+        for item_data in item_list:
+            name = item_data.get(table_info["name_column"], table_info["default_name"])
+            full_document = _build_meta_info_string(item_type, item_data) + (item_data.get("document") or full_text_for_llm)
+
+            logs.append(f"    -> {table_info['label']}『{name}』のキーワードを抽出中...")
+            keywords = extract_keywords_with_llm(full_document, item_type)
+            logs.append(f"    -> 抽出キーワード: {keywords}")
+            items.append({"item_type": item_type, "name": name, "document": full_document, "keywords": keywords})
+
+    return {"source_data": source_data, "items": items}, logs
+
+
+def persist_analyzed_email(cursor, analysis: dict, now_jst_naive, logs: list) -> list:
+    """
+    analyze_email_content の結果を、渡されたカーソルでDBにINSERTする。
+    コミットは呼び出し元の責任とする。登録した (item_type, id) のリストを返す。
+    """
+    source_data = analysis["source_data"]
+    received_at_dt = source_data.get('received_at')
+    # JSONとして保存するデータのために、datetimeオブジェクトをISO形式の文字列に変換
+    source_json_str = json.dumps({k: v.isoformat() if isinstance(v, datetime) else v for k, v in source_data.items()}, ensure_ascii=False, separators=(',', ':'))
+
+    inserted = []
+    for item in analysis["items"]:
+        table_info = _ITEM_TABLES[item["item_type"]]
+        name = item["name"]
+        # 単価・勤務地・開始時期は、メタ情報から取り出した値を型付きの列にも保存する（item_attributes.py）
+        attributes = item_attributes.extract_attributes(item["item_type"], item["document"], now_jst_naive)
+        attribute_columns = item_attributes.ATTRIBUTE_COLUMNS
+        sql = f"""
+            INSERT INTO {table_info['table']} ({table_info['name_column']}, document, source_data_json, created_at, received_at, keywords, {', '.join(attribute_columns)}) 
+            VALUES (%s, %s, %s, %s, %s, %s, {', '.join(['%s'] * len(attribute_columns))}) RETURNING id
+        """
+        params = (name, item["document"], source_json_str, now_jst_naive, received_at_dt, item["keywords"]) + tuple(attributes[column] for column in attribute_columns)
+
+        try:
+            log_query = cursor.mogrify(sql, params).decode('utf-8', 'ignore')
+            logs.append(f"    -> Executing SQL: {log_query[:500]}...")
+        except Exception as log_err:
+            logs.append(f"    -> Failed to mogrify query for logging: {log_err}")
+
+        cursor.execute(sql, params)
+
+        result = cursor.fetchone()
+        if result:
+            logs.append(f"    -> 新規{table_info['label']}を登録: 『{name}』 (ID: {result['id']})")
+            inserted.append((item["item_type"], result['id']))
+        else:
+            logs.append(f"    -> ⚠️ {table_info['label']}『{name}』のDB登録に失敗、または既に存在します。")
+    return inserted
+
+
+def process_single_email_core(source_data: dict) -> (bool, list):
+    """
+    【完成版】
+    単一のメールコンテンツを解析、キーワードを抽出し、DBに登録する。
+    エラーハンドリングとタイムゾーン処理を強化。
+    """
+    config = load_app_config()
+    dedup_settings, segment_settings = load_dedup_settings(config), load_segment_settings(config)
+    fp, plan, llm_text, screening_logs = None, None, None, []
+    if source_data and (dedup_settings["enabled"] or segment_settings["enabled"]):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    if segment_settings["enabled"]:
+                        plan = plan_segments(cursor, source_data, segment_settings)
+                        if plan["seen_hashes"]:
+                            screening_logs.append(describe_segment_plan(plan))
+                            if plan["quoted_refs"]["job_ids"] or plan["quoted_refs"]["engineer_ids"]:
+                                source_data["quoted_item_refs"] = plan["quoted_refs"]
+                            if len(normalize_text(plan["llm_text"])) < segment_settings["min_new_chars"]:
+                                record_segments(cursor, plan, [])
+                                conn.commit()
+                                return True, screening_logs + ["  > ♻️ 新しい内容が無い返信のため、AI処理と登録をスキップします。"]
+                            llm_text = plan["llm_text"]
+                    duplicate = None
+                    if dedup_settings["enabled"]:
+                        fp = compute_fingerprint(llm_text if llm_text is not None else build_llm_input_text(source_data), dedup_settings)
+                        duplicate = find_duplicate_fingerprint(cursor, fp, dedup_settings)
+                        if duplicate: record_fingerprint(cursor, fp, source_data, duplicate=duplicate)
+                conn.commit()
+            if duplicate: return True, screening_logs + [describe_duplicate(duplicate)]
+        except Exception as e:
+            print(f"  > ⚠️ 重複チェック中にエラーが発生したため、通常どおり処理します: {e}")
+            fp, plan, llm_text = None, None, None
+
+    analysis, logs = analyze_email_content(source_data, llm_text=llm_text)
+    logs = screening_logs + logs
+    if not analysis:
         return False, logs
+    if analysis.get("skipped"):
+        return True, logs
     
-    # --- 3. データベースへの保存処理 ---
+    # --- データベースへの保存処理 ---
     logs.append("  > ✅ 抽出された情報をデータベースに保存します...")
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                
-                # ▼▼▼【ここからが修正の核】▼▼▼
-                jst_tz = pytz.timezone('Asia/Tokyo')
-                now_in_jst = datetime.now(jst_tz)
-                # タイムゾーン情報を取り除いた naive オブジェクトを生成
-                now_jst_naive = now_in_jst.replace(tzinfo=None)
-                # ▲▲▲【修正ここまで】▲▲▲
-
-                # タイムゾーンをLAに統一して、タイムゾーン付きのdatetimeオブジェクトを生成
-                #target_tz = pytz.timezone('America/Los_Angeles')
-                #now_in_la = datetime.now(target_tz)
-                
-                received_at_dt = source_data.get('received_at')
-                # JSONとして保存するデータのために、datetimeオブジェクトをISO形式の文字列に変換
-                source_json_str = json.dumps({k: v.isoformat() if isinstance(v, datetime) else v for k, v in source_data.items()}, ensure_ascii=False, indent=2)
-
-                # --- jobs の処理 ---
-                for item_data in new_jobs:
-                    name = item_data.get("project_name", "名称未定の案件")
-                    full_document = _build_meta_info_string('job', item_data) + (item_data.get("document") or full_text_for_llm)
-                    
-                    logs.append(f"    -> 案件『{name}』のキーワードを抽出中...")
-                    keywords = extract_keywords_with_llm(full_document, 'job') # このファイル内に定義が必要
-                    logs.append(f"    -> 抽出キーワード: {keywords}")
-
-                    sql = """
-                        INSERT INTO jobs (project_name, document, source_data_json, created_at, received_at, keywords) 
-                        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-                    """
-                    params = (name, full_document, source_json_str, now_jst_naive, received_at_dt, keywords)
-                    
-                    try:
-                        log_query = cursor.mogrify(sql, params).decode('utf-8', 'ignore')
-                        logs.append(f"    -> Executing SQL: {log_query[:500]}...")
-                    except Exception as log_err:
-                        logs.append(f"    -> Failed to mogrify query for logging: {log_err}")
-                    
-                    cursor.execute(sql, params)
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        logs.append(f"    -> 新規案件を登録: 『{name}』 (ID: {result['id']})")
-                    else:
-                        logs.append(f"    -> ⚠️ 案件『{name}』のDB登録に失敗、または既に存在します。")
-
-                # --- engineers の処理 ---
-                for item_data in new_engineers:
-                    name = item_data.get("name", "名称不明の技術者")
-                    full_document = _build_meta_info_string('engineer', item_data) + (item_data.get("document") or full_text_for_llm)
-
-                    logs.append(f"    -> 技術者『{name}』のキーワードを抽出中...")
-                    keywords = extract_keywords_with_llm(full_document, 'engineer') # このファイル内に定義が必要
-                    logs.append(f"    -> 抽出キーワード: {keywords}")
-
-                    sql = """
-                        INSERT INTO engineers (name, document, source_data_json, created_at, received_at, keywords) 
-                        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-                    """
-                    params = (name, full_document, source_json_str, now_jst_naive, received_at_dt, keywords)
-
-                    try:
-                        log_query = cursor.mogrify(sql, params).decode('utf-8', 'ignore')
-                        logs.append(f"    -> Executing SQL: {log_query[:500]}...")
-                    except Exception as log_err:
-                        logs.append(f"    -> Failed to mogrify query for logging: {log_err}")
-
-                    cursor.execute(sql, params)
-
-                    result = cursor.fetchone()
-                    if result:
-                        logs.append(f"    -> 新規技術者を登録: 『{name}』 (ID: {result['id']})")
-                    else:
-                        logs.append(f"    -> ⚠️ 技術者『{name}』のDB登録に失敗、または既に存在します。")
-                
+                inserted = persist_analyzed_email(cursor, analysis, _get_now_jst_naive(), logs)
+                if fp is not None: record_fingerprint(cursor, fp, source_data, inserted)
+                if plan is not None: record_segments(cursor, plan, inserted)
             conn.commit()
     except Exception as e:
         logs.append(f"❌ DB保存中にエラーが発生: {e}")
@@ -575,86 +752,857 @@ def process_single_email_core(source_data: dict) -> (bool, list):
     return True, logs
 
 
+# --- 取り込み台帳（メールごとの処理段階の記録） ---
+# fetched → extracted → analyzed → persisted → flagged の順に進む。failed は attempts が上限に達するまで再試行する。
+# 登録対象ではないと判断したメール（案件・技術者以外のカテゴリなど）は skipped で終わり、再試行しない。
+# persisted・skipped 以降のメールは、次回の実行でLLMもDB登録も行わずにフラグ付けだけをやり直す。
+_LEDGER_DONE_STATUSES = ('persisted', 'skipped', 'flagged')
+
+
+def ledger_identity(raw_bytes: bytes) -> dict:
+    """台帳のキー（Message-ID と、メール全体の sha256）を返す。Message-ID が無いメールは空文字とする。"""
+    headers = BytesHeaderParser().parsebytes(raw_bytes)
+    return {"message_id": (headers.get('Message-ID') or '').strip(), "content_hash": hashlib.sha256(raw_bytes).hexdigest()}
+
+def ledger_register_fetched(cursor, mailbox: str, uidvalidity, entries: list) -> dict:
+    """
+    取得したメール [(uid, identity), ...] を台帳に登録し、既存の行があればその状態を返す。
+    戻り値は (message_id, content_hash) をキーにした台帳の行。
+    同じメールが重複して届き、1回の取得に同じキーが複数含まれる場合は、最初の UID だけを台帳に記録する
+    （同じ行を1つの INSERT ... ON CONFLICT DO UPDATE で2回更新することはできない）。
+    """
+    if not entries: return {}
+    unique = {}
+    for uid, identity in entries:
+        unique.setdefault((identity["message_id"], identity["content_hash"]), uid)
+    rows = execute_values(cursor, """
+        INSERT INTO ingested_messages (message_id, content_hash, mailbox, uidvalidity, uid)
+        VALUES %s
+        ON CONFLICT (message_id, content_hash) DO UPDATE
+        SET mailbox = EXCLUDED.mailbox, uidvalidity = EXCLUDED.uidvalidity, uid = EXCLUDED.uid, updated_at = NOW()
+        RETURNING message_id, content_hash, status, analysis_json, attempts
+    """, [(message_id, content_hash, mailbox, uidvalidity, uid) for (message_id, content_hash), uid in unique.items()], fetch=True)
+    return {(row['message_id'], row['content_hash']): dict(row) for row in rows}
+
+def ledger_update(cursor, identity: dict, status: str, analysis: dict | None = None, inserted: list | None = None, error: str | None = None):
+    """台帳の状態を進める。error を渡した場合は attempts を1増やす。"""
+    sets, params = ["status = %s", "updated_at = NOW()"], [status]
+    if analysis is not None:
+        sets.append("analysis_json = %s")
+        params.append(json.dumps(analysis, ensure_ascii=False, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)))
+    if inserted is not None:
+        sets += ["job_ids = %s", "engineer_ids = %s"]
+        params += [[i for t, i in inserted if t == 'job'], [i for t, i in inserted if t == 'engineer']]
+    if error is not None:
+        sets += ["attempts = attempts + 1", "last_error = %s"]
+        params.append(error[:1000])
+    cursor.execute(f"UPDATE ingested_messages SET {', '.join(sets)} WHERE message_id = %s AND content_hash = %s",
+                   params + [identity["message_id"], identity["content_hash"]])
+
+def ledger_mark_flagged(identities: list):
+    if not identities: return
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingested_messages SET status = 'flagged', updated_at = NOW()
+                WHERE (message_id, content_hash) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+            """, ([i["message_id"] for i in identities], [i["content_hash"] for i in identities]))
+        conn.commit()
+
+def restore_analysis(analysis_json) -> dict | None:
+    """台帳に保存した analyze_email_content の結果を復元する（received_at を datetime に戻す）。"""
+    if not analysis_json: return None
+    analysis = analysis_json if isinstance(analysis_json, dict) else json.loads(analysis_json)
+    received_at = analysis["source_data"].get("received_at")
+    if isinstance(received_at, str):
+        try: analysis["source_data"]["received_at"] = datetime.fromisoformat(received_at)
+        except ValueError: analysis["source_data"]["received_at"] = None
+    return analysis
+
+
+# ==============================================================================
+# 2. 取り込みパイプライン（fetch → parse/extract → LLM → persist）
+# ==============================================================================
+
+_PIPELINE_STOP = object()
+
+def load_pipeline_settings(config: dict) -> dict:
+    """config.toml の [email_processing] からパイプラインの並列度・キュー上限を読み込む"""
+    ep = (config or {}).get("email_processing", {})
+    return {
+        "fetch_limit": ep.get("fetch_limit", 10),
+        "queue_size": max(1, ep.get("queue_size", 10)),
+        "extract_workers": max(1, ep.get("extract_workers", 2)),
+        "llm_concurrency": max(1, ep.get("llm_concurrency", 4)),
+        "persist_batch_size": max(1, ep.get("persist_batch_size", 10)),
+        "persist_flush_seconds": ep.get("persist_flush_seconds", 3.0),
+        "fetch_batch_size": max(1, ep.get("fetch_batch_size", 25)),
+        "max_part_bytes": ep.get("max_part_bytes", 0),
+        "max_attempts": max(1, ep.get("max_attempts", 3)),
+        "extraction_limits": load_extraction_limits(config),
+        "dedup": load_dedup_settings(config),
+        "reply_segmentation": load_segment_settings(config),
+    }
+
+
+class EmailIngestionPipeline:
+    """
+    メール取り込みをステージごとに並列化するパイプライン。
+
+    - parse/extract : MIME解析を行い、添付ファイルのテキスト抽出は AttachmentExtractor（プロセスプール）で実行
+    - dedup         : 単一スレッドが返信を引用部分と分けて取り込み済みのセグメントを除き、
+                      残りの指紋が登録済み・今回のバッチ内と重複するメールはLLMに渡さない
+    - LLM           : 分類・構造化・キーワード抽出をスレッドで並行実行（llm_concurrency 本）
+    - persist       : 単一スレッドが persist_batch_size 件ずつまとめてINSERTし、1回でコミット
+
+    ステージ間は有界キューで繋がっており、下流が詰まると submit() がブロックする（バックプレッシャー）。
+    IMAP接続は呼び出し元スレッドだけが扱い、コミットが完了したメールだけが drain_committed() で返される。
+    """
+
+    def __init__(self, settings: dict, extractor: AttachmentExtractor | None = None):
+        self.settings = settings
+        # 常駐プロセスなどから使い回しの extractor が渡された場合は、生成も停止もしない
+        self._owns_extractor = extractor is None
+        self._extractor = extractor
+        self.parse_queue = queue.Queue(maxsize=settings["queue_size"])
+        self.dedup_queue = queue.Queue(maxsize=settings["queue_size"])
+        self.llm_queue = queue.Queue(maxsize=settings["queue_size"])
+        self.persist_queue = queue.Queue(maxsize=settings["queue_size"])
+        self.committed_queue = queue.Queue()
+        self._parse_threads, self._llm_threads, self._dedup_thread, self._persist_thread = [], [], None, None
+        # 重複検知の状態。_run_* は dedup スレッドだけが、_canonical_outcomes と _deferred は persist スレッドだけが触る
+        self._dedup_settings = settings.get("dedup") or load_dedup_settings({})
+        self._segment_settings = settings.get("reply_segmentation") or load_segment_settings({})
+        self._run_hashes, self._run_bands, self._run_segments = set(), {}, set()
+        self._canonical_outcomes, self._deferred = {}, []
+
+    # --- ライフサイクル ---
+    def start(self):
+        if self._owns_extractor:
+            self._extractor = create_attachment_extractor(self.settings)
+        self._parse_threads = [threading.Thread(target=self._parse_worker, name=f"parse-{i}", daemon=True) for i in range(self.settings["extract_workers"])]
+        self._dedup_thread = threading.Thread(target=self._dedup_worker, name="dedup", daemon=True)
+        self._llm_threads = [threading.Thread(target=self._llm_worker, name=f"llm-{i}", daemon=True) for i in range(self.settings["llm_concurrency"])]
+        self._persist_thread = threading.Thread(target=self._persist_worker, name="persist", daemon=True)
+        for t in self._parse_threads + [self._dedup_thread] + self._llm_threads + [self._persist_thread]: t.start()
+        return self
+
+    def submit(self, key, raw_bytes: bytes, ledger: dict | None = None):
+        """
+        取得済みのメール（RFC822のバイト列）を投入する。キューが満杯の間はブロックする。
+        ledger は取り込み台帳の行。前回のAI処理結果が残っていれば、解析とLLMを飛ばして保存から再開する。
+        """
+        analysis = restore_analysis(ledger.get("analysis_json")) if ledger else None
+        if analysis:
+            self.persist_queue.put({"key": key, "ledger": ledger, "analysis": analysis, "resumed": True,
+                                    "logs": ["  > ℹ️ 前回の実行で保存できなかったAI処理結果を再利用します。"]})
+            return
+        self.parse_queue.put((key, raw_bytes, ledger))
+
+    def close(self):
+        """上流から順に停止シグナルを流し、全ステージの処理完了を待つ。"""
+        for _ in self._parse_threads: self.parse_queue.put(_PIPELINE_STOP)
+        for t in self._parse_threads: t.join()
+        self.dedup_queue.put(_PIPELINE_STOP)
+        if self._dedup_thread: self._dedup_thread.join()
+        for _ in self._llm_threads: self.llm_queue.put(_PIPELINE_STOP)
+        for t in self._llm_threads: t.join()
+        self.persist_queue.put(_PIPELINE_STOP)
+        if self._persist_thread: self._persist_thread.join()
+        if self._owns_extractor and self._extractor: self._extractor.close()
+
+    @property
+    def extractor_stats(self) -> dict:
+        """添付抽出の累計件数（AttachmentExtractor.stats）の写しを返す。start() の前は空の辞書。"""
+        return dict(self._extractor.stats) if self._extractor else {}
+
+    def drain_committed(self) -> list:
+        """コミット（または失敗確定）したメールの結果を取り出す。ブロックしない。"""
+        results = []
+        while True:
+            try: results.append(self.committed_queue.get_nowait())
+            except queue.Empty: return results
+
+    # --- 各ステージのワーカー ---
+    def _parse_worker(self):
+        while True:
+            entry = self.parse_queue.get()
+            if entry is _PIPELINE_STOP: return
+            key, raw_bytes, ledger = entry
+            try:
+                msg = email.message_from_bytes(raw_bytes)
+                # 解析後は元のバイト列を保持しない（添付ファイルの中身は msg 側に残る）
+                entry = raw_bytes = None
+                source_data = get_email_contents(msg, extractor=self._extractor)
+                self.dedup_queue.put({"key": key, "ledger": ledger, "source_data": source_data, "logs": []})
+            except Exception as e:
+                self.persist_queue.put({"key": key, "ledger": ledger, "analysis": None, "logs": [f"❌ メールの解析中にエラーが発生: {e}"]})
+
+    def _dedup_worker(self):
+        conn = None
+        try:
+            while True:
+                entry = self.dedup_queue.get()
+                if entry is _PIPELINE_STOP: return
+                try:
+                    conn = self._screen_entry(conn, entry)
+                except Exception as e:
+                    entry["logs"].append(f"  > ⚠️ 重複チェック中にエラーが発生したため、通常どおり処理します: {e}")
+                    if conn is not None and not conn.closed: conn.close()
+                    conn = None
+                    self.llm_queue.put(entry)
+        finally:
+            if conn is not None and not conn.closed: conn.close()
+
+    def _screen_entry(self, conn, entry: dict):
+        """
+        LLMに渡す前の選別を行い、entry を llm_queue か persist_queue のどちらかに流す。
+        1. 本文を返信と引用に分割し、取り込み済みのセグメントを除外する
+        2. 残ったテキストの指紋で、今回の実行内・登録済みのメールとの重複を判定する
+        """
+        source_data = entry["source_data"]
+        segment_settings, dedup_settings = self._segment_settings, self._dedup_settings
+        if conn is None or conn.closed:
+            conn = get_db_connection()
+        if entry.get("ledger"):
+            with conn.cursor() as cursor: ledger_update(cursor, entry["ledger"], 'extracted')
+            conn.commit()
+        if not (segment_settings["enabled"] or dedup_settings["enabled"]) or not source_data:
+            self.llm_queue.put(entry)
+            return conn
+
+        # 1. 返信の分割と、取り込み済みセグメントの除外
+        text = build_llm_input_text(source_data)
+        plan = None
+        if segment_settings["enabled"]:
+            with conn.cursor() as cursor:
+                plan = plan_segments(cursor, source_data, segment_settings, self._run_segments)
+            conn.commit()
+            entry["segment_plan"] = plan
+            if plan["seen_hashes"]:
+                entry["logs"].append(describe_segment_plan(plan))
+                if plan["quoted_refs"]["job_ids"] or plan["quoted_refs"]["engineer_ids"]:
+                    source_data["quoted_item_refs"] = plan["quoted_refs"]
+                if len(normalize_text(plan["llm_text"])) < segment_settings["min_new_chars"]:
+                    entry.update({"analysis": None, "quoted_only": True})
+                    self.persist_queue.put(entry)
+                    return conn
+                entry["llm_text"] = text = plan["llm_text"]
+        if not dedup_settings["enabled"] or not text.strip():
+            self._register_in_run(None, plan)
+            self.llm_queue.put(entry)
+            return conn
+
+        fp = compute_fingerprint(text, dedup_settings)
+        entry["fingerprint"] = fp
+
+        # 2-1. 今回の実行で先に流れたメールとの重複（正規メールの登録結果は persist 側で待ち合わせる）
+        pending = self._find_in_run_duplicate(fp)
+        if pending:
+            entry.update({"analysis": None, "pending_canonical": pending})
+            self.persist_queue.put(entry)
+            return conn
+
+        # 2-2. 登録済みのメールとの重複
+        with conn.cursor() as cursor:
+            duplicate = find_duplicate_fingerprint(cursor, fp, dedup_settings)
+        conn.commit()
+        if duplicate:
+            entry.update({"analysis": None, "duplicate": duplicate})
+            self.persist_queue.put(entry)
+            return conn
+
+        self._register_in_run(fp, plan)
+        entry["canonical"] = True
+        self.llm_queue.put(entry)
+        return conn
+
+    def _find_in_run_duplicate(self, fp: Fingerprint) -> dict | None:
+        if fp.content_hash in self._run_hashes:
+            return {"content_hash": fp.content_hash, "similarity": 1.0}
+        best = None
+        for band_key in fp.band_keys:
+            for other in self._run_bands.get(band_key, []):
+                similarity = is_near_duplicate(fp, other.signature, other.text_length, self._dedup_settings)
+                if similarity is not None and (best is None or similarity > best["similarity"]):
+                    best = {"content_hash": other.content_hash, "similarity": similarity}
+        return best
+
+    def _register_in_run(self, fp: Fingerprint | None, plan: dict | None):
+        # LLMに渡したメールのセグメントは、同じ実行内の後続メール（そのメールへの返信など）では送らない
+        if plan: self._run_segments.update(segment["hash"] for segment in plan["segments"] if segment["hash"])
+        if fp is None: return
+        self._run_hashes.add(fp.content_hash)
+        for band_key in fp.band_keys:
+            self._run_bands.setdefault(band_key, []).append(fp)
+
+    def _llm_worker(self):
+        while True:
+            entry = self.llm_queue.get()
+            if entry is _PIPELINE_STOP: return
+            try:
+                analysis, logs = analyze_email_content(entry["source_data"], llm_text=entry.get("llm_text"))
+            except Exception as e:
+                analysis, logs = None, [f"❌ AI処理中に予期せぬエラーが発生: {e}", traceback.format_exc()]
+            entry.update({"analysis": analysis, "logs": entry["logs"] + logs})
+            self.persist_queue.put(entry)
+
+    def _persist_worker(self):
+        conn = None
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                # 1件目は無期限に待ち、以降はバッチが埋まるか flush 秒経過するまで集める
+                deadline = None
+                while len(batch) < self.settings["persist_batch_size"]:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    try: entry = self.persist_queue.get(timeout=timeout)
+                    except queue.Empty: break
+                    if entry is _PIPELINE_STOP:
+                        stopping = True
+                        break
+                    batch.append(entry)
+                    if deadline is None: deadline = time.monotonic() + self.settings["persist_flush_seconds"]
+                batch = self._resolve_deferred(batch)
+                if batch:
+                    conn = self._persist_batch(conn, batch)
+            # 停止時点では全ての正規メールがここまで届いているため、保留中の重複メールは最後のバッチの後に必ず解決できる
+            while self._deferred:
+                batch = self._resolve_deferred([], final=True)
+                if batch: conn = self._persist_batch(conn, batch)
+        finally:
+            if conn is not None and not conn.closed: conn.close()
+
+    def _resolve_deferred(self, batch: list, final: bool = False) -> list:
+        """
+        今回の実行内の重複メールを、正規メールの登録結果が確定するまで保留する。
+        正規メールが登録済みになったものは既存IDへの紐付けとして、失敗したものは失敗としてバッチに戻す。
+        """
+        ready = []
+        for entry in batch:
+            if entry.get("pending_canonical"): self._deferred.append(entry)
+            else: ready.append(entry)
+        still_waiting = []
+        for entry in self._deferred:
+            outcome = self._canonical_outcomes.get(entry["pending_canonical"]["content_hash"])
+            if outcome is None and not final:
+                still_waiting.append(entry)
+                continue
+            pending = entry.pop("pending_canonical")
+            if outcome and outcome["success"]:
+                entry["duplicate"] = {**pending, "job_ids": outcome["job_ids"], "engineer_ids": outcome["engineer_ids"]}
+            else:
+                entry["logs"].append("❌ 同じ内容のメールの登録に失敗したため、このメールも登録できませんでした。")
+            ready.append(entry)
+        self._deferred = still_waiting
+        return ready
+
+    def _persist_batch(self, conn, batch: list):
+        """
+        バッチ内のメールを1トランザクションで登録する。メール単位でSAVEPOINTを切り、失敗した1通だけを巻き戻す。
+        台帳の persisted への更新も同じSAVEPOINTで行うため、登録とその記録は必ず揃ってコミットされる。
+        登録対象ではないと判断したメールは skipped として記録し、登録したメールと同じく今回フラグを付ける。
+        """
+        to_save = [entry for entry in batch if entry["analysis"] or entry.get("duplicate") or entry.get("quoted_only")]
+        results = {id(entry): False for entry in batch}
+        inserted_by_entry = {}
+        if to_save:
+            try:
+                if conn is None or conn.closed: conn = get_db_connection()
+                # 先にAI処理結果だけを台帳へ保存しておき、この後の登録が失敗してもLLMを呼び直さずに済むようにする
+                fresh = [entry for entry in to_save if entry["analysis"] and not entry["analysis"].get("skipped") and entry.get("ledger") and not entry.get("resumed")]
+                if fresh:
+                    with conn.cursor() as cursor:
+                        for entry in fresh: ledger_update(cursor, entry["ledger"], 'analyzed', analysis=entry["analysis"])
+                    conn.commit()
+
+                now_jst_naive = _get_now_jst_naive()
+                with conn.cursor() as cursor:
+                    for entry in to_save:
+                        cursor.execute("SAVEPOINT ingest_email")
+                        try:
+                            inserted, status = [], 'persisted'
+                            if entry.get("quoted_only"):
+                                entry["logs"].append("  > ♻️ 新しい内容が無い返信のため、AI処理と登録をスキップします。")
+                                record_segments(cursor, entry["segment_plan"], [])
+                            elif entry.get("duplicate"):
+                                entry["logs"].append(describe_duplicate(entry["duplicate"]))
+                                record_fingerprint(cursor, entry["fingerprint"], entry["source_data"], duplicate=entry["duplicate"])
+                            elif entry["analysis"].get("skipped"):
+                                # 後の返信で引用として届いたときにAI処理から除外できるよう、登録0件としてセグメントを記録する
+                                if entry.get("fingerprint"): record_fingerprint(cursor, entry["fingerprint"], entry["source_data"], [])
+                                if entry.get("segment_plan"): record_segments(cursor, entry["segment_plan"], [])
+                                status = 'skipped'
+                            else:
+                                entry["logs"].append("  > ✅ 抽出された情報をデータベースに保存します...")
+                                inserted = persist_analyzed_email(cursor, entry["analysis"], now_jst_naive, entry["logs"])
+                                if entry.get("fingerprint"): record_fingerprint(cursor, entry["fingerprint"], entry["source_data"], inserted)
+                                if entry.get("segment_plan"): record_segments(cursor, entry["segment_plan"], inserted)
+                                inserted_by_entry[id(entry)] = inserted
+                            if entry.get("ledger"): ledger_update(cursor, entry["ledger"], status, inserted=inserted)
+                            cursor.execute("RELEASE SAVEPOINT ingest_email")
+                            results[id(entry)] = True
+                        except Exception as e:
+                            cursor.execute("ROLLBACK TO SAVEPOINT ingest_email")
+                            entry["logs"].append(f"❌ DB保存中にエラーが発生: {e}")
+                conn.commit()
+                for entry in to_save:
+                    if results[id(entry)] and entry["analysis"] and not entry["analysis"].get("skipped"): entry["logs"].append("  > ✅ 保存完了！")
+            except Exception as e:
+                # 接続断などバッチ全体の失敗。コミットされていないので、いずれのメールにもフラグは付かない
+                if conn is not None and not conn.closed:
+                    try: conn.rollback()
+                    except Exception: pass
+                    conn.close()
+                conn = None
+                for entry in to_save:
+                    results[id(entry)] = False
+                    entry["logs"].append(f"❌ DB保存中にエラーが発生（バッチ全体を巻き戻しました）: {e}")
+
+        retryable = self._record_failures(conn, [entry for entry in batch if not results[id(entry)]])
+        for entry in batch:
+            fp = entry.get("fingerprint")
+            if fp is not None and entry.get("canonical"):
+                # 今回の実行内で保留している重複メールの待ち合わせ用に、正規メールの結果を残す
+                inserted = inserted_by_entry.get(id(entry), []) if results[id(entry)] else []
+                self._canonical_outcomes[fp.content_hash] = {
+                    "success": results[id(entry)],
+                    "job_ids": [item_id for item_type, item_id in inserted if item_type == 'job'],
+                    "engineer_ids": [item_id for item_type, item_id in inserted if item_type == 'engineer'],
+                }
+            self.committed_queue.put({"key": entry["key"], "success": results[id(entry)], "logs": entry["logs"],
+                                      "ledger": entry.get("ledger"), "retryable": id(entry) in retryable})
+        return conn
+
+    def _record_failures(self, conn, failed: list) -> set:
+        """
+        失敗したメールを台帳に記録し、次回の実行で再試行するメール（attempts が上限未満）の id() の集合を返す。
+        台帳に記録できなかった場合は、従来どおり再試行しない扱いにする。
+        """
+        failed = [entry for entry in failed if entry.get("ledger")]
+        if not failed: return set()
+        # バッチ全体が失敗して接続を閉じた後は、記録用に一時的な接続を張る
+        owns_conn = conn is None or conn.closed
+        try:
+            if owns_conn: conn = get_db_connection()
+            with conn.cursor() as cursor:
+                for entry in failed:
+                    error = next((line for line in reversed(entry["logs"]) if line.lstrip().startswith(("❌", "⚠️"))), "原因不明のエラー")
+                    ledger_update(cursor, entry["ledger"], 'failed', error=error.strip())
+            conn.commit()
+        except Exception as e:
+            print(f"⚠️ 取り込み台帳への失敗の記録中にエラーが発生しました: {e}")
+            return set()
+        finally:
+            if owns_conn and conn is not None and not conn.closed: conn.close()
+        retryable = set()
+        for entry in failed:
+            attempts = entry["ledger"].get("attempts", 0) + 1
+            if attempts < self.settings["max_attempts"]:
+                retryable.add(id(entry))
+                entry["logs"].append(f"  > ℹ️ 次回の実行で再試行します。（{attempts}/{self.settings['max_attempts']}回目の失敗）")
+            else:
+                entry["logs"].append(f"  > ⚠️ 失敗が{attempts}回に達したため、再試行を打ち切ります。")
+        return retryable
+
 
 # ==============================================================================
-# 2. バッチ処理のメインロジック
+# 3. IMAP（UIDベースの差分同期）
 # ==============================================================================
 
+_UID_PATTERN = re.compile(rb'UID (\d+)')
+_SECTION_PATTERN = re.compile(rb'BODY\[([0-9.]+(?:\.MIME)?|HEADER)\]')
+_SIZE_PATTERN = re.compile(rb'RFC822\.SIZE (\d+)')
+_BODYSTRUCTURE_TOKEN = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+def connect_imap(secrets: dict, mailbox: str = 'inbox'):
+    """secrets の接続情報でIMAPサーバーにログインし、mailbox を選択した接続を返す。"""
+    server = secrets.get("EMAIL_SERVER")
+    port = secrets.get("EMAIL_PORT")
+    if secrets.get("EMAIL_USE_SSL", True):
+        mail = imaplib.IMAP4_SSL(server, port) if port else imaplib.IMAP4_SSL(server)
+    else:
+        mail = imaplib.IMAP4(server, port) if port else imaplib.IMAP4(server)
+    mail.login(secrets.get("EMAIL_USER"), secrets.get("EMAIL_PASSWORD"))
+    mail.select(mailbox)
+    return mail
+
+def _get_uidvalidity(mail) -> int | None:
+    _, data = mail.response('UIDVALIDITY')
+    try: return int(data[0]) if data and data[0] else None
+    except (TypeError, ValueError): return None
+
+
+def load_imap_sync_state(mailbox: str) -> dict | None:
+    """DBに保存された mailbox の UIDVALIDITY と処理済みの最終UIDを返す。未保存なら None。"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT uidvalidity, last_uid FROM imap_sync_state WHERE mailbox = %s", (mailbox,))
+            row = cursor.fetchone()
+        conn.commit()
+    return dict(row) if row else None
+
+def save_imap_sync_state(mailbox: str, uidvalidity: int, last_uid: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO imap_sync_state (mailbox, uidvalidity, last_uid, updated_at)
+                VALUES (%s, %s, %s, NOW())
+                ON CONFLICT (mailbox) DO UPDATE
+                SET uidvalidity = EXCLUDED.uidvalidity, last_uid = EXCLUDED.last_uid, updated_at = NOW()
+            """, (mailbox, uidvalidity, last_uid))
+        conn.commit()
+
+def compress_uid_set(uids) -> str:
+    """[1, 2, 3, 7, 9, 10] → '1:3,7,9:10' のように、UIDのリストをIMAPのシーケンスセット表記にまとめる。"""
+    ranges, sorted_uids = [], sorted(set(int(u) for u in uids))
+    for uid in sorted_uids:
+        if ranges and uid == ranges[-1][1] + 1: ranges[-1][1] = uid
+        else: ranges.append([uid, uid])
+    return ",".join(f"{a}" if a == b else f"{a}:{b}" for a, b in ranges)
+
+def _chunked(items: list, size: int):
+    for i in range(0, len(items), size): yield items[i:i + size]
+
+def search_new_uids(mail, last_uid: int) -> list:
+    """last_uid より大きいUIDを持つ未読メールのUIDを昇順で返す。"""
+    _, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*', 'UNSEEN')
+    # 'n:*' は該当が無くても最大UIDのメールを1件返す仕様のため、改めて絞り込む
+    return sorted(uid for uid in (int(x) for x in (data[0] or b'').split()) if uid > last_uid)
+
+def store_flags_bulk(mail, uids, flag: str, chunk_size: int = 500):
+    """UIDセット表記でまとめてフラグを設定する（chunk_size件ごとに1コマンド）。"""
+    uids = sorted(set(int(u) for u in uids))
+    for chunk in _chunked(uids, chunk_size):
+        mail.uid('STORE', compress_uid_set(chunk), '+FLAGS', f'({flag})')
+
+def _parse_bodystructure(text: str):
+    """BODYSTRUCTUREの括弧表記を、ネストしたリスト（NILはNone、文字列はstr）に変換する。"""
+    stack, current = [], []
+    for token in _BODYSTRUCTURE_TOKEN.findall(text):
+        if token == '(':
+            stack.append(current); current = []
+        elif token == ')':
+            finished, current = current, stack.pop()
+            current.append(finished)
+        elif token.startswith('"'):
+            current.append(token[1:-1].replace('\\"', '"').replace('\\\\', '\\'))
+        else:
+            current.append(None if token.upper() == 'NIL' else token)
+    return current[0] if current else None
+
+def _walk_bodystructure(node, section: str = ''):
+    """BODYSTRUCTUREの末端パートを (セクション番号, サイズ) で列挙する。"""
+    if isinstance(node, list) and node and isinstance(node[0], list):
+        # 先頭から続くリストだけが子パート（サブタイプ以降の拡張データは除外する）
+        children = []
+        for c in node:
+            if not isinstance(c, list): break
+            children.append(c)
+        for i, child in enumerate(children):
+            yield from _walk_bodystructure(child, f"{section}.{i + 1}" if section else f"{i + 1}")
+    elif isinstance(node, list):
+        try: size = int(node[6])
+        except (IndexError, TypeError, ValueError): size = 0
+        yield (section or '1'), size
+
+def _flatten_fetch_response(data) -> bytes:
+    # リテラル（{n}）で返された部分を引用文字列に戻して、1本のバイト列にまとめる
+    chunks = []
+    for part in data:
+        if isinstance(part, tuple):
+            head = re.sub(rb'\{\d+\}$', b'', part[0])
+            chunks.append(head + b'"' + part[1].replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"')
+        elif part: chunks.append(part)
+    return b''.join(chunks)
+
+def _fetch_message_without_large_parts(mail, uid: int, max_part_bytes: int):
+    """
+    BODYSTRUCTUREを先に取得し、max_part_bytes を超えるパートを除いた状態でメールを再構成する。
+    再構成できない場合は None を返す（呼び出し元で全体を取得する）。
+    """
+    _, data = mail.uid('FETCH', str(uid), '(BODYSTRUCTURE BODY.PEEK[HEADER])')
+    header_bytes = next((p[1] for p in data if isinstance(p, tuple) and b'BODY[HEADER]' in p[0]), None)
+    flat = _flatten_fetch_response([p for p in data if not (isinstance(p, tuple) and b'BODY[HEADER]' in p[0])])
+    start = flat.find(b'BODYSTRUCTURE ')
+    boundary = email.message_from_bytes(header_bytes).get_boundary() if header_bytes else None
+    if start == -1 or not boundary: return None
+    structure = _parse_bodystructure(flat[start + len(b'BODYSTRUCTURE '):].decode('utf-8', errors='ignore'))
+    leaves = list(_walk_bodystructure(structure))
+    kept = [section for section, size in leaves if size <= max_part_bytes]
+    skipped = [(section, size) for section, size in leaves if size > max_part_bytes]
+    for section, size in skipped:
+        print(f"  > ℹ️ UID {uid} のパート {section}（{size / 1024 / 1024:.1f}MB）はサイズ上限を超えるため取得をスキップします。")
+    if not kept: return header_bytes
+
+    items = " ".join(f"BODY.PEEK[{sec}.MIME] BODY.PEEK[{sec}]" for sec in kept)
+    _, data = mail.uid('FETCH', str(uid), f'({items})')
+    sections = {}
+    for part in data:
+        if isinstance(part, tuple) and (m := _SECTION_PATTERN.search(part[0])):
+            sections[m.group(1).decode()] = part[1]
+    body = b''.join(b'--' + boundary.encode() + b'\r\n' + sections.get(f"{sec}.MIME", b'\r\n') + sections.get(sec, b'') + b'\r\n' for sec in kept)
+    return header_bytes + body + b'--' + boundary.encode() + b'--\r\n'
+
+def fetch_messages_by_uid(mail, uids: list, batch_size: int = 25, max_part_bytes: int = 0):
+    """
+    UIDのリストを batch_size 件ずつ `UID FETCH a:b (UID BODY.PEEK[])` で取得し、(uid, RFC822バイト列) を順に返す。
+    PEEKのため取得しただけでは既読にならない。
+    max_part_bytes > 0 の場合は先に RFC822.SIZE を確認し、上限超過のメールだけ大きな添付を除いて取得する。
+    """
+    for chunk in _chunked(sorted(uids), batch_size):
+        uid_set = compress_uid_set(chunk)
+        large_uids = set()
+        if max_part_bytes > 0:
+            _, data = mail.uid('FETCH', uid_set, '(UID RFC822.SIZE)')
+            for part in data:
+                line = part[0] if isinstance(part, tuple) else part
+                if line and (u := _UID_PATTERN.search(line)) and (sz := _SIZE_PATTERN.search(line)) and int(sz.group(1)) > max_part_bytes:
+                    large_uids.add(int(u.group(1)))
+        small_uids = [uid for uid in chunk if uid not in large_uids]
+        if small_uids:
+            _, data = mail.uid('FETCH', compress_uid_set(small_uids), '(UID BODY.PEEK[])')
+            for part in data:
+                if isinstance(part, tuple) and (u := _UID_PATTERN.search(part[0])):
+                    yield int(u.group(1)), part[1]
+        for uid in sorted(large_uids):
+            raw = _fetch_message_without_large_parts(mail, uid, max_part_bytes)
+            if raw is None:
+                _, data = mail.uid('FETCH', str(uid), '(UID BODY.PEEK[])')
+                raw = next((p[1] for p in data if isinstance(p, tuple)), None)
+            if raw is not None: yield uid, raw
+
+
+# ==============================================================================
+# 4. バッチ処理のメインロジック
+# ==============================================================================
+
+def _handle_committed_results(mail, results: list, counters: dict):
+    """
+    コミット済み（または失敗確定）のメールのログを出力し、まとめてフラグを付ける。
+    BODY.PEEK[] で取得しているため、従来のRFC822取得と同様にチェック済みのメールは既読にし、
+    登録に成功したメールにだけ削除フラグを付ける。次回に再試行するメールは未読のまま残す。
+    """
+    if not results: return
+    checked_uids, processed_uids, flagged_identities = [], [], []
+    for result in results:
+        uid = result["key"]
+        counters["done"] += 1
+        print(f"\n--- ({counters['done']}/{counters['total']}) UID {uid} の処理結果 ---")
+        for log_line in result["logs"]: print(log_line)
+        if result.get("retryable"):
+            counters["retry"] += 1
+            continue
+        checked_uids.append(uid)
+        if result["success"]:
+            processed_uids.append(uid)
+            if result.get("ledger"): flagged_identities.append(result["ledger"])
+    counters["completed_uids"].extend(checked_uids)
+    store_flags_bulk(mail, checked_uids, '\\Seen')
+    if processed_uids:
+        counters["processed"] += len(processed_uids)
+        # 処理成功したメールを削除
+        store_flags_bulk(mail, processed_uids, '\\Deleted')
+        print(f"  > ✅ UID {compress_uid_set(processed_uids)} を削除マークしました。")
+        try:
+            ledger_mark_flagged(flagged_identities)
+        except Exception as e:
+            # persisted のままでも、次回は登録済みとしてフラグ付けだけをやり直すので処理は重複しない
+            print(f"  > ⚠️ 取り込み台帳のフラグ状態の更新に失敗しました: {e}")
+
+
+def _resume_from_ledger(pipeline, mail, mailbox: str, uidvalidity, fetched: list, settings: dict, counters: dict):
+    """
+    取得したメールを台帳に登録し、台帳の状態に応じて投入する。
+    登録済み・対象外（persisted / skipped / flagged）のメールはフラグ付けだけを行い、再試行の上限に達したメールは既読にして打ち切る。
+    """
+    identities = [(uid, ledger_identity(raw_bytes)) for uid, raw_bytes in fetched]
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            ledger_rows = ledger_register_fetched(cursor, mailbox, uidvalidity, identities)
+        conn.commit()
+
+    already_done, submitted = [], {}
+    for (uid, raw_bytes), (_, identity) in zip(fetched, identities):
+        key = (identity["message_id"], identity["content_hash"])
+        if key in submitted:
+            # 同じメールの2通目以降は台帳の行を共有する。処理は1通目に任せ、台帳には触れずに削除だけを行う
+            already_done.append({"key": uid, "success": True,
+                                 "logs": [f"  > ♻️ UID {submitted[key]} と同じメールが重複して届いたため、AI処理と登録を行わずに削除します。"]})
+            continue
+        submitted[key] = uid
+        row = ledger_rows.get(key, {})
+        ledger = {**identity, "attempts": row.get("attempts", 0), "analysis_json": row.get("analysis_json")}
+        status = row.get("status")
+        if status in _LEDGER_DONE_STATUSES:
+            counters["resumed"] += 1
+            already_done.append({"key": uid, "success": True, "ledger": ledger,
+                                 "logs": ["  > ℹ️ 前回の実行で登録済みのメールです。AI処理と登録を行わずにフラグだけを付けます。"]})
+        elif status == 'failed' and ledger["attempts"] >= settings["max_attempts"]:
+            already_done.append({"key": uid, "success": False, "ledger": ledger,
+                                 "logs": [f"  > ⚠️ 失敗が{ledger['attempts']}回に達しているため、処理をスキップします。"]})
+        else:
+            pipeline.submit(uid, raw_bytes, ledger=ledger)
+    _handle_committed_results(mail, already_done, counters)
+
+
+def reset_peak_rss():
+    """ピークRSS（VmHWM）を現在値に戻す。常駐プロセスでもバッチごとのピークを計れるようにする（Linuxのみ）。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f: f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    """このプロセスのピークRSS（MB）。添付抽出のワーカープロセスは含まない（RLIMIT_AS で個別に上限を設けている）。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位で返る
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _terminal_watermark(target_uids: list, completed_uids: list, last_uid: int) -> int:
+    """先頭から連続して処理が確定したUIDまでを、次回の開始位置にする（再試行するメールを追い越さない）。"""
+    completed = set(completed_uids)
+    watermark = last_uid
+    for uid in target_uids:
+        if uid not in completed: break
+        watermark = uid
+    return watermark
+
+
+def process_mailbox(mail, settings: dict, mailbox: str = 'inbox', extractor: AttachmentExtractor | None = None) -> dict:
+    """
+    選択済みのIMAP接続に対して、前回処理したUIDより新しい未読メールを取り込む。
+    UIDVALIDITY と最終UIDはDBに保存し、次回はその続きから処理する。処理件数などのカウンタを返す。
+    メールごとの処理段階は取り込み台帳（ingested_messages）に記録し、途中で落ちても次回は続きの段階から再開する。
+    """
+    FETCH_LIMIT = settings["fetch_limit"]
+    counters = {"total": 0, "done": 0, "processed": 0, "resumed": 0, "retry": 0, "completed_uids": []}
+
+    uidvalidity = _get_uidvalidity(mail)
+    state = load_imap_sync_state(mailbox)
+    last_uid = 0
+    if state and uidvalidity is not None and state["uidvalidity"] == uidvalidity:
+        last_uid = state["last_uid"]
+    elif state:
+        print(f"⚠️ UIDVALIDITY が変化しました（{state['uidvalidity']} → {uidvalidity}）。UIDを先頭から再同期します。")
+
+    new_uids = search_new_uids(mail, last_uid)
+    if not new_uids:
+        print("ℹ️ 処理対象の未読メールは見つかりませんでした。")
+        return counters
+
+    # 古い順に処理することで、最終UIDを取りこぼしなく進められる
+    target_uids = new_uids[:FETCH_LIMIT]
+    counters["total"] = len(target_uids)
+    print(f"ℹ️ 未読メール {counters['total']}件をチェックします。（UID {last_uid + 1} 以降 / 設定上限: {FETCH_LIMIT}件 / 残り: {len(new_uids) - len(target_uids)}件）")
+    print(f"ℹ️ 並列設定: 抽出プロセス {settings['extract_workers']} / LLM並列 {settings['llm_concurrency']} / キュー上限 {settings['queue_size']} / 保存バッチ {settings['persist_batch_size']}件 / 取得バッチ {settings['fetch_batch_size']}件")
+
+    started = time.monotonic()
+    reset_peak_rss()
+    pipeline = EmailIngestionPipeline(settings, extractor=extractor).start()
+    try:
+        fetched = []
+        for uid, raw_bytes in fetch_messages_by_uid(mail, target_uids, settings["fetch_batch_size"], settings["max_part_bytes"]):
+            fetched.append((uid, raw_bytes))
+            # 台帳への登録は取得バッチ単位でまとめて行う
+            if len(fetched) >= settings["fetch_batch_size"]:
+                _resume_from_ledger(pipeline, mail, mailbox, uidvalidity, fetched, settings, counters)
+                fetched = []
+            # 取得の合間に、コミット済みのメールへフラグを付けていく（IMAP接続はこのスレッドだけが使う）
+            _handle_committed_results(mail, pipeline.drain_committed(), counters)
+        _resume_from_ledger(pipeline, mail, mailbox, uidvalidity, fetched, settings, counters)
+    finally:
+        # 途中で例外が起きても、コミット済みのメールには必ずフラグを付け、同期状態を保存してから抜ける
+        pipeline.close()
+        _handle_committed_results(mail, pipeline.drain_committed(), counters)
+        watermark = _terminal_watermark(target_uids, counters["completed_uids"], last_uid)
+        if watermark > last_uid and uidvalidity is not None:
+            save_imap_sync_state(mailbox, uidvalidity, watermark)
+
+    elapsed = time.monotonic() - started
+    per_minute = counters["done"] / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"\n--- チェック完了 ---")
+    print(f"▶︎ 処理済みメール: {counters['processed']}件（うち前回の続き {counters['resumed']}件） / 再試行待ち: {counters['retry']}件 / チェックしたメール: {counters['total']}件")
+    print(f"▶︎ 所要時間: {elapsed:.1f}秒（{per_minute:.1f}通/分）")
+    print(f"▶︎ ピークメモリ（RSS）: {peak_rss_mb():.1f}MB")
+    ex_stats = pipeline.extractor_stats
+    print(f"▶︎ 添付抽出（累計）: 抽出 {ex_stats['extracted']}件 / キャッシュ利用 {ex_stats['cache_hits']}件 / タイムアウト {ex_stats['timeouts']}件 / サイズ超過 {ex_stats['skipped_too_large']}件")
+
+    # 削除マークされたメールを物理的に削除
+    if counters["processed"] > 0:
+        mail.expunge()
+        print(f"  > ✅ {counters['processed']}件のメールを物理的に削除しました。")
+    return counters
+
+
+def delete_seen_messages(mail, mailbox: str = 'inbox'):
+    """
+    既読メールのうち、取り込み台帳で登録済み・対象外（persisted / skipped / flagged）のものだけを削除する。
+    人が既読にしただけのメールや、再試行を打ち切ったメールは残す。
+    """
+    print(f"\n--- 既読メールの削除処理を開始 ---")
+    try:
+        _, seen_messages = mail.uid('SEARCH', None, 'SEEN')
+        seen_uids = [int(x) for x in (seen_messages[0] or b'').split()]
+        
+        if not seen_uids:
+            print("ℹ️ 削除対象の既読メールはありません。")
+            return
+        uidvalidity = _get_uidvalidity(mail)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT DISTINCT uid FROM ingested_messages
+                    WHERE mailbox = %s AND uidvalidity = %s AND uid = ANY(%s) AND status IN %s
+                """, (mailbox, uidvalidity, seen_uids, _LEDGER_DONE_STATUSES))
+                done_uids = [row['uid'] for row in cursor.fetchall()]
+            conn.commit()
+
+        if not done_uids:
+            print(f"ℹ️ 既読メール {len(seen_uids)}件のうち、登録済みのものはありません。")
+            return
+        print(f"ℹ️ 既読メール {len(seen_uids)}件のうち、登録済みの {len(done_uids)}件を削除マークします...")
+        store_flags_bulk(mail, done_uids, '\\Deleted')
+        
+        # 物理的に削除
+        mail.expunge()
+        print(f"  > ✅ {len(done_uids)}件の既読メールを削除しました。（未処理の {len(seen_uids) - len(done_uids)}件は残しています）")
+    except Exception as e:
+        print(f"⚠️ 既読メールの削除中にエラーが発生しました: {e}")
+
+
 def fetch_and_process_emails_batch():
     mail = None
     try:
         secrets, config = load_secrets(), load_app_config()
         if not secrets: return
+        if not require_current_schema(): return
         configure_genai()
-        FETCH_LIMIT = config.get("email_processing", {}).get("fetch_limit", 10)
-        SERVER, USER, PASSWORD = secrets.get("EMAIL_SERVER"), secrets.get("EMAIL_USER"), secrets.get("EMAIL_PASSWORD")
-        if not all([SERVER, USER, PASSWORD]):
+        settings = load_pipeline_settings(config)
+        if not all([secrets.get("EMAIL_SERVER"), secrets.get("EMAIL_USER"), secrets.get("EMAIL_PASSWORD")]):
             print("❌ メールサーバーの接続情報が secrets.toml に設定されていません。")
             return
         
         try:
-            mail = imaplib.IMAP4_SSL(SERVER)
-            mail.login(USER, PASSWORD)
-            mail.select('inbox')
+            mail = connect_imap(secrets)
             print("✅ メールサーバーへの接続完了")
         except Exception as e:
             print(f"❌ メールサーバーへの接続またはログインに失敗: {e}")
             return
 
-        _, messages = mail.search(None, 'UNSEEN')
-        email_ids = messages[0].split()
-        
-        if not email_ids:
-            print("ℹ️ 処理対象の未読メールは見つかりませんでした。")
-        else:
-            latest_ids = email_ids[::-1][:FETCH_LIMIT]
-            checked_count, total_processed_count = len(latest_ids), 0
-            print(f"ℹ️ 最新の未読メール {checked_count}件をチェックします。（設定上限: {FETCH_LIMIT}件）")
-
-            for i, email_id in enumerate(latest_ids):
-                print(f"\n--- ({i+1}/{checked_count}) メールID {email_id.decode()} を処理中 ---")
-                _, msg_data = mail.fetch(email_id, '(RFC822)')
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        source_data = get_email_contents(msg)
-                        success, logs = process_single_email_core(source_data)
-                        for log_line in logs: print(log_line)
-                        if success:
-                            total_processed_count += 1
-                            # 処理成功したメールを削除
-                            mail.store(email_id, '+FLAGS', '\\Deleted')
-                            print(f"  > ✅ メールID {email_id.decode()} を削除マークしました。")
-            
-            print(f"\n--- チェック完了 ---")
-            print(f"▶︎ 処理済みメール: {total_processed_count}件 / チェックしたメール: {checked_count}件")
-            
-            # 削除マークされたメールを物理的に削除
-            if total_processed_count > 0:
-                mail.expunge()
-                print(f"  > ✅ {total_processed_count}件のメールを物理的に削除しました。")
+        process_mailbox(mail, settings)
         
         # 既読メール全体を削除する処理
-        print(f"\n--- 既読メールの削除処理を開始 ---")
-        try:
-            _, seen_messages = mail.search(None, 'SEEN')
-            seen_email_ids = seen_messages[0].split()
-            
-            if not seen_email_ids:
-                print("ℹ️ 削除対象の既読メールはありません。")
-            else:
-                seen_count = len(seen_email_ids)
-                print(f"ℹ️ 既読メール {seen_count}件を削除マークします...")
-                
-                # 全ての既読メールに削除フラグを設定
-                for email_id in seen_email_ids:
-                    mail.store(email_id, '+FLAGS', '\\Deleted')
-                
-                # 物理的に削除
-                mail.expunge()
-                print(f"  > ✅ {seen_count}件の既読メールを削除しました。")
-        except Exception as e:
-            print(f"⚠️ 既読メールの削除中にエラーが発生しました: {e}")
+        delete_seen_messages(mail)
 
     except Exception as e:
         print(f"❌ メール処理全体で予期せぬエラーが発生しました: {e}")
@@ -666,7 +1614,7 @@ def fetch_and_process_emails_batch():
             print("ℹ️ メールサーバーから切断しました。")
 
 # ==============================================================================
-# 3. スクリプトのエントリーポイント
+# 5. スクリプトのエントリーポイント
 # ==============================================================================
 
 def main():
@@ -0,0 +1,199 @@
+# ==============================================================================
+# run_email_replay.py
+# ==============================================================================
+# 保存済みのメール（.eml ファイルのディレクトリ、または mbox ファイル）を、
+# IMAPを介さずに run_email_processor と同じ get_email_contents → process_single_email_core の経路で取り込む。
+# 過去メールのバックフィルと、メールサーバー無しでの取り込み性能の計測に使う。
+#
+# 使い方:
+#   python run_email_replay.py archive/2024-05/                     # .eml を再帰的に探して取り込む
+#   python run_email_replay.py backup.mbox --limit 500 --concurrency 8
+#   python run_email_replay.py samples/ --dry-run --stub-llm --stub-latency 0.8
+#                                         # DBにもAIにも触れずに、パイプラインのスループットだけを計測する
+#
+# --dry-run  : DBに接続しない（重複検知・登録・添付抽出のDBキャッシュを使わず、AI処理の結果だけを表示する）
+# --stub-llm : Gemini を呼ばず、本文から決まった形の結果を返すスタブに差し替える（--stub-latency 秒だけ待つ）
+# ==============================================================================
+
+import argparse
+import mailbox
+import os
+import re
+import statistics
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email import message_from_bytes
+
+import run_email_processor as core
+from attachment_extractor import AttachmentExtractor
+
+
+# ==============================================================================
+# 1. メールの読み込み
+# ==============================================================================
+
+def iter_raw_messages(paths: list):
+    """パスごとに (ラベル, RFC822のバイト列) を順に返す。ディレクトリは .eml を再帰的に、それ以外は mbox として読む。"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if not name.lower().endswith(".eml"): continue
+                    file_path = os.path.join(root, name)
+                    with open(file_path, "rb") as f:
+                        yield file_path, f.read()
+        elif path.lower().endswith(".eml"):
+            with open(path, "rb") as f:
+                yield path, f.read()
+        else:
+            box = mailbox.mbox(path, create=False)
+            try:
+                for index, key in enumerate(box.iterkeys()):
+                    yield f"{path}#{index + 1}", box.get_bytes(key)
+            finally:
+                box.close()
+
+
+# ==============================================================================
+# 2. LLM のスタブ
+# ==============================================================================
+
+_ENGINEER_HINT = re.compile(r'技術者|要員|スキルシート|経歴書|氏名')
+_SKILL_TOKEN = re.compile(r'[A-Za-z][A-Za-z0-9#+.]{1,20}')
+
+def install_llm_stub(latency: float = 0.0):
+    """
+    分類・構造化とキーワード抽出を、本文から機械的に結果を作るスタブに差し替える。
+    latency 秒の待ちを入れることで、API呼び出しの待ち時間を含めた並列度の効果を再現できる。
+    """
+    def split_text_stub(text_content: str):
+        if latency: time.sleep(latency)
+        document = text_content[:3000]
+        if _ENGINEER_HINT.search(text_content):
+            return {"jobs": [], "engineers": [{"name": "スタブ技術者", "document": document}]}, ["  > ℹ️ [stub] ENGINEER_INFO として扱います。"]
+        return {"jobs": [{"project_name": "スタブ案件", "document": document}], "engineers": []}, ["  > ℹ️ [stub] PROJECT_INFO として扱います。"]
+
+    def extract_keywords_stub(text_content: str, item_type: str, count: int = 20) -> list:
+        if latency: time.sleep(latency)
+        keywords = []
+        for token in _SKILL_TOKEN.findall(text_content):
+            token = token.lower()
+            if token not in keywords: keywords.append(token)
+            if len(keywords) >= count: break
+        return keywords
+
+    core.split_text_with_llm = split_text_stub
+    core.extract_keywords_with_llm = extract_keywords_stub
+
+
+# ==============================================================================
+# 3. 取り込み
+# ==============================================================================
+
+def replay_one(label: str, raw_bytes: bytes, extractor, dry_run: bool) -> dict:
+    started = time.perf_counter()
+    try:
+        source_data = core.get_email_contents(message_from_bytes(raw_bytes), extractor=extractor)
+        if dry_run:
+            analysis, logs = core.analyze_email_content(source_data)
+            success = analysis is not None
+            if analysis:
+                logs += [f"  > ℹ️ [dry-run] {core._ITEM_TABLES[item['item_type']]['label']}『{item['name']}』（キーワード {len(item['keywords'])}件）" for item in analysis["items"]]
+        else:
+            success, logs = core.process_single_email_core(source_data)
+    except Exception as e:
+        success, logs = False, [f"❌ 予期せぬエラーが発生: {e}", traceback.format_exc()]
+    return {"label": label, "success": success, "logs": logs, "elapsed": time.perf_counter() - started}
+
+
+def _percentile(values: list, ratio: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def replay(paths: list, concurrency: int, extractor, dry_run: bool, limit: int | None, quiet: bool) -> dict:
+    results, print_lock = [], threading.Lock()
+    started = time.perf_counter()
+
+    def run(label, raw_bytes):
+        result = replay_one(label, raw_bytes, extractor, dry_run)
+        with print_lock:
+            results.append(result)
+            mark = "✅" if result["success"] else "❌"
+            print(f"{mark} ({len(results)}) {label}（{result['elapsed']:.2f}秒）")
+            if not quiet or not result["success"]:
+                for log_line in result["logs"]: print(log_line)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for index, (label, raw_bytes) in enumerate(iter_raw_messages(paths)):
+            if limit is not None and index >= limit: break
+            futures.append(executor.submit(run, label, raw_bytes))
+            # 巨大な mbox を読み込み切ってしまわないよう、投入済みが並列度の数倍に達したら待つ
+            while sum(1 for f in futures if not f.done()) >= concurrency * 4:
+                time.sleep(0.05)
+        for future in futures: future.result()
+
+    elapsed = time.perf_counter() - started
+    latencies = [r["elapsed"] for r in results]
+    return {
+        "total": len(results),
+        "succeeded": sum(1 for r in results if r["success"]),
+        "elapsed": elapsed,
+        "per_minute": len(results) / elapsed * 60 if elapsed > 0 else 0.0,
+        "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+        "latency_p95": _percentile(latencies, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=".eml / mbox のメールを run_email_processor と同じ経路で取り込む")
+    parser.add_argument("paths", nargs="+", help=".eml ファイル、.eml を含むディレクトリ、または mbox ファイル")
+    parser.add_argument("--concurrency", type=int, help="同時に処理するメール数（既定: [email_processing] の llm_concurrency）")
+    parser.add_argument("--extract-workers", type=int, help="添付ファイル抽出のプロセス数（既定: [email_processing] の extract_workers）")
+    parser.add_argument("--limit", type=int, help="取り込むメールの最大件数")
+    parser.add_argument("--dry-run", action="store_true", help="DBに接続せず、AI処理の結果だけを表示する")
+    parser.add_argument("--stub-llm", action="store_true", help="Gemini を呼ばずにスタブの結果を使う")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="スタブが1回の呼び出しごとに待つ秒数")
+    parser.add_argument("--quiet", action="store_true", help="成功したメールのログを表示しない")
+    args = parser.parse_args()
+
+    settings = core.load_pipeline_settings(core.load_app_config())
+    concurrency = max(1, args.concurrency or settings["llm_concurrency"])
+    extract_workers = max(1, args.extract_workers or settings["extract_workers"])
+
+    if not args.dry_run and not core.require_current_schema(): return
+
+    if args.stub_llm:
+        install_llm_stub(args.stub_latency)
+    else:
+        core.configure_genai()
+
+    # dry-run では添付抽出のキャッシュもDBに保存しない
+    persistent_cache = None if args.dry_run else core.DbAttachmentTextCache()
+    extractor = AttachmentExtractor(settings["extraction_limits"], workers=extract_workers, persistent_cache=persistent_cache)
+
+    mode = "（dry-run）" if args.dry_run else ""
+    print(f"--- [ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ] メールの再取り込みを開始します{mode} ---")
+    print(f"ℹ️ 並列数 {concurrency} / 抽出プロセス {extract_workers} / LLM: {'スタブ（待ち ' + str(args.stub_latency) + '秒）' if args.stub_llm else 'Gemini'}")
+    core.reset_peak_rss()
+    try:
+        summary = replay(args.paths, concurrency, extractor, args.dry_run, args.limit, args.quiet)
+    finally:
+        extractor.close()
+
+    print(f"\n--- 再取り込み完了 ---")
+    print(f"▶︎ 成功: {summary['succeeded']}件 / 処理したメール: {summary['total']}件")
+    print(f"▶︎ 所要時間: {summary['elapsed']:.1f}秒（{summary['per_minute']:.1f}通/分）")
+    print(f"▶︎ 1通あたり: 平均 {summary['latency_mean']:.2f}秒 / p95 {summary['latency_p95']:.2f}秒")
+    print(f"▶︎ ピークメモリ（RSS）: {core.peak_rss_mb():.1f}MB")
+    ex_stats = extractor.stats
+    print(f"▶︎ 添付抽出: 抽出 {ex_stats['extracted']}件 / キャッシュ利用 {ex_stats['cache_hits']}件 / タイムアウト {ex_stats['timeouts']}件 / サイズ超過 {ex_stats['skipped_too_large']}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# ==============================================================================
+# run_kpi_refresh.py
+# ==============================================================================
+# ライブダッシュボードの KPI 集計テーブル（migrations/004_kpi_rollups.sql）を更新する。
+# 通常は、トリガーが kpi_deltas に記録した増減を集計テーブルへ反映するだけ（ダッシュボードを誰も開いていない間も
+# kpi_deltas が溜まらないように、cron から定期的に実行する）。
+# トリガーを通らない一括投入・削除などで集計がずれた場合は --rebuild で元テーブルから作り直す。
+# 作り直しの間は元テーブルへの書き込みが待たされるため、取り込みバッチが動いていない時間に実行すること。
+#
+# 使い方:
+#   python run_kpi_refresh.py             # 未反映の増減を集計テーブルへ反映する
+#   python run_kpi_refresh.py --rebuild   # 集計テーブルを元テーブルから作り直す
+# ==============================================================================
+
+import argparse
+import sys
+import time
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import DictCursor
+
+import run_migrations
+
+
+def fold(conn) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT kpi_fold() AS folded")
+        folded = cursor.fetchone()['folded']
+    conn.commit()
+    return folded
+
+def rebuild(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT kpi_rebuild()")
+    conn.commit()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ライブダッシュボードの KPI 集計テーブルを更新する")
+    parser.add_argument("--rebuild", action="store_true", help="集計テーブルを元テーブルから作り直す")
+    args = parser.parse_args()
+
+    print(f"--- [ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ] KPI集計の更新を開始します ---")
+    db_url = run_migrations.get_db_url_from_secrets()
+    if not db_url: return 1
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        pending = run_migrations.pending_migrations(conn)
+        if pending:
+            print(f"❌ データベースに未適用のマイグレーションがあります（{', '.join(m['filename'] for m in pending)}）。先に `python run_migrations.py` を実行してください。")
+            return 1
+        started = time.perf_counter()
+        if args.rebuild:
+            rebuild(conn)
+            print(f"✅ KPI集計テーブルを作り直しました（{time.perf_counter() - started:.1f}秒）")
+        else:
+            folded = fold(conn)
+            print(f"✅ {folded}件の増減を集計テーブルへ反映しました（{time.perf_counter() - started:.2f}秒）")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ KPI集計の更新に失敗しました: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# ==============================================================================
+# run_matching_worker.py
+# ==============================================================================
+# 再マッチングのキュー（migrations/009_matching_queue.sql の jobs_queue）を処理する常駐プロセス。
+# 画面（案件詳細・技術者詳細）は「AIマッチングを実行する」でタスクを登録して進捗を読むだけになり、
+# 実際の処理（backend.rematch_*_with_keyword_filtering）はこのワーカーが行う。
+# そのため、ブラウザのタブを閉じても処理は途中で止まらず、複数の再マッチングを並行して実行できる。
+# タスクは SELECT ... FOR UPDATE SKIP LOCKED で取り出すため、ワーカーは同じマシン・別のマシンで
+# いくつ起動してもよい（台数を増やすと、同時に処理できる件数が増える）。
+#
+# backend.py を読み込むため、プロジェクトのルート（.streamlit/secrets.toml がある場所）で実行する。
+#
+# 使い方:
+#   python run_matching_worker.py              # 常駐してタスクを処理する
+#   python run_matching_worker.py --once       # 実行できるタスクが無くなったら終了する（通知は待たない）
+#
+# SIGTERM / SIGINT を受けると、実行中のタスクを完了させてから終了する。
+#
+# ワーカーは migrations/010_change_notifications.sql の通知を LISTEN して待つ。
+#   jobs_queue     タスクが登録されたら、すぐに取り出す（画面からの再マッチングを待たせない）
+#   item_changes   案件・技術者が登録されたら自動マッチング（auto_match）を、マッチング結果などが変わったら
+#                  KPI集計の反映（kpi_fold）をキューに登録する。cron の次の実行を待たずに、数秒以内に処理が始まる
+# 通知を取りこぼした場合や、再試行の待ち時間が明けたタスクのために、poll_interval_seconds ごとにもキューを確認する。
+# ==============================================================================
+
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+import psycopg2
+import toml
+from psycopg2.extras import DictCursor
+
+import matching_queue
+import run_auto_matcher
+import run_kpi_refresh
+import run_migrations
+
+_SHUTDOWN = threading.Event()
+
+DEFAULT_WORKER_SETTINGS = {
+    "poll_interval_seconds": 30,
+    "stale_seconds": 600,
+}
+
+# LISTEN するチャンネル（migrations/010_change_notifications.sql）
+LISTEN_CHANNELS = ("jobs_queue", "item_changes")
+
+
+def log(message: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def _request_shutdown(signum, frame):
+    log(f"ℹ️ シグナル {signal.Signals(signum).name} を受信しました。実行中のタスクを完了してから終了します。")
+    _SHUTDOWN.set()
+
+
+def load_worker_settings() -> dict:
+    settings = dict(DEFAULT_WORKER_SETTINGS)
+    try:
+        with open("config.toml", "r", encoding="utf-8") as f:
+            settings.update(toml.load(f).get("matching_worker", {}))
+    except FileNotFoundError:
+        pass
+    return settings
+
+
+# ==============================================================================
+# 1. タスクの種類ごとの処理
+# ==============================================================================
+# payload から、進捗のメッセージを yield し、最後に実行結果（matching_queue.TaskResult）を return するジェネレータを作る
+
+def kpi_fold_task(db_url: str):
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        message = f"✅ KPI集計に {run_kpi_refresh.fold(conn)}件の増減を反映しました。"
+        yield message
+        return matching_queue.TaskResult(True, message)
+    finally:
+        conn.close()
+
+
+def task_handlers(be, db_url: str) -> dict:
+    return {
+        'rematch_job': lambda payload: be.rematch_job_with_keyword_filtering(
+            job_id=payload['job_id'], target_rank=payload['target_rank'], target_count=payload['target_count'],
+            reevaluate_all=payload.get('reevaluate_all', False)),
+        'rematch_engineer': lambda payload: be.rematch_engineer_with_keyword_filtering(
+            engineer_id=payload['engineer_id'], target_rank=payload['target_rank'], target_count=payload['target_count'],
+            reevaluate_all=payload.get('reevaluate_all', False)),
+        'auto_match': lambda payload: run_auto_matcher.run_auto_match_task(db_url, be),
+        'kpi_fold': lambda payload: kpi_fold_task(db_url),
+    }
+
+
+def run_task(conn, task, handler) -> str:
+    """
+    タスクを1件実行し、進捗を jobs_queue_progress に書きながら最後まで（またはキャンセルまで）進める。新しい状態を返す。
+    成功・失敗は、ジェネレータが return した TaskResult で決める（進捗のメッセージの内容では判断しない）。
+    """
+    generator = handler(task['payload'])
+    result, cancelled = None, False
+    try:
+        while True:
+            try:
+                message = next(generator)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            if matching_queue.report_progress(conn, task, str(message)):
+                cancelled = True
+                break
+    except Exception as e:
+        matching_queue.report_progress(conn, task, f"❌ ワーカーでエラーが発生しました: {e}")
+        return matching_queue.finish(conn, task, False, error=traceback.format_exc())
+    finally:
+        # キャンセル時は、ジェネレータの finally で接続がプールへ返され、未コミットの変更は破棄される
+        generator.close()
+
+    if cancelled:
+        matching_queue.report_progress(conn, task, "⏹️ キャンセルされたため、処理を中断しました（変更は保存していません）。")
+        return matching_queue.finish(conn, task, False, message="キャンセルされました")
+    if not isinstance(result, matching_queue.TaskResult):
+        result = matching_queue.TaskResult(False, f"タスクの処理が実行結果を返しませんでした（{result!r}）")
+    if result.defer_seconds is not None:
+        return matching_queue.defer(conn, task, result.defer_seconds, message=result.message)
+    return matching_queue.finish(conn, task, result.succeeded, message=result.message,
+                                 error=None if result.succeeded else result.message, retryable=result.retryable)
+
+
+# ==============================================================================
+# 2. 変更の通知（LISTEN / NOTIFY）
+# ==============================================================================
+# 通知から登録するタスクは、種類ごとに dedup_key を1つにする（通知が続けて届いても、待ちのタスクは1つにまとまる）
+
+def wakeups_for(notify) -> set:
+    """通知1件から、キューに登録するタスクの種類を返す。"""
+    if notify.channel != "item_changes": return set()
+    try:
+        change = json.loads(notify.payload)
+    except ValueError:
+        return set()
+    wakeups = {'kpi_fold'}
+    # 自動マッチングは「最後に処理したID」より後の行だけを見るため、登録のときだけ起こす
+    if change.get('table') in ('jobs', 'engineers') and change.get('op') == 'INSERT':
+        wakeups.add('auto_match')
+    return wakeups
+
+
+def listen(conn):
+    with conn.cursor() as cursor:
+        for channel in LISTEN_CHANNELS:
+            cursor.execute(f"LISTEN {channel}")
+    conn.commit()
+
+
+def wait_for_notifications(conn, timeout: float):
+    """通知が届くか、timeout 秒が経つか、終了の合図があるまで待つ（終了の合図に1秒以内に気付けるよう、細かく区切って待つ）。"""
+    deadline = time.monotonic() + timeout
+    while not conn.notifies and not _SHUTDOWN.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0: return
+        if select.select([conn], [], [], min(remaining, 1.0))[0]:
+            conn.poll()
+
+
+def enqueue_wakeups(conn, wakeups: set) -> set:
+    """
+    通知から決まったタスクを登録し、まだ登録できていないものを返す。
+    同じ種類のタスクが実行中の場合、そのタスクは今回の変更を読む前に始まっている可能性があるため、
+    実行中のタスクが終わって新しく待ちにできるまで、次のループで登録し直す。
+    """
+    remaining = set()
+    for task_type in wakeups:
+        task_id, created = matching_queue.enqueue(conn, task_type, {}, dedup_key=task_type, requested_by="listener")
+        if not created and (task := matching_queue.get_task(conn, task_id)) and task['status'] == 'running':
+            remaining.add(task_type)
+    conn.commit()
+    return remaining
+
+
+# ==============================================================================
+# 3. 常駐ループ
+# ==============================================================================
+
+def serve(db_url: str, handlers: dict, settings: dict, worker_id: str, run_once: bool = False):
+    conn, backoff, wakeups = None, 1, set()
+    while not _SHUTDOWN.is_set():
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+                listen(conn)
+                backoff = 1
+            while conn.notifies:
+                wakeups |= wakeups_for(conn.notifies.pop(0))
+            if wakeups:
+                wakeups = enqueue_wakeups(conn, wakeups & handlers.keys())
+
+            requeued = matching_queue.requeue_stale(conn, int(settings["stale_seconds"]))
+            if requeued: log(f"⚠️ 応答が途絶えたワーカーのタスク {requeued}件を、待ちに戻しました。")
+
+            task = matching_queue.claim(conn, worker_id, handlers.keys())
+            if task is None:
+                if run_once: break
+                # 登録し直すタスクが残っている間は、実行中のタスクが終わるのを短い間隔で確かめる
+                wait_for_notifications(conn, 1.0 if wakeups else float(settings["poll_interval_seconds"]))
+                continue
+
+            log(f"▶️ タスク #{task['id']}（{task['task_type']}、{task['attempts']}回目）を開始します: {task['payload']}")
+            started = time.perf_counter()
+            status = run_task(conn, task, handlers[task['task_type']])
+            log(f"{'✅' if status == 'succeeded' else 'ℹ️'} タスク #{task['id']}: {status}（{time.perf_counter() - started:.1f}秒）")
+        except psycopg2.Error as e:
+            log(f"❌ キューの操作中にデータベースエラーが発生しました: {e}（{backoff}秒後に再接続します）")
+            if conn is not None and not conn.closed: conn.close()
+            conn = None
+            _SHUTDOWN.wait(backoff)
+            backoff = min(backoff * 2, 60)
+    if conn is not None and not conn.closed: conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="再マッチングのキュー（jobs_queue）を処理する常駐プロセス")
+    parser.add_argument("--once", action="store_true", help="実行できるタスクが無くなったら終了する")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}:{os.getpid()}", help="キューに記録するワーカー名")
+    args = parser.parse_args()
+
+    db_url = run_migrations.get_db_url_from_secrets()
+    if not db_url: return 1
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        pending = run_migrations.pending_migrations(conn)
+    finally:
+        conn.close()
+    if pending:
+        print(f"❌ データベースに未適用のマイグレーションがあります（{', '.join(m['filename'] for m in pending)}）。先に `python run_migrations.py` を実行してください。")
+        return 1
+
+    signal.signal(signal.SIGTERM, _request_shutdown)
+    signal.signal(signal.SIGINT, _request_shutdown)
+
+    import backend as be  # 埋め込みモデル・LLM の設定を読み込むため、起動確認が済んでから読み込む
+    log(f"--- マッチングワーカー {args.worker_id} を開始します ---")
+    serve(db_url, task_handlers(be, db_url), load_worker_settings(), args.worker_id, run_once=args.once)
+    log(f"--- マッチングワーカー {args.worker_id} を終了しました ---")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
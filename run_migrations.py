@@ -0,0 +1,222 @@
+# ==============================================================================
+# run_migrations.py
+# ==============================================================================
+# migrations/ ディレクトリの SQL ファイルを、番号順に未適用のものだけ適用する。
+# 適用済みの番号は schema_migrations テーブルに記録する。
+#
+# ファイル名は「<3桁以上の番号>_<名前>.sql」。1ファイルは1トランザクションで適用する。
+# 先頭行に「-- migrate: no-transaction」と書いたファイルは、CREATE INDEX CONCURRENTLY のように
+# トランザクション内で実行できない文のために、1文ずつ自動コミットで実行する
+# （この形式のファイルでは、文の終わりの「;」を行末に置き、関数定義（$$ ... $$）は書かないこと）。
+#
+# アプリ（backend.init_database）と取り込みバッチ（run_email_processor）は起動時に pending_migrations() で
+# 未適用のものが無いかを1回確認するだけで、スキーマの変更はこのスクリプトでのみ行う。
+#
+# 使い方:
+#   python run_migrations.py             # 未適用のマイグレーションを適用する
+#   python run_migrations.py --status    # 適用済み・未適用の一覧を表示する
+#   python run_migrations.py --dry-run   # 適用予定のファイルと文を表示するだけで、実行しない
+# ==============================================================================
+
+import argparse
+import os
+import re
+import sys
+import toml
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import DictCursor
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+MIGRATIONS_DIR = os.path.join(project_root, "migrations")
+
+_FILENAME = re.compile(r'^(\d{3,})_([\w-]+)\.sql$')
+_NO_TRANSACTION = re.compile(r'^--\s*migrate:\s*no-transaction\s*$', re.MULTILINE)
+# 複数の runner が同時に動いたときに、同じマイグレーションを二重に適用しないためのロックキー
+_ADVISORY_LOCK_KEY = 20240701
+
+
+def get_db_url_from_secrets() -> str | None:
+    try:
+        secrets = toml.load(os.path.join(project_root, '.streamlit', 'secrets.toml'))
+        db_url = secrets.get("DATABASE_URL")
+        if not db_url: raise ValueError("DATABASE_URLがsecrets.tomlに見つかりません。")
+        return db_url
+    except Exception as e:
+        print(f"❌ secrets.toml の読み込みに失敗しました: {e}")
+        return None
+
+
+# ==============================================================================
+# 1. マイグレーションファイルの読み込み
+# ==============================================================================
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> list:
+    """migrations/ の SQL ファイルを番号順に返す。番号の重複はエラーにする。"""
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if not match: continue
+        version = int(match.group(1))
+        if version in migrations: raise ValueError(f"マイグレーション番号 {version} が重複しています: {migrations[version]['filename']} / {filename}")
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f: sql = f.read()
+        migrations[version] = {"version": version, "name": match.group(2), "filename": filename, "sql": sql,
+                               "transactional": not _NO_TRANSACTION.search(sql)}
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def split_statements(sql: str) -> list:
+    """no-transaction のファイルを1文ずつに分ける。行末の「;」を文の区切りとし、コメントだけの断片は除く。"""
+    statements, current = [], []
+    for line in sql.splitlines():
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current))
+            current = []
+    if current: statements.append("\n".join(current))
+    return [s.strip() for s in statements if any(l.strip() and not l.strip().startswith("--") for l in s.splitlines())]
+
+
+# ==============================================================================
+# 2. 適用
+# ==============================================================================
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """)
+
+def applied_versions(cursor) -> set:
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def pending_migrations(conn, migrations: list | None = None) -> list:
+    """
+    未適用のマイグレーションを返す。起動時のバージョン確認用で、schema_migrations を1回読むだけ。
+    schema_migrations が無い（一度も実行していない）場合は、すべてを未適用として返す。
+    """
+    migrations = load_migrations() if migrations is None else migrations
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS ready")
+        done = applied_versions(cursor) if cursor.fetchone()['ready'] else set()
+    if not conn.autocommit: conn.commit()
+    return [m for m in migrations if m["version"] not in done]
+
+
+def apply_migration(conn, migration: dict):
+    if migration["transactional"]:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(migration["sql"])
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (migration["version"], migration["name"]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return
+
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        for statement in split_statements(migration["sql"]):
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (migration["version"], migration["name"]))
+
+
+def migrate(conn, migrations: list) -> int:
+    """未適用のマイグレーションを番号順に適用し、適用した件数を返す。失敗したらそこで止める。"""
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (_ADVISORY_LOCK_KEY,))
+    try:
+        with conn.cursor() as cursor:
+            ensure_migrations_table(cursor)
+            done = applied_versions(cursor)
+        pending = [m for m in migrations if m["version"] not in done]
+        if not pending:
+            print("ℹ️ 適用待ちのマイグレーションはありません。")
+            return 0
+        for migration in pending:
+            print(f"  > {migration['filename']} を適用中...{'' if migration['transactional'] else '（トランザクション外）'}")
+            try:
+                apply_migration(conn, migration)
+            except psycopg2.Error as e:
+                print(f"❌ {migration['filename']} の適用に失敗しました: {e}")
+                if not migration["transactional"]:
+                    print("⚠️ このマイグレーションはトランザクション外で実行されるため、途中まで適用されています。作成途中で INVALID になったインデックスがあれば DROP INDEX してから再実行してください。")
+                raise
+            print(f"  > ✅ {migration['filename']} を適用しました。")
+        return len(pending)
+    finally:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (_ADVISORY_LOCK_KEY,))
+
+
+def print_status(conn, migrations: list):
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS ready")
+        applied = {}
+        if cursor.fetchone()['ready']:
+            cursor.execute("SELECT version, applied_at FROM schema_migrations")
+            applied = {row['version']: row['applied_at'] for row in cursor.fetchall()}
+    for migration in migrations:
+        applied_at = applied.get(migration["version"])
+        mark = f"✅ 適用済み（{applied_at:%Y-%m-%d %H:%M}）" if applied_at else "⏳ 未適用"
+        print(f"  {migration['filename']:<40} {mark}")
+    unknown = sorted(set(applied) - {m["version"] for m in migrations})
+    if unknown: print(f"⚠️ migrations/ に無い番号が適用済みとして記録されています: {unknown}")
+
+
+def print_dry_run(conn, migrations: list):
+    pending = pending_migrations(conn, migrations)
+    if not pending:
+        print("ℹ️ 適用待ちのマイグレーションはありません。")
+        return
+    for migration in pending:
+        statements = split_statements(migration["sql"])
+        print(f"  > {migration['filename']}（{len(statements)}文{'、1トランザクション' if migration['transactional'] else '、トランザクション外'}）")
+        for statement in statements:
+            first_line = next(l.strip() for l in statement.splitlines() if l.strip() and not l.strip().startswith("--"))
+            print(f"      {first_line}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="migrations/ のスキーマ変更を番号順に適用する")
+    parser.add_argument("--status", action="store_true", help="適用済み・未適用の一覧を表示する")
+    parser.add_argument("--dry-run", action="store_true", help="適用予定のマイグレーションを表示するだけで、実行しない")
+    args = parser.parse_args()
+
+    print(f"--- [ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ] マイグレーションを開始します ---")
+    db_url = get_db_url_from_secrets()
+    if not db_url: return 1
+    try:
+        migrations = load_migrations()
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    conn = psycopg2.connect(db_url, cursor_factory=DictCursor)
+    try:
+        if args.status:
+            print_status(conn, migrations)
+            return 0
+        if args.dry_run:
+            print_dry_run(conn, migrations)
+            return 0
+        applied = migrate(conn, migrations)
+    except psycopg2.Error:
+        return 1
+    finally:
+        conn.close()
+    print(f"✅ マイグレーション完了（{applied}件を適用）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
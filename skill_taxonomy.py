@@ -0,0 +1,81 @@
+# ==============================================================================
+# skill_taxonomy.py
+# ==============================================================================
+# スキル辞書（migrations/008_skill_taxonomy.sql）で正規化したスキルIDを使って、
+# 案件と技術者のスキルの重なりをまとめて数える。
+#   jobs.skill_ids / engineers.skill_ids                    キーワードを辞書で引いたスキルID（昇順）
+#   jobs.skill_ancestor_ids / engineers.skill_ancestor_ids  その親・祖先のスキルID（昇順、migrations/014）
+# 正規化とIDの付与はデータベース側（resolve_skill_ids とトリガー）で行うため、ここでは読むだけ。
+# 一方のスキルが他方のスキルそのもの、またはその親・祖先であれば一致とし、一致したスキル（より一般的な方）を1回ずつ数える。
+# 共通の親・祖先だけ（React と Vue.js の JavaScript など）は一致としない。
+# 重なりの数は、バッチに出てくるスキルだけに詰め直したビット集合（uint64 の配列）の AND / OR を
+# np.bitwise_count で数える。案件 × 技術者の組を一度に計算するので、数千件の組でも Python のループを回さない。
+# ==============================================================================
+
+import re
+import unicodedata
+import numpy as np
+
+# 一度に作る (案件数 × 技術者数 × ワード数) の中間配列の上限（バイト）
+_CHUNK_BYTES = 64 * 1024 * 1024
+
+_KEY_SEPARATORS = re.compile(r'[\s._\-・]+')
+
+
+def normalize_skill_key(value: str) -> str:
+    """表記ゆれを吸収した別名のキー（SQL の skill_key と同じ規則）。"Spring Boot" → "springboot"、"Node.js" → "nodejs"。"""
+    if not value: return ""
+    return _KEY_SEPARATORS.sub("", unicodedata.normalize("NFKC", value).lower())
+
+
+def build_bitsets(skill_id_lists, shared: np.ndarray) -> np.ndarray:
+    """
+    スキルIDの配列のリストを、(件数, ワード数) の uint64 のビット集合にする。
+    shared（昇順のスキルID）の i 番目のスキルを i 番目のビットに割り当て、shared に無いIDは無視する。
+    """
+    words = max(1, (len(shared) + 63) // 64)
+    bitsets = np.zeros((len(skill_id_lists), words), dtype=np.uint64)
+    lengths = np.fromiter((len(ids) if ids else 0 for ids in skill_id_lists), dtype=np.int64, count=len(skill_id_lists))
+    if not lengths.sum() or not len(shared): return bitsets
+
+    flat = np.fromiter((skill_id for ids in skill_id_lists if ids for skill_id in ids), dtype=np.int64, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(skill_id_lists)), lengths)
+    columns = np.minimum(np.searchsorted(shared, flat), len(shared) - 1)
+    known = shared[columns] == flat
+    rows, columns = rows[known], columns[known].astype(np.uint64)
+    np.bitwise_or.at(bitsets, (rows, (columns >> np.uint64(6)).astype(np.int64)), np.uint64(1) << (columns & np.uint64(63)))
+    return bitsets
+
+
+def _with_ancestors(skill_id_lists, ancestor_id_lists) -> list:
+    """スキルIDと親・祖先のIDを合わせた配列のリスト（ancestor_id_lists が None なら skill_id_lists のまま）。"""
+    if ancestor_id_lists is None: return [ids or [] for ids in skill_id_lists]
+    return [list(ids or ()) + list(ancestors or ()) for ids, ancestors in zip(skill_id_lists, ancestor_id_lists)]
+
+
+def overlap_matrix(job_skill_ids, engineer_skill_ids, job_ancestor_ids=None, engineer_ancestor_ids=None) -> np.ndarray:
+    """
+    案件ごと・技術者ごとのスキルIDの配列（と、その親・祖先のIDの配列）から、一致したスキルの数の行列
+    （案件数 × 技術者数、int32）を返す。一致したスキルの集合は
+        (案件のスキル ∩ 技術者のスキルと祖先) ∪ (技術者のスキル ∩ 案件のスキルと祖先)
+    で、一方のスキルが他方のスキルか祖先であるときのより一般的な方を、1回ずつ数えたものになる。
+    ビット位置は、両方（祖先を含む）に出てくるスキルだけに詰めて割り当てる（片方にしか無いスキルは一致に影響しない）。
+    """
+    job_closure = _with_ancestors(job_skill_ids, job_ancestor_ids)
+    engineer_closure = _with_ancestors(engineer_skill_ids, engineer_ancestor_ids)
+    job_skills = set().union(*map(set, filter(None, job_closure)))
+    engineer_skills = set().union(*map(set, filter(None, engineer_closure)))
+    shared = sorted(job_skills & engineer_skills)
+    scores = np.zeros((len(job_skill_ids), len(engineer_skill_ids)), dtype=np.int32)
+    if not shared: return scores
+
+    shared = np.asarray(shared, dtype=np.int64)
+    job_bits, job_closure_bits = build_bitsets(job_skill_ids, shared), build_bitsets(job_closure, shared)
+    engineer_bits, engineer_closure_bits = build_bitsets(engineer_skill_ids, shared), build_bitsets(engineer_closure, shared)
+    # 中間配列は AND の2つ分を同時に持つため、1回に扱う行数をその分減らす
+    rows_per_chunk = max(1, _CHUNK_BYTES // max(1, 2 * engineer_bits.nbytes))
+    for start in range(0, len(job_bits), rows_per_chunk):
+        stop = start + rows_per_chunk
+        chunk = (job_bits[start:stop, None, :] & engineer_closure_bits[None, :, :]) | (job_closure_bits[start:stop, None, :] & engineer_bits[None, :, :])
+        scores[start:stop] = np.bitwise_count(chunk).sum(axis=2, dtype=np.int32)
+    return scores
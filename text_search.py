@@ -0,0 +1,68 @@
+# ==============================================================================
+# text_search.py
+# ==============================================================================
+# 管理画面（技術者管理・案件管理）とダッシュボードのキーワード検索。
+# jobs / engineers の search_text 列（migrations/003_search_text.sql のトリガーで更新）を
+# pg_trgm の GIN インデックスで部分一致検索する SQL 断片と、関連度の式を組み立てる。
+# キーワードは search_text と同じ規則（NFKC・小文字化・空白の連続を1つに）で正規化してから LIKE に渡す。
+# 2文字以下のキーワードは trigram で絞り込めないため、インデックス全体を読む（結果は正しい）。
+# ==============================================================================
+
+import re
+import unicodedata
+
+_WS = re.compile(r'\s+')
+_LIKE_SPECIAL = re.compile(r'([\\%_])')
+
+
+def normalize_search_text(text: str) -> str:
+    """SQL の search_normalize() と同じ正規化。"""
+    if not text: return ""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text).lower()).strip()
+
+def split_keywords(keyword: str) -> list:
+    """空白区切りのキーワードを正規化して重複を除く（入力順は保つ）。"""
+    keywords = []
+    for kw in normalize_search_text(keyword).split(" "):
+        if kw and kw not in keywords: keywords.append(kw)
+    return keywords
+
+def like_pattern(keyword: str) -> str:
+    """部分一致の LIKE パターン。キーワード中の % _ \\ は文字として扱う。"""
+    escaped = _LIKE_SPECIAL.sub(r'\\\1', keyword)
+    return f"%{escaped}%"
+
+
+def keyword_filter_clause(alias: str, keywords: list) -> tuple:
+    """すべてのキーワードを含む行に絞り込む WHERE 句の断片とパラメータ。"""
+    clause = " AND ".join(f"{alias}.search_text LIKE %s" for _ in keywords)
+    return f"({clause})", [like_pattern(kw) for kw in keywords]
+
+def relevance_expression(alias: str, name_column: str, keywords: list) -> tuple:
+    """
+    関連度の式とパラメータ。キーワードごとに、名前（案件名・氏名）に含まれていれば 1、
+    さらに本文を含む search_text との単語類似度（0〜1）を足す。絞り込み後の行だけで計算される。
+    """
+    parts, params = [], []
+    for kw in keywords:
+        parts.append(f"(CASE WHEN search_normalize({alias}.{name_column}) LIKE %s THEN 1.0 ELSE 0.0 END + word_similarity(%s, {alias}.search_text))")
+        params.extend([like_pattern(kw), kw])
+    return " + ".join(parts), params
+
+
+def matching_results_keyword_clause(alias: str, keyword: str, status_options: list) -> tuple:
+    """
+    ダッシュボードのマッチング結果を、案件・技術者の search_text とステータス名で絞り込む WHERE 句の断片。
+    案件・技術者ごとに GIN インデックスで絞った ID から matching_results を引くため、結果の全件を走査しない。
+    """
+    normalized = normalize_search_text(keyword)
+    pattern = like_pattern(normalized)
+    statuses = [s for s in status_options if normalized in normalize_search_text(s)]
+    clause = f"""{alias}.id IN (
+            SELECT m.id FROM matching_results m WHERE m.job_id IN (SELECT id FROM jobs WHERE search_text LIKE %s)
+            UNION
+            SELECT m.id FROM matching_results m WHERE m.engineer_id IN (SELECT id FROM engineers WHERE search_text LIKE %s)
+            UNION
+            SELECT m.id FROM matching_results m WHERE m.status = ANY(%s)
+        )"""
+    return clause, [pattern, pattern, statuses]
@@ -194,3 +194,74 @@ def logout():
     st.success("ログアウトしました。")
     st.rerun()
 
+
+
+# ==============================================================================
+# 再マッチングのタスクの進捗表示
+# ==============================================================================
+# 再マッチングは run_matching_worker.py が実行する。画面はタスクIDを session_state に覚えておき、
+# 進捗（jobs_queue_progress）を数秒ごとに読んで表示するだけなので、タブを閉じても処理は続く。
+
+_TASK_STATUS_LABELS = {
+    'queued': "⏳ 実行待ち（ワーカーの空きを待っています）",
+    'running': "🔄 AIマッチングを実行中...",
+    'succeeded': "処理が正常に完了しました！",
+    'failed': "処理が完了しませんでした。",
+    'cancelled': "キャンセルしました。",
+}
+
+def _task_log(task_id: int) -> list:
+    """これまでに読んだ進捗のメッセージ。前回の続きからだけを読み足す。"""
+    import backend as be  # このモジュールはリリースノートなど backend を使わない画面からも読み込まれる
+    cache = st.session_state.setdefault(f"matching_task_log_{task_id}", {"last_id": 0, "messages": []})
+    for row in be.get_matching_task_progress(task_id, cache["last_id"]):
+        cache["messages"].append(row['message'])
+        cache["last_id"] = row['id']
+    return cache["messages"]
+
+@st.fragment(run_every=2)
+def _poll_matching_task(task_id: int):
+    import backend as be
+    task = be.get_matching_task(task_id)
+    if task is None or task['status'] not in ('queued', 'running'):
+        # 終わったら画面全体を更新して、マッチング結果の一覧に反映する
+        st.rerun()
+    messages = _task_log(task_id)
+    with st.status(_TASK_STATUS_LABELS[task['status']], expanded=True, state="running"):
+        if task['attempts'] > 1:
+            st.caption(f"{task['attempts']}回目の実行です（前回のエラー: {task['last_error'] or '不明'}）")
+        for message in messages:
+            st.markdown(message, unsafe_allow_html=True)
+    if task['cancel_requested']:
+        st.info("キャンセルを依頼しました。実行中の評価が終わりしだい中断します。")
+    elif st.button("⏹️ 処理をキャンセルする", key=f"cancel_matching_task_{task_id}"):
+        be.cancel_matching_task(task_id)
+        st.rerun(scope="fragment")
+
+def render_matching_task(task_id: int, state_key: str):
+    """
+    state_key（session_state のキー）に覚えているタスクの進捗を表示する。
+    実行中は数秒ごとに表示を更新し、終わったら結果とログを表示して「閉じる」で state_key を消す。
+    """
+    import backend as be
+    task = be.get_matching_task(task_id)
+    if task is None:
+        st.session_state.pop(state_key, None)
+        return
+    if task['status'] in ('queued', 'running'):
+        _poll_matching_task(task_id)
+        return
+
+    messages = _task_log(task_id)
+    state = "complete" if task['status'] == 'succeeded' else "error"
+    with st.status(_TASK_STATUS_LABELS[task['status']], expanded=task['status'] == 'failed', state=state):
+        for message in messages:
+            st.markdown(message, unsafe_allow_html=True)
+    if task['status'] == 'succeeded':
+        st.success("AIマッチングが完了しました。")
+    elif task['status'] == 'failed':
+        st.error("処理が完了しませんでした。上記のログを確認してください。")
+    if st.button("閉じる", key=f"close_matching_task_{task_id}"):
+        st.session_state.pop(state_key, None)
+        st.session_state.pop(f"matching_task_log_{task_id}", None)
+        st.rerun()